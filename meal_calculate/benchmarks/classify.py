@@ -0,0 +1,60 @@
+"""カテゴリ名・メニュー名の分類処理 (`classify_item` など) を計測するケース。
+
+1ケースはメニュー1件分ではなく、名前の一覧全体を1回処理する時間。
+"""
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, List, Optional
+
+from meal_calculator import (
+    DEFAULT_CATEGORY_LABELS,
+    _extract_items_from_html,
+    canonical_category,
+    classify_item,
+    infer_category_from_name,
+)
+
+from .harness import Case
+from .solver import synthetic_menu
+
+if TYPE_CHECKING:
+    from menu_replay import MenuCorpus
+
+SYNTHETIC_SIZE = 500
+
+
+def _names(corpus: Optional["MenuCorpus"]) -> List[tuple[str, Optional[str]]]:
+    """(メニュー名, カテゴリ) の一覧。コーパスがあれば記録したページの全メニューを使う。"""
+
+    if corpus is not None:
+        items = [
+            item
+            for url, page, fragments in corpus.pages()
+            for item in _extract_items_from_html(page, url, fetch_fragments=False, captured=dict(fragments))
+        ]
+        if items:
+            return [(item.name, item.category) for item in items]
+    return [(row.name, row.category) for row in synthetic_menu(SYNTHETIC_SIZE)]
+
+
+def cases(*, quick: bool = False, corpus: Optional["MenuCorpus"] = None, solver: str = "auto") -> List[Case]:
+    names = _names(corpus)
+    labels = list(DEFAULT_CATEGORY_LABELS.values()) + [category for _, category in names if category]
+
+    def classify() -> None:
+        for name, category in names:
+            classify_item(name, category)
+
+    def infer() -> None:
+        for name, _ in names:
+            infer_category_from_name(name)
+
+    def canonical() -> None:
+        for label in labels:
+            canonical_category(label)
+
+    return [
+        (f"classify.classify_item.x{len(names)}", classify),
+        (f"classify.infer_category_from_name.x{len(names)}", infer),
+        (f"classify.canonical_category.x{len(labels)}", canonical),
+    ]
@@ -0,0 +1,39 @@
+"""記録済みのメニューページ (`menu_replay` のコーパス) を `_extract_items_from_html` で解析するケース。
+
+コーパスがなければ `parse_menu.synthetic_page` の合成ページを用いる。
+"""
+from __future__ import annotations
+
+import urllib.parse
+from typing import TYPE_CHECKING, List, Optional
+
+from meal_calculator import MENU_URL, _extract_items_from_html
+
+from .harness import Case
+from .parse_menu import synthetic_page
+
+if TYPE_CHECKING:
+    from menu_replay import MenuCorpus
+
+
+def _page_label(url: str) -> str:
+    query = urllib.parse.parse_qs(urllib.parse.urlsplit(url).query)
+    return query.get("t", [url])[0]
+
+
+def cases(*, quick: bool = False, corpus: Optional["MenuCorpus"] = None, solver: str = "auto") -> List[Case]:
+    if corpus is None:
+        pages = [("synthetic", MENU_URL, synthetic_page(), {})]
+    else:
+        pages = [(_page_label(url), url, page, dict(fragments)) for url, page, fragments in corpus.pages()]
+        if quick:
+            pages = pages[:1]
+    return [
+        (
+            f"extract.{label}",
+            lambda page=page, url=url, captured=captured: _extract_items_from_html(
+                page, url, fetch_fragments=False, captured=captured
+            ),
+        )
+        for label, url, page, captured in pages
+    ]
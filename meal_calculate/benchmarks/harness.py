@@ -0,0 +1,137 @@
+"""ベンチマークの計測・結果の保存・基準値との比較を行う共通処理。"""
+from __future__ import annotations
+
+import dataclasses
+import json
+import platform
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+RESULTS_FORMAT = 1
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "baseline.json"
+DEFAULT_THRESHOLD = 0.2
+
+# (ケース名, 計測する関数) の組
+Case = Tuple[str, Callable[[], Any]]
+
+
+@dataclasses.dataclass(frozen=True)
+class Measurement:
+    """1ケースの計測結果。時間はいずれも1回あたりの秒数。"""
+
+    name: str
+    median: float
+    best: float
+    repeat: int
+    number: int
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"median_s": self.median, "min_s": self.best, "repeat": self.repeat, "number": self.number}
+
+
+def measure(name: str, func: Callable[[], Any], *, repeat: int = 5, min_time: float = 0.05) -> Measurement:
+    """1回の計測が `min_time` 秒以上になるよう呼び出し回数を決め、`repeat` 回計測する。"""
+
+    func()  # 初回のみの準備 (遅延import、キャッシュの作成など) を計測から除く
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or number >= 1 << 20:
+            break
+        number *= 2 if elapsed <= 0 else max(2, min(10, int(min_time / elapsed) + 1))
+    samples = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        samples.append((time.perf_counter() - start) / number)
+    return Measurement(name, statistics.median(samples), min(samples), repeat, number)
+
+
+def run_cases(
+    cases: Iterable[Case],
+    *,
+    repeat: int = 5,
+    min_time: float = 0.05,
+    on_result: Optional[Callable[[Measurement], None]] = None,
+) -> List[Measurement]:
+    results = []
+    for name, func in cases:
+        result = measure(name, func, repeat=repeat, min_time=min_time)
+        if on_result is not None:
+            on_result(result)
+        results.append(result)
+    return results
+
+
+def write_results(path: Path | str, results: Iterable[Measurement], **metadata: Any) -> None:
+    """計測結果を `load_results` で読めるJSONとして保存する。"""
+
+    try:
+        import numpy
+
+        numpy_version: Optional[str] = numpy.__version__
+    except ImportError:  # pragma: no cover - 依存ライブラリがない環境
+        numpy_version = None
+    payload = {
+        "format": RESULTS_FORMAT,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": numpy_version,
+        **metadata,
+        "results": {result.name: result.to_dict() for result in results},
+    }
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    Path(path).write_text(json.dumps(payload, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+
+
+def load_results(path: Path | str) -> Dict[str, Any]:
+    data = json.loads(Path(path).read_text(encoding="utf-8"))
+    if data.get("format") != RESULTS_FORMAT:
+        raise SystemExit(f"対応していない結果ファイルの形式です (format={data.get('format')}): {path}")
+    return data
+
+
+@dataclasses.dataclass(frozen=True)
+class Comparison:
+    name: str
+    baseline: float
+    current: float
+
+    @property
+    def ratio(self) -> float:
+        return self.current / self.baseline if self.baseline > 0 else float("inf")
+
+
+def compare(
+    results: Iterable[Measurement], baseline: Dict[str, Any], threshold: float = DEFAULT_THRESHOLD
+) -> Tuple[List[Comparison], List[Comparison]]:
+    """基準値にあるケースを中央値で比較し、(全比較, `1 + threshold` 倍を超えて遅くなったもの) を返す。"""
+
+    recorded = baseline.get("results", {})
+    comparisons = [
+        Comparison(result.name, recorded[result.name]["median_s"], result.median)
+        for result in results
+        if result.name in recorded
+    ]
+    return comparisons, [entry for entry in comparisons if entry.ratio > 1 + threshold]
+
+
+def format_seconds(seconds: float) -> str:
+    if seconds >= 1:
+        return f"{seconds:.3f}s"
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.3f}ms"
+    return f"{seconds * 1e6:.1f}us"
+
+
+def print_measurement(result: Measurement) -> None:
+    print(f"{result.name:<48} {format_seconds(result.median):>10} (min {format_seconds(result.best)}, ×{result.number})")
+    sys.stdout.flush()
@@ -0,0 +1,75 @@
+"""記録済みメニューページの解析時間を1KBあたりで計測する。
+
+使い方:
+    python -m benchmarks.parse_menu [HTMLファイルまたはディレクトリ ...]
+
+ファイルを指定しない場合は、実ページに近い構造の合成ページを用いる。
+"""
+from __future__ import annotations
+
+import argparse
+import statistics
+import time
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+
+from meal_calculator import _parse_menu
+
+
+def synthetic_page(categories: int = 8, items_per_category: int = 12) -> str:
+    """toggleTitle と catMenu を持つ合成メニューページを生成する。"""
+
+    parts = ['<html><body><div id="menu">']
+    for category in range(categories):
+        toggle_id = f"on_{chr(ord('a') + category)}"
+        parts.append(f'<p class="toggleTitle" id="{toggle_id}">カテゴリ{category}</p>')
+        parts.append('<div class="catMenu"><ul>')
+        for index in range(items_per_category):
+            parts.append(
+                f'<li class="menu-item"><a href="detail.php?c={category}&amp;i={index}">'
+                f'<span class="menu-name">メニュー{category}-{index}</span>'
+                f'<span class="menu-price">{300 + index * 10}円</span></a></li>'
+            )
+        parts.append("</ul></div>")
+    parts.append("</div></body></html>")
+    return "".join(parts)
+
+
+def _collect_pages(paths: Sequence[str]) -> List[Tuple[str, str]]:
+    pages: List[Tuple[str, str]] = []
+    for raw in paths:
+        path = Path(raw)
+        files = sorted(path.rglob("*.html")) if path.is_dir() else [path]
+        for file in files:
+            pages.append((str(file), file.read_text(encoding="utf-8")))
+    return pages
+
+
+def measure(html_content: str, repeat: int) -> float:
+    """`_parse_menu` の1回あたりの所要時間 (秒) の中央値を返す。"""
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        _parse_menu(html_content, [])
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="メニューHTMLの解析時間を計測します。")
+    parser.add_argument("pages", nargs="*", help="記録済みHTMLファイル、またはそれを含むディレクトリ")
+    parser.add_argument("--repeat", type=int, default=20, help="1ページあたりの計測回数")
+    args = parser.parse_args(argv)
+
+    pages = _collect_pages(args.pages) if args.pages else [("synthetic", synthetic_page())]
+    for label, html_content in pages:
+        size_kb = len(html_content.encode("utf-8")) / 1024
+        seconds = measure(html_content, args.repeat)
+        per_kb = seconds * 1000 / size_kb if size_kb else 0.0
+        print(f"{label}: {size_kb:.1f}KB {seconds * 1000:.2f}ms ({per_kb:.3f}ms/KB)")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,80 @@
+"""Djangoのテストクライアントで `views.index` を呼び出し、リクエスト全体の処理時間を計測するケース。
+
+メニューの取得 (`fetch_menu`) は固定のメニューを返す関数に差し替える。コーパスがあれば最初のページの
+解析結果を、なければ合成メニューを返す。キャッシュはプロセス内 (locmem) を使い、計算結果のLRUは無効にして
+予算ごとの最適解 (frontier) と探索の経路をそのまま通す。
+"""
+from __future__ import annotations
+
+import os
+from typing import TYPE_CHECKING, List, Optional
+from unittest import mock
+
+from meal_calculator import MenuTable, _extract_items_from_html
+
+from .harness import Case
+from .solver import synthetic_menu
+
+if TYPE_CHECKING:
+    from menu_replay import MenuCorpus
+
+SYNTHETIC_SIZE = 80
+
+
+def _menu(corpus: Optional["MenuCorpus"]) -> MenuTable:
+    if corpus is not None:
+        for url, page, fragments in corpus.pages():
+            items = _extract_items_from_html(page, url, fetch_fragments=False, captured=dict(fragments))
+            if items:
+                return MenuTable.from_items(items)
+    return synthetic_menu(SYNTHETIC_SIZE)
+
+
+def _setup_django() -> None:
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "meal_project.settings")
+    os.environ.update(
+        {
+            "MENU_CACHE_BACKEND": "locmem",
+            "MENU_RESULT_CACHE_SIZE": "0",
+            "MEAL_ASYNC_VIEWS": "0",
+            "MEAL_TIMINGS_LOG_LEVEL": "WARNING",
+        }
+    )
+    import django
+
+    django.setup()
+
+
+def cases(*, quick: bool = False, corpus: Optional["MenuCorpus"] = None, solver: str = "auto") -> List[Case]:
+    _setup_django()
+    from django.test import Client
+
+    from calculator.cafeterias import CAFETERIAS
+    from calculator.menu_cache import get_menu_cache
+
+    menu = _menu(corpus)
+    # 計測の間だけでなくプロセスの終了まで差し替えたままにする
+    mock.patch("calculator.menu_cache.fetch_menu", lambda url, **kwargs: menu).start()
+    client = Client()
+    cache = get_menu_cache()
+    cafeteria_id = CAFETERIAS[0].identifier
+
+    def post(budget: int, output_format: str = "text") -> None:
+        response = client.post("/", {"budget": budget, "cafeteria": cafeteria_id, "output_format": output_format})
+        if response.status_code != 200:
+            raise RuntimeError(f"views.index が {response.status_code} を返しました")
+
+    def cold() -> None:
+        cache.invalidate(cafeteria_id)
+        post(1000)
+
+    result: List[Case] = [
+        ("view.index.get", lambda: client.get("/")),
+        ("view.index.cold.b1000", cold),
+        ("view.index.warm.b1000", lambda: post(1000)),
+        ("view.index.warm.b1000.json", lambda: post(1000, "json")),
+    ]
+    if not quick:
+        # frontierの上限を超える予算は探索 (大きければソルバーのプロセスプール) を通る
+        result.append(("view.index.warm.b5000", lambda: post(5000)))
+    return result
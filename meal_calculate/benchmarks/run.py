@@ -0,0 +1,106 @@
+"""ベンチマークを実行し、結果をJSONに書き出して基準値と比較する。
+
+使い方:
+    python -m benchmarks.run [--suite solver --suite extract ...] [--quick] [--output PATH]
+    python -m benchmarks.run --save-baseline          # 結果を基準値として保存
+    python -m benchmarks.run --threshold 0.1          # 基準値より10%を超えて遅いケースがあれば終了コード1
+
+対象は solver (best_combination)、extract (記録済みページの解析)、classify (分類処理)、
+request (views.index 全体)。記録済みのページは `menu_replay.py` のコーパスから読み込む。
+"""
+from __future__ import annotations
+
+import argparse
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional, Sequence
+
+from meal_calculator import SOLVERS
+
+from . import classify, extract, harness, request, solver
+
+if TYPE_CHECKING:
+    from menu_replay import MenuCorpus
+
+SUITES = {
+    "solver": solver.cases,
+    "extract": extract.cases,
+    "classify": classify.cases,
+    "request": request.cases,
+}
+
+
+def _load_corpus(path: Optional[str]) -> Optional["MenuCorpus"]:
+    from menu_replay import DEFAULT_CORPUS_DIR, load_corpus
+
+    if path is None and not any(DEFAULT_CORPUS_DIR.glob("*/manifest.json")):
+        return None
+    return load_corpus(path or DEFAULT_CORPUS_DIR)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="探索・解析・リクエスト処理のベンチマークを実行します。")
+    parser.add_argument("--suite", action="append", choices=sorted(SUITES), help="実行する対象 (デフォルトは全て)")
+    parser.add_argument("--quick", action="store_true", help="ケースを減らして短時間で実行します")
+    parser.add_argument("--repeat", type=int, default=5, help="ケースごとの計測回数 (中央値を採用)")
+    parser.add_argument("--min-time", type=float, default=0.05, help="1回の計測の最短秒数")
+    parser.add_argument("--solver", choices=SOLVERS, default="auto", help="solver で使う探索エンジン")
+    parser.add_argument(
+        "--corpus",
+        help="記録済みページの保存先または版ディレクトリ (デフォルト: benchmarks/corpus があれば最新の版)",
+    )
+    parser.add_argument("--output", default="bench_results.json", help="結果を書き出すJSONファイル")
+    parser.add_argument("--baseline", default=str(harness.DEFAULT_BASELINE), help="比較する基準値のJSONファイル")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=harness.DEFAULT_THRESHOLD,
+        help=f"基準値の中央値からこの割合を超えて遅くなったケースを劣化とみなします (デフォルト: {harness.DEFAULT_THRESHOLD:g})",
+    )
+    parser.add_argument("--save-baseline", action="store_true", help="結果を --baseline に保存し、比較は行いません")
+    args = parser.parse_args(argv)
+
+    corpus = _load_corpus(args.corpus)
+    suites = args.suite or list(SUITES)
+    print(f"コーパス: {corpus.directory if corpus is not None else '(なし、合成データを使用)'}")
+    results = []
+    for suite in suites:
+        cases = SUITES[suite](quick=args.quick, corpus=corpus, solver=args.solver)
+        results.extend(
+            harness.run_cases(
+                cases, repeat=args.repeat, min_time=args.min_time, on_result=harness.print_measurement
+            )
+        )
+
+    metadata = {
+        "suites": suites,
+        "quick": args.quick,
+        "solver": args.solver,
+        "corpus": str(corpus.directory) if corpus is not None else None,
+    }
+    if args.save_baseline:
+        harness.write_results(args.baseline, results, **metadata)
+        print(f"基準値を保存しました: {args.baseline}")
+        return 0
+    harness.write_results(args.output, results, **metadata)
+    print(f"結果を書き出しました: {args.output}")
+
+    if not Path(args.baseline).exists():
+        print(f"基準値がないため比較を省略します: {args.baseline}")
+        return 0
+    comparisons, regressions = harness.compare(results, harness.load_results(args.baseline), args.threshold)
+    print()
+    print(f"基準値との比較 ({len(comparisons)}ケース、しきい値 +{args.threshold:.0%}):")
+    for entry in comparisons:
+        mark = "  劣化" if entry in regressions else ""
+        print(
+            f"{entry.name:<48} {harness.format_seconds(entry.baseline):>10} -> "
+            f"{harness.format_seconds(entry.current):>10} ({entry.ratio - 1:+.1%}){mark}"
+        )
+    if regressions:
+        print(f"{len(regressions)}ケースが基準値より遅くなりました。")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
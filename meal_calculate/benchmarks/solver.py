@@ -0,0 +1,67 @@
+"""`best_combination` をメニュー件数・予算・`limit_primary` の組み合わせごとに計測するケース。"""
+from __future__ import annotations
+
+import random
+from typing import TYPE_CHECKING, List, Optional
+
+from meal_calculator import (
+    CURRY_DON_KEYWORDS,
+    DEFAULT_CATEGORY_LABELS,
+    MAIN_DISH_KEYWORDS,
+    NOODLE_KEYWORDS,
+    RICE_KEYWORDS,
+    SIDE_DISH_KEYWORDS,
+    MenuItem,
+    MenuTable,
+    best_combination,
+)
+
+from .harness import Case
+
+if TYPE_CHECKING:
+    from menu_replay import MenuCorpus
+
+SIZES = (10, 50, 100, 250, 500)
+BUDGETS = (100, 1000, 3000, 10000)
+QUICK_SIZES = (10, 100, 500)
+QUICK_BUDGETS = (100, 1000, 10000)
+
+# 名前のキーワードとカテゴリの組。実際のメニューと同様に、カテゴリなしの品も混ぜる
+_KINDS = [
+    (MAIN_DISH_KEYWORDS, DEFAULT_CATEGORY_LABELS["on_a"]),
+    (SIDE_DISH_KEYWORDS, DEFAULT_CATEGORY_LABELS["on_b"]),
+    (NOODLE_KEYWORDS, DEFAULT_CATEGORY_LABELS["on_c"]),
+    (CURRY_DON_KEYWORDS, DEFAULT_CATEGORY_LABELS["on_d"]),
+    (RICE_KEYWORDS, DEFAULT_CATEGORY_LABELS["on_bunrui3"]),
+    (SIDE_DISH_KEYWORDS, None),
+]
+
+
+def synthetic_menu(size: int, seed: int = 0) -> MenuTable:
+    """主菜・副菜・麺類・丼・ライスを含む、再現可能な合成メニューを `size` 品生成する。"""
+
+    rng = random.Random(seed)
+    items = []
+    for index in range(size):
+        keywords, category = rng.choice(_KINDS)
+        price = rng.randrange(6, 40) * 5 if keywords is SIDE_DISH_KEYWORDS else rng.randrange(22, 140) * 5
+        items.append(MenuItem(f"{rng.choice(keywords)}{index}", price, category))
+    return MenuTable.from_items(items)
+
+
+def cases(*, quick: bool = False, corpus: Optional["MenuCorpus"] = None, solver: str = "auto") -> List[Case]:
+    result: List[Case] = []
+    for size in QUICK_SIZES if quick else SIZES:
+        menu = synthetic_menu(size)
+        for budget in QUICK_BUDGETS if quick else BUDGETS:
+            for limit_primary in (False, True):
+                mode = "limited" if limit_primary else "unrestricted"
+                result.append(
+                    (
+                        f"solver.{mode}.n{size}.b{budget}",
+                        lambda menu=menu, budget=budget, limit_primary=limit_primary: best_combination(
+                            menu, budget, limit_primary, solver=solver
+                        ),
+                    )
+                )
+    return result
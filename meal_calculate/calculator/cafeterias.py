@@ -6,6 +6,8 @@ from dataclasses import dataclass
 from pathlib import Path
 from typing import Iterable, List, Tuple
 
+from django.conf import settings
+
 
 _DATA_FILE = Path(__file__).resolve().parent / "cafeterias.json"
 _MENU_BASE_URL = "https://west2-univ.jp/sp/menu.php?t={id}"
@@ -29,7 +31,19 @@ class Cafeteria:
 
     @property
     def menu_url(self) -> str:
-        return _MENU_BASE_URL.format(id=self.identifier)
+        return _menu_url(self.identifier)
+
+
+def _menu_url(identifier: str) -> str:
+    """食堂のメニューURL。`MEAL_MENU_ORIGIN` があればそのホスト (記録の再生サーバーなど) に向ける。"""
+
+    url = _MENU_BASE_URL.format(id=identifier)
+    origin = getattr(settings, "MEAL_MENU_ORIGIN", None)
+    if origin:
+        from menu_replay import rebase_url
+
+        url = rebase_url(url, origin)
+    return url
 
 
 def _load_from_file() -> List[Cafeteria]:
@@ -78,4 +92,4 @@ def cafeteria_url(identifier: str) -> str:
     for caf in CAFETERIAS:
         if caf.identifier == identifier:
             return caf.menu_url
-    return _MENU_BASE_URL.format(id=identifier)
+    return _menu_url(identifier)
@@ -0,0 +1,286 @@
+"""同一食堂への同時スクレイピングを1回にまとめる (single-flight) ユーティリティ。"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import hashlib
+import tempfile
+import threading
+import weakref
+from pathlib import Path
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterator, Optional, TypeVar
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from . import metrics
+
+
+T = TypeVar("T")
+
+# async版のロック待ちで、空くまで再試行する間隔 (秒、待つごとに倍、上限あり)
+LOCK_POLL_INTERVAL = 0.05
+LOCK_POLL_MAX_INTERVAL = 0.5
+
+
+class _Call:
+    """実行中の取得処理1件分の状態。"""
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: object = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """同じキーに対する同時呼び出しを1回の実行に集約する。
+
+    実行回数・待ち合わせ回数は `stats()` のほか、`name` をラベルにしてメトリクスにも記録する。
+    """
+
+    def __init__(self, name: str = "sync") -> None:
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self._executions = 0
+        self._coalesced = 0
+
+    def do(self, key: str, func: Callable[[], T]) -> T:
+        """`func` を実行する。実行中の同一キーがあればその結果を待って共有する。"""
+
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self._coalesced += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self._executions += 1
+                leader = True
+        metrics.flight_started(self.name, coalesced=not leader)
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result  # type: ignore[return-value]
+
+        try:
+            call.result = func()
+        except BaseException as exc:  # SystemExitも待機側へ伝播させる
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+            metrics.flight_finished(self.name)
+        return call.result  # type: ignore[return-value]
+
+    def stats(self) -> dict[str, int]:
+        """実行回数・待ち合わせで省略できた回数・実行中の件数を返す。"""
+
+        with self._lock:
+            return {
+                "executions": self._executions,
+                "coalesced": self._coalesced,
+                "in_flight": len(self._calls),
+            }
+
+
+class AsyncSingleFlight:
+    """`SingleFlight` のasyncio版。実行中の同一キーがあれば、そのタスクの完了を待って結果を共有する。
+
+    待ち合わせはイベントループごとに行う。
+    """
+
+    def __init__(self, name: str = "async") -> None:
+        self.name = name
+        self._calls: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Future]]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._lock = threading.Lock()
+        self._executions = 0
+        self._coalesced = 0
+
+    async def do(self, key: str, func: Callable[[], Awaitable[T]]) -> T:
+        """`await func()` を実行する。実行中の同一キーがあればその結果を待って共有する。"""
+
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            calls = self._calls.setdefault(loop, {})
+            future = calls.get(key)
+            if future is not None:
+                self._coalesced += 1
+                leader = False
+            else:
+                future = calls[key] = loop.create_future()
+                self._executions += 1
+                leader = True
+        metrics.flight_started(self.name, coalesced=not leader)
+
+        if not leader:
+            # shieldで包み、待機側のキャンセルが実行中の取得に波及しないようにする
+            return await asyncio.shield(future)
+
+        try:
+            result = await func()
+        except BaseException as exc:  # SystemExitも待機側へ伝播させる
+            future.set_exception(exc)
+            # 待機者がいない場合に「取得されなかった例外」の警告を出さないようにする
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                calls.pop(key, None)
+            metrics.flight_finished(self.name)
+
+    def stats(self) -> dict[str, int]:
+        """実行回数・待ち合わせで省略できた回数・実行中の件数を返す。"""
+
+        with self._lock:
+            return {
+                "executions": self._executions,
+                "coalesced": self._coalesced,
+                "in_flight": sum(len(calls) for calls in self._calls.values()),
+            }
+
+
+def _lock_key(key: str) -> int:
+    """文字列キーをPostgreSQLのアドバイザリロック用の符号付き64bit整数に変換する。"""
+
+    digest = hashlib.sha1(key.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big", signed=True)
+
+
+def _lock_path(key: str, directory: Optional[str]) -> Path:
+    lock_dir = Path(directory) if directory else Path(tempfile.gettempdir()) / "meal_calculate" / "locks"
+    lock_dir.mkdir(parents=True, exist_ok=True)
+    return lock_dir / f"{hashlib.sha1(key.encode('utf-8')).hexdigest()}.lock"
+
+
+@contextlib.contextmanager
+def _file_lock(key: str, directory: Optional[str]) -> Iterator[None]:
+    import fcntl
+
+    with open(_lock_path(key, directory), "a+") as handle:
+        fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+
+
+@contextlib.asynccontextmanager
+async def _async_file_lock(key: str, directory: Optional[str]) -> AsyncIterator[None]:
+    import fcntl
+
+    with open(_lock_path(key, directory), "a+") as handle:
+        delay = LOCK_POLL_INTERVAL
+        while True:
+            try:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, LOCK_POLL_MAX_INTERVAL)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+
+
+@contextlib.contextmanager
+def _database_lock(key: str) -> Iterator[None]:
+    from django.db import connection
+
+    if connection.vendor != "postgresql":
+        # SQLiteなどアドバイザリロックを持たないDBではワーカー間ロックを行わない
+        yield
+        return
+    lock_id = _lock_key(key)
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_lock(%s)", [lock_id])
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_unlock(%s)", [lock_id])
+
+
+def _try_advisory_lock(lock_id: int) -> bool:
+    from django.db import connection
+
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_try_advisory_lock(%s)", [lock_id])
+        return bool(cursor.fetchone()[0])
+
+
+def _advisory_unlock(lock_id: int) -> None:
+    from django.db import connection
+
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_unlock(%s)", [lock_id])
+
+
+@contextlib.asynccontextmanager
+async def _async_database_lock(key: str) -> AsyncIterator[None]:
+    from django.db import connection
+
+    if connection.vendor != "postgresql":
+        yield
+        return
+    lock_id = _lock_key(key)
+    # アドバイザリロックは接続に紐づくため、取得と解放は同じ sync_to_async のスレッドで行う。
+    # 待つ間はそのスレッドを塞がないよう、pg_try_advisory_lock を間隔を空けて繰り返す
+    delay = LOCK_POLL_INTERVAL
+    while not await sync_to_async(_try_advisory_lock)(lock_id):
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, LOCK_POLL_MAX_INTERVAL)
+    try:
+        yield
+    finally:
+        await sync_to_async(_advisory_unlock)(lock_id)
+
+
+@contextlib.contextmanager
+def process_lock(key: str) -> Iterator[None]:
+    """設定 `MENU_FETCH_LOCK` に応じてワーカー間の排他ロックを取得する。"""
+
+    config = getattr(settings, "MENU_FETCH_LOCK", {})
+    backend = config.get("BACKEND", "none")
+    if backend == "file":
+        with _file_lock(key, config.get("DIRECTORY")):
+            yield
+    elif backend == "database":
+        with _database_lock(key):
+            yield
+    else:
+        yield
+
+
+@contextlib.asynccontextmanager
+async def async_process_lock(key: str) -> AsyncIterator[None]:
+    """`process_lock` のasyncio版。ロックが空くまでイベントループ上で待ち、スレッドを塞がない。"""
+
+    config = getattr(settings, "MENU_FETCH_LOCK", {})
+    backend = config.get("BACKEND", "none")
+    if backend == "file":
+        async with _async_file_lock(key, config.get("DIRECTORY")):
+            yield
+    elif backend == "database":
+        async with _async_database_lock(key):
+            yield
+    else:
+        yield
+
+
+menu_flight = SingleFlight()
+async_menu_flight = AsyncSingleFlight()
+
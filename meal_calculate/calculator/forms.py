@@ -35,3 +35,15 @@ class BudgetForm(forms.Form):
         self.fields["cafeteria"].choices = choices
         if choices and not self.data and not self.initial.get("cafeteria"):
             self.fields["cafeteria"].initial = choices[0][0]
+
+
+class FrontierForm(forms.Form):
+    """予算ごとの最適解APIのクエリパラメータ。"""
+
+    cafeteria = forms.ChoiceField(label="食堂", choices=())
+    limit_primary = forms.BooleanField(label="主菜系は1品まで", required=False)
+    max_budget = forms.IntegerField(label="上限金額 (円)", min_value=0, required=False)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields["cafeteria"].choices = cafeteria_choices()
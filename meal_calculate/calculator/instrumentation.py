@@ -0,0 +1,76 @@
+"""リクエストのフェーズごとの処理時間を `Server-Timing` ヘッダーと構造化ログに出力するユーティリティ。"""
+from __future__ import annotations
+
+import asyncio
+import functools
+import json
+import logging
+from typing import Any, Callable
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpRequest, HttpResponse
+
+from meal_calculator import Timings, record_timings
+
+from .profiling import is_staff_request
+
+logger = logging.getLogger("calculator.timings")
+
+
+def _server_timing_enabled() -> bool:
+    return getattr(settings, "MEAL_SERVER_TIMING", False)
+
+
+def _finish(
+    request: HttpRequest, response: HttpResponse, timings: Timings, view_name: str, *, staff: bool = False
+) -> None:
+    if _server_timing_enabled():
+        # 取得先の断片URLなど (desc) はスタッフにだけ返す
+        response["Server-Timing"] = timings.server_timing(details=staff)
+    if not logger.isEnabledFor(logging.INFO):
+        return
+    data = timings.to_dict()
+    record = {
+        "event": "request_timings",
+        "view": view_name,
+        "method": request.method,
+        "path": request.path,
+        "status": response.status_code,
+        "cafeteria_id": request.POST.get("cafeteria") or request.GET.get("cafeteria"),
+        "total_ms": data["total_ms"],
+        "phases": data["phases"],
+        "fragments": [
+            {"url": entry["detail"], "ms": entry["ms"]} for entry in data["entries"] if entry["name"] == "fragment"
+        ],
+    }
+    logger.info(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+
+
+def instrument(view: Callable[..., Any]) -> Callable[..., Any]:
+    """ビューの処理中に `timed` で計測したフェーズを、レスポンスヘッダーとログに出力する。
+
+    同期・async両方のビューに使える。
+    """
+
+    view_name = view.__name__
+    if asyncio.iscoroutinefunction(view):
+
+        @functools.wraps(view)
+        async def async_wrapper(request: HttpRequest, *args: Any, **kwargs: Any) -> HttpResponse:
+            with record_timings() as timings:
+                response = await view(request, *args, **kwargs)
+            staff = _server_timing_enabled() and await sync_to_async(is_staff_request)(request)
+            _finish(request, response, timings, view_name, staff=staff)
+            return response
+
+        return async_wrapper
+
+    @functools.wraps(view)
+    def wrapper(request: HttpRequest, *args: Any, **kwargs: Any) -> HttpResponse:
+        with record_timings() as timings:
+            response = view(request, *args, **kwargs)
+        _finish(request, response, timings, view_name, staff=_server_timing_enabled() and is_staff_request(request))
+        return response
+
+    return wrapper
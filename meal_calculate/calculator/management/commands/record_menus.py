@@ -0,0 +1,47 @@
+from __future__ import annotations
+
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from calculator.cafeterias import CAFETERIAS, cafeteria_url
+from menu_replay import DEFAULT_CORPUS_DIR, MANIFEST_NAME, record_corpus
+
+
+class Command(BaseCommand):
+    help = "全食堂のメニューページとAJAX断片を取得し、再生用のコーパスに新しい版として保存します。"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--cafeteria",
+            action="append",
+            dest="cafeterias",
+            metavar="ID",
+            help="対象の食堂ID。複数指定できます (デフォルトは全食堂)。",
+        )
+        parser.add_argument(
+            "--out",
+            default=str(DEFAULT_CORPUS_DIR),
+            help=f"保存先 (デフォルト: {DEFAULT_CORPUS_DIR})",
+        )
+        parser.add_argument("--label", help="版ディレクトリの名前 (デフォルト: 記録日時)")
+
+    def handle(self, *args, **options):
+        cafeteria_ids = options["cafeterias"] or [caf.identifier for caf in CAFETERIAS]
+        try:
+            directory = record_corpus(
+                [cafeteria_url(cafeteria_id) for cafeteria_id in cafeteria_ids],
+                options["out"],
+                version=options["label"],
+            )
+        except (SystemExit, FileExistsError) as exc:
+            raise CommandError(str(exc)) from exc
+
+        manifest = json.loads((directory / MANIFEST_NAME).read_text(encoding="utf-8"))
+        pages = sum(1 for entry in manifest["entries"] if entry["kind"] == "page")
+        fragments = len(manifest["entries"]) - pages
+        self.stdout.write(self.style.SUCCESS(f"{pages}ページ・{fragments}断片を記録しました: {directory}"))
+        if manifest["missing"]:
+            self.stderr.write(self.style.WARNING(f"取得できなかった断片: {len(manifest['missing'])}件"))
+            for url in manifest["missing"]:
+                self.stderr.write(f"  {url}")
@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from meal_calculator import get_browser_pool
+
+from calculator.cafeterias import CAFETERIAS
+from calculator.menu_cache import LocMemSnapshotBackend, get_menu_cache
+from calculator.menu_refresh import (
+    DEFAULT_JITTER,
+    DEFAULT_TIMEOUT,
+    DEFAULT_WORKERS,
+    RefreshResult,
+    refresh_cafeterias,
+)
+
+
+class Command(BaseCommand):
+    help = "全食堂のメニューを並行して取得し、メニュースナップショットキャッシュへ保存します。"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--cafeteria",
+            action="append",
+            dest="cafeterias",
+            metavar="ID",
+            help="対象の食堂ID。複数指定できます (デフォルトは全食堂)。",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=DEFAULT_WORKERS,
+            help=(
+                f"同時に取得する食堂数 (デフォルト: {DEFAULT_WORKERS})。"
+                "MEAL_BROWSER_POOL_SIZE が未設定なら、常駐させる Chromium の数もこれに合わせます。"
+            ),
+        )
+        parser.add_argument(
+            "--timeout",
+            type=float,
+            default=DEFAULT_TIMEOUT,
+            help=f"食堂ごとのタイムアウト秒数。ブラウザプールの空き待ちを含みます (デフォルト: {DEFAULT_TIMEOUT:g})",
+        )
+        parser.add_argument(
+            "--jitter",
+            type=float,
+            default=DEFAULT_JITTER,
+            help=f"各取得の開始を 0〜指定秒のランダムな時間だけ遅らせます (デフォルト: {DEFAULT_JITTER:g})",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=0,
+            help="指定した秒数ごとに取得を繰り返す常駐モードで動作します。0 の場合は1回だけ実行します。",
+        )
+        parser.add_argument(
+            "--no-playwright",
+            action="store_true",
+            help="Playwrightを使用せず、静的HTMLとAJAX断片のみでメニューを取得します。",
+        )
+
+    def handle(self, *args, **options):
+        cafeteria_ids = options["cafeterias"] or [caf.identifier for caf in CAFETERIAS]
+        interval = options["interval"]
+        if isinstance(get_menu_cache().backend, LocMemSnapshotBackend):
+            self.stderr.write(
+                self.style.WARNING(
+                    "MENU_CACHE_BACKEND が locmem のため、取得結果は他のプロセスと共有されません。"
+                )
+            )
+
+        if not options["no_playwright"]:
+            self._size_browser_pool(min(options["workers"], len(cafeteria_ids)))
+
+        while True:
+            results = self._refresh(cafeteria_ids, options)
+            failures = [result for result in results if not result.ok]
+            if interval <= 0:
+                break
+            try:
+                time.sleep(interval)
+            except KeyboardInterrupt:
+                return
+
+        if failures:
+            raise CommandError(f"{len(failures)}/{len(results)} 件の食堂でメニューを取得できませんでした。")
+
+    def _size_browser_pool(self, workers: int) -> None:
+        # ページの描画はブラウザプールの大きさまでしか並行しないため、明示的な設定がなければ並行数に合わせる
+        pool_size = os.environ.get("MEAL_BROWSER_POOL_SIZE")
+        if pool_size is None:
+            get_browser_pool(max(workers, 1))
+        elif int(pool_size) < workers:
+            self.stderr.write(
+                self.style.WARNING(
+                    f"MEAL_BROWSER_POOL_SIZE={pool_size} のため、--workers {workers} を指定しても"
+                    f"同時に描画するページは{pool_size}件までです。"
+                )
+            )
+
+    def _refresh(self, cafeteria_ids, options) -> list[RefreshResult]:
+        write_lock = threading.Lock()
+
+        def report(result: RefreshResult) -> None:
+            label = f"{result.name} ({result.cafeteria_id})"
+            if result.ok:
+                message = self.style.SUCCESS(f"OK {label}: {result.item_count}品 {result.duration:.2f}秒")
+            else:
+                message = self.style.ERROR(f"NG {label}: {result.error} {result.duration:.2f}秒")
+            with write_lock:
+                self.stdout.write(message)
+
+        start = time.monotonic()
+        results = refresh_cafeterias(
+            cafeteria_ids,
+            workers=options["workers"],
+            use_playwright=not options["no_playwright"],
+            timeout=options["timeout"] or None,
+            jitter=options["jitter"],
+            on_result=report,
+        )
+        succeeded = sum(1 for result in results if result.ok)
+        self.stdout.write(
+            f"{succeeded}/{len(results)} 件の食堂を更新しました ({time.monotonic() - start:.2f}秒)"
+        )
+        return results
@@ -6,10 +6,27 @@ from pathlib import Path
 from django.core.management.base import BaseCommand, CommandError
 
 from calculator.cafeterias import _DATA_FILE as DATA_FILE  # type: ignore[attr-defined]
+from meal_calculator import BrowserPool, get_browser_pool
 
 KYOTO_UNIV_PAGE = "https://west2-univ.jp/sp/kyoto-univ.php"
 
 
+def _collect_cafeterias(page) -> list[dict[str, str]]:
+    """食堂一覧ページのリンクから食堂IDと名称を抽出する。"""
+
+    cafeterias = []
+    page.goto(KYOTO_UNIV_PAGE, wait_until="networkidle", timeout=60000)
+    anchors = page.query_selector_all("a[href*='menu.php?t=']")
+    for anchor in anchors:
+        href = anchor.get_attribute("href")
+        text = anchor.inner_text().strip()
+        if not href or "menu.php?t=" not in href or not text:
+            continue
+        identifier = href.split("t=")[-1].split("&")[0]
+        cafeterias.append({"id": identifier, "name": text})
+    return cafeterias
+
+
 class Command(BaseCommand):
     help = "Playwright を用いて https://west2-univ.jp/sp/kyoto-univ.php から食堂一覧を取得し、cafeterias.json を更新します。"
 
@@ -26,31 +43,17 @@ class Command(BaseCommand):
         )
 
     def handle(self, *args, **options):
-        try:
-            from playwright.sync_api import sync_playwright
-        except ImportError as exc:  # pragma: no cover - ランタイム依存
-            raise CommandError(
-                "Playwright がインストールされていません。`pip install playwright` と `playwright install chromium` を実行してください。"
-            ) from exc
-
         headless = not options.get("show")
+        # 表示モードは共有プールと設定が異なるため、専用のプールを一時的に用意する
+        pool = get_browser_pool() if headless else BrowserPool(1, headless=False)
 
-        cafeterias = []
-        with sync_playwright() as p:
-            browser = p.chromium.launch(headless=headless)
-            page = browser.new_page()
-            try:
-                page.goto(KYOTO_UNIV_PAGE, wait_until="networkidle", timeout=60000)
-                anchors = page.query_selector_all("a[href*='menu.php?t=']")
-                for anchor in anchors:
-                    href = anchor.get_attribute("href")
-                    text = anchor.inner_text().strip()
-                    if not href or "menu.php?t=" not in href or not text:
-                        continue
-                    identifier = href.split("t=")[-1].split("&")[0]
-                    cafeterias.append({"id": identifier, "name": text})
-            finally:
-                browser.close()
+        try:
+            cafeterias = pool.run(_collect_cafeterias)
+        except SystemExit as exc:
+            raise CommandError(str(exc)) from exc
+        finally:
+            if not headless:
+                pool.close()
 
         if not cafeterias:
             raise CommandError("食堂情報を取得できませんでした。サイト構造が変更された可能性があります。")
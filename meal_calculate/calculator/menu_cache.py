@@ -0,0 +1,561 @@
+"""食堂ごとのメニュースナップショットをTTL付きでキャッシュするユーティリティ。"""
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import dataclasses
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, List, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import close_old_connections, connections
+from django.utils.module_loading import import_string
+
+from meal_calculator import (
+    BudgetFrontier,
+    CombinationCache,
+    MenuTable,
+    budget_frontier,
+    fetch_menu,
+    fetch_menu_async,
+    get_solver_executor,
+    record_timings,
+    timed,
+)
+
+from . import metrics
+from .cafeterias import CAFETERIAS, cafeteria_url
+from .coalescing import async_menu_flight, async_process_lock, menu_flight, process_lock
+
+
+DEFAULT_TTL = 900
+DEFAULT_MAX_STALE = 3600
+DEFAULT_FRONTIER_MAX_BUDGET = 3000
+DEFAULT_RESULT_CACHE_SIZE = 1024
+
+logger = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass(frozen=True)
+class MenuSnapshot:
+    """ある時点で取得した食堂メニューのスナップショット。
+
+    `frontiers` には `limit_primary` ごとに、予算ごとの最適解 (`BudgetFrontier`) を保持する。
+    """
+
+    cafeteria_id: str
+    items: MenuTable
+    fetched_at: float
+    frontiers: dict[bool, BudgetFrontier] = dataclasses.field(default_factory=dict, compare=False)
+
+    def age(self, now: Optional[float] = None) -> float:
+        """取得からの経過秒数を返す。"""
+
+        return (time.time() if now is None else now) - self.fetched_at
+
+    def to_dict(self) -> dict[str, Any]:
+        table = MenuTable.from_items(self.items)
+        return {
+            "cafeteria_id": self.cafeteria_id,
+            "table": table.to_dict(),
+            # 読み込んだプロセスで結果キャッシュのキーを計算し直さずに済むよう、指紋も保存する
+            "fingerprint": table.fingerprint(),
+            "fetched_at": self.fetched_at,
+            "frontiers": [frontier.to_dict() for frontier in self.frontiers.values()],
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "MenuSnapshot":
+        if "table" in data:
+            items = MenuTable.from_dict(data["table"], fingerprint=data.get("fingerprint"))
+        else:
+            # 列形式導入前に保存された {"name", "price", "category"} の一覧
+            items = MenuTable.from_records(data.get("items", []))
+        frontiers = {}
+        for entry in data.get("frontiers", []):
+            frontier = BudgetFrontier.from_dict(entry, items)
+            frontiers[frontier.limit_primary] = frontier
+        return cls(str(data["cafeteria_id"]), items, float(data["fetched_at"]), frontiers)
+
+
+class SnapshotBackend:
+    """スナップショット保存先の基底クラス。"""
+
+    def get(self, cafeteria_id: str) -> Optional[MenuSnapshot]:
+        raise NotImplementedError
+
+    def set(self, snapshot: MenuSnapshot) -> None:
+        raise NotImplementedError
+
+    def delete(self, cafeteria_id: str) -> None:
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+
+class LocMemSnapshotBackend(SnapshotBackend):
+    """プロセス内のLRUでスナップショットを保持するバックエンド。"""
+
+    def __init__(self, max_entries: int = 64) -> None:
+        self._max_entries = max(1, max_entries)
+        self._entries: "OrderedDict[str, MenuSnapshot]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, cafeteria_id: str) -> Optional[MenuSnapshot]:
+        with self._lock:
+            snapshot = self._entries.get(cafeteria_id)
+            if snapshot is not None:
+                self._entries.move_to_end(cafeteria_id)
+            return snapshot
+
+    def set(self, snapshot: MenuSnapshot) -> None:
+        with self._lock:
+            self._entries[snapshot.cafeteria_id] = snapshot
+            self._entries.move_to_end(snapshot.cafeteria_id)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, cafeteria_id: str) -> None:
+        with self._lock:
+            self._entries.pop(cafeteria_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class DjangoCacheSnapshotBackend(SnapshotBackend):
+    """Djangoのキャッシュフレームワークに保存するバックエンド。"""
+
+    def __init__(self, cache_alias: str = "default", key_prefix: str = "menu_snapshot") -> None:
+        from django.core.cache import caches
+
+        self._cache = caches[cache_alias]
+        self._key_prefix = key_prefix
+
+    def _key(self, cafeteria_id: str) -> str:
+        return f"{self._key_prefix}:{cafeteria_id}"
+
+    def get(self, cafeteria_id: str) -> Optional[MenuSnapshot]:
+        data = self._cache.get(self._key(cafeteria_id))
+        if not data:
+            return None
+        return MenuSnapshot.from_dict(data)
+
+    def set(self, snapshot: MenuSnapshot) -> None:
+        # 鮮度はfetched_atで判定するため、キャッシュ側では期限を設けない
+        self._cache.set(self._key(snapshot.cafeteria_id), snapshot.to_dict(), timeout=None)
+
+    def delete(self, cafeteria_id: str) -> None:
+        self._cache.delete(self._key(cafeteria_id))
+
+    def clear(self) -> None:
+        self._cache.delete_many([self._key(caf.identifier) for caf in CAFETERIAS])
+
+
+class FileSnapshotBackend(SnapshotBackend):
+    """食堂ごとにJSONファイルとして保存するバックエンド。"""
+
+    def __init__(self, directory: Optional[str] = None) -> None:
+        default_dir = Path(tempfile.gettempdir()) / "meal_calculate" / "menu_snapshots"
+        self._directory = Path(directory) if directory else default_dir
+
+    def _path(self, cafeteria_id: str) -> Path:
+        safe_id = "".join(ch for ch in cafeteria_id if ch.isalnum() or ch in "-_")
+        return self._directory / f"{safe_id}.json"
+
+    def get(self, cafeteria_id: str) -> Optional[MenuSnapshot]:
+        path = self._path(cafeteria_id)
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError):
+            return None
+        try:
+            return MenuSnapshot.from_dict(data)
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def set(self, snapshot: MenuSnapshot) -> None:
+        self._directory.mkdir(parents=True, exist_ok=True)
+        path = self._path(snapshot.cafeteria_id)
+        # 書き込み途中のファイルを他プロセスが読まないよう、一時ファイル経由で置き換える
+        fd, tmp_name = tempfile.mkstemp(dir=self._directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as handle:
+                json.dump(snapshot.to_dict(), handle, ensure_ascii=False)
+            os.replace(tmp_name, path)
+        except BaseException:
+            Path(tmp_name).unlink(missing_ok=True)
+            raise
+
+    def delete(self, cafeteria_id: str) -> None:
+        self._path(cafeteria_id).unlink(missing_ok=True)
+
+    def clear(self) -> None:
+        if not self._directory.exists():
+            return
+        for path in self._directory.glob("*.json"):
+            path.unlink(missing_ok=True)
+
+
+class DatabaseSnapshotBackend(SnapshotBackend):
+    """`calculator.models` のテーブルに保存するバックエンド。全ワーカーで同じ内容を共有する。
+
+    最適解 (`frontiers`) もスナップショットに保存し、読み込んだワーカーで計算し直さずに済ませる。
+    """
+
+    def get(self, cafeteria_id: str) -> Optional[MenuSnapshot]:
+        from .menu_store import load_frontiers, load_latest_menu
+
+        latest = load_latest_menu(cafeteria_id)
+        if latest is None:
+            return None
+        items, fetched_at = latest
+        # 最適解は品目の並びにだけ依存するため、読み込んだ品目と同じ内容ハッシュのものを使う
+        frontiers = {}
+        for entry in load_frontiers(cafeteria_id, items.fingerprint()):
+            frontier = BudgetFrontier.from_dict(entry, items)
+            frontiers[frontier.limit_primary] = frontier
+        return MenuSnapshot(cafeteria_id, items, fetched_at, frontiers)
+
+    def set(self, snapshot: MenuSnapshot) -> None:
+        from .menu_store import store_menu
+
+        store_menu(
+            snapshot.cafeteria_id,
+            snapshot.items,
+            fetched_at=snapshot.fetched_at,
+            frontiers=[frontier.to_dict() for frontier in snapshot.frontiers.values()],
+        )
+
+    def delete(self, cafeteria_id: str) -> None:
+        from .menu_store import delete_menus
+
+        delete_menus(cafeteria_id)
+
+    def clear(self) -> None:
+        from .menu_store import delete_menus
+
+        delete_menus()
+
+
+BACKEND_ALIASES = {
+    "locmem": LocMemSnapshotBackend,
+    "django": DjangoCacheSnapshotBackend,
+    "file": FileSnapshotBackend,
+    "database": DatabaseSnapshotBackend,
+}
+
+
+class MenuSnapshotCache:
+    """`fetch_menu` の前段に置くTTL付きスナップショットキャッシュ。
+
+    TTL切れから `max_stale` 秒以内のスナップショットは、裏で1回だけ取得し直しつつそのまま返す
+    (stale-while-revalidate)。それより古い場合は取得が終わるまで待つ。
+    """
+
+    def __init__(
+        self,
+        backend: SnapshotBackend,
+        ttl: float = DEFAULT_TTL,
+        max_stale: float = DEFAULT_MAX_STALE,
+        frontier_max_budget: int = DEFAULT_FRONTIER_MAX_BUDGET,
+        result_cache_size: int = DEFAULT_RESULT_CACHE_SIZE,
+    ) -> None:
+        self.backend = backend
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.frontier_max_budget = frontier_max_budget
+        # frontiersを保存できないバックエンド向けに、計算済みの最適解をプロセス内で保持する
+        self._frontiers: "OrderedDict[tuple[str, float, bool], BudgetFrontier]" = OrderedDict()
+        self._frontiers_lock = threading.Lock()
+        self.results = CombinationCache(result_cache_size)
+        self._revalidating: set[str] = set()
+        self._revalidating_lock = threading.Lock()
+        self._tasks: set[asyncio.Task] = set()
+
+    def is_fresh(self, snapshot: MenuSnapshot, now: Optional[float] = None) -> bool:
+        """スナップショットがTTL内かどうかを判定する。"""
+
+        return self.ttl > 0 and snapshot.age(now) < self.ttl
+
+    def get(self, cafeteria_id: str) -> Optional[MenuSnapshot]:
+        """TTL内のスナップショットがあれば返す。"""
+
+        snapshot = self.backend.get(cafeteria_id)
+        if snapshot is None or not self.is_fresh(snapshot):
+            return None
+        return snapshot
+
+    def refresh(
+        self, cafeteria_id: str, *, use_playwright: bool = True, timeout: Optional[float] = None
+    ) -> MenuSnapshot:
+        """メニューを取得し直してキャッシュに保存する。`timeout` は `fetch_menu` に渡す。"""
+
+        with record_timings() as timings:
+            try:
+                items = fetch_menu(cafeteria_url(cafeteria_id), use_playwright=use_playwright, timeout=timeout)
+            except (SystemExit, Exception):
+                metrics.scrape_failed(cafeteria_id)
+                raise
+        metrics.observe_scrape(cafeteria_id, timings)
+        snapshot = self._build_snapshot(cafeteria_id, items)
+        self.backend.set(snapshot)
+        return snapshot
+
+    def _build_snapshot(self, cafeteria_id: str, items: Any) -> MenuSnapshot:
+        table = MenuTable.from_items(items)
+        frontiers = {}
+        if self.frontier_max_budget > 0:
+            with timed("frontier"):
+                for limit_primary in (False, True):
+                    frontiers[limit_primary] = budget_frontier(table, self.frontier_max_budget, limit_primary)
+        return MenuSnapshot(cafeteria_id, table, time.time(), frontiers)
+
+    async def refresh_async(self, cafeteria_id: str, *, use_playwright: bool = True) -> MenuSnapshot:
+        """`refresh` のasyncio版。取得はイベントループ上で、最適解の計算と保存は別スレッドで行う。"""
+
+        with record_timings() as timings:
+            try:
+                items = await fetch_menu_async(cafeteria_url(cafeteria_id), use_playwright=use_playwright)
+            except (SystemExit, Exception):
+                metrics.scrape_failed(cafeteria_id)
+                raise
+        metrics.observe_scrape(cafeteria_id, timings)
+        snapshot = await asyncio.to_thread(self._build_snapshot, cafeteria_id, items)
+        await sync_to_async(self.backend.set)(snapshot)
+        return snapshot
+
+    def frontier(self, snapshot: MenuSnapshot, limit_primary: bool) -> BudgetFrontier:
+        """スナップショットに対する予算ごとの最適解を返す。保存されていなければ計算して保持する。"""
+
+        frontier = snapshot.frontiers.get(limit_primary)
+        if frontier is not None and frontier.max_budget >= self.frontier_max_budget:
+            return frontier
+        key = (snapshot.cafeteria_id, snapshot.fetched_at, limit_primary)
+        with self._frontiers_lock:
+            frontier = self._frontiers.get(key)
+            if frontier is not None:
+                self._frontiers.move_to_end(key)
+                return frontier
+        frontier = budget_frontier(snapshot.items, max(self.frontier_max_budget, 0), limit_primary)
+        with self._frontiers_lock:
+            self._frontiers[key] = frontier
+            while len(self._frontiers) > 2 * len(CAFETERIAS) + 2:
+                self._frontiers.popitem(last=False)
+        return frontier
+
+    def best_combination(
+        self,
+        snapshot: MenuSnapshot,
+        budget: int,
+        limit_primary: bool = False,
+    ) -> Tuple[int, List[Any]]:
+        """予算 `budget` の最適な組み合わせを返す。
+
+        同じメニュー・条件の結果が `results` にあれば探索を省き、なければ最適解の範囲内なら
+        二分探索、範囲外ならソルバー実行器で求める。混雑時は `SolverUnavailable` を送出する。
+        """
+
+        source = "cache"
+
+        def solve() -> Tuple[int, List[Any]]:
+            nonlocal source
+            if 0 <= budget <= self.frontier_max_budget:
+                frontier = self.frontier(snapshot, limit_primary)
+                if frontier.covers(budget):
+                    source = "frontier"
+                    return frontier.lookup(budget)
+            source = "solver"
+            # 範囲外の大きな予算はリクエスト処理のスレッドを止めないようプロセスプールで解く
+            return get_solver_executor().best_combination(snapshot.items, budget, limit_primary=limit_primary)
+
+        start = time.perf_counter()
+        result = self.results.best_combination(
+            snapshot.items,
+            budget,
+            limit_primary,
+            menu_key=snapshot.cafeteria_id,
+            solve=solve,
+        )
+        metrics.observe_solve(limit_primary, budget, time.perf_counter() - start, source)
+        return result
+
+    def get_menu(self, cafeteria_id: str, *, use_playwright: bool = True) -> MenuTable:
+        """キャッシュを優先してメニューを返す。"""
+
+        snapshot, _ = self.get_snapshot(cafeteria_id, use_playwright=use_playwright)
+        return snapshot.items
+
+    def get_snapshot(self, cafeteria_id: str, *, use_playwright: bool = True) -> tuple[MenuSnapshot, bool]:
+        """スナップショットと、それがTTL切れ (stale) かどうかを返す。
+
+        TTL切れでも `max_stale` 以内なら即座に返し、裏で取得し直す。
+        """
+
+        snapshot = self.backend.get(cafeteria_id)
+        if snapshot is not None:
+            if self.is_fresh(snapshot):
+                metrics.snapshot_lookup("fresh")
+                return snapshot, False
+            if self.ttl > 0 and snapshot.age() < self.ttl + self.max_stale:
+                metrics.snapshot_lookup("stale")
+                self.revalidate(cafeteria_id, use_playwright=use_playwright)
+                return snapshot, True
+        metrics.snapshot_lookup("miss")
+        snapshot = menu_flight.do(
+            f"snapshot:{cafeteria_id}",
+            lambda: self._locked_refresh(cafeteria_id, use_playwright=use_playwright),
+        )
+        return snapshot, False
+
+    async def get_snapshot_async(
+        self, cafeteria_id: str, *, use_playwright: bool = True
+    ) -> tuple[MenuSnapshot, bool]:
+        """`get_snapshot` のasyncio版。TTL切れ時の再取得はイベントループ上のタスクで行う。"""
+
+        snapshot = await sync_to_async(self.backend.get)(cafeteria_id)
+        if snapshot is not None:
+            if self.is_fresh(snapshot):
+                metrics.snapshot_lookup("fresh")
+                return snapshot, False
+            if self.ttl > 0 and snapshot.age() < self.ttl + self.max_stale:
+                metrics.snapshot_lookup("stale")
+                self.revalidate_async(cafeteria_id, use_playwright=use_playwright)
+                return snapshot, True
+        metrics.snapshot_lookup("miss")
+        snapshot = await async_menu_flight.do(
+            f"snapshot:{cafeteria_id}",
+            lambda: self._locked_refresh_async(cafeteria_id, use_playwright=use_playwright),
+        )
+        return snapshot, False
+
+    async def _locked_refresh_async(self, cafeteria_id: str, *, use_playwright: bool) -> MenuSnapshot:
+        async with async_process_lock(cafeteria_url(cafeteria_id)):
+            snapshot = await sync_to_async(self.get)(cafeteria_id)
+            if snapshot is None:
+                snapshot = await self.refresh_async(cafeteria_id, use_playwright=use_playwright)
+        return snapshot
+
+    def revalidate_async(self, cafeteria_id: str, *, use_playwright: bool = True) -> bool:
+        """`revalidate` のasyncio版。実行中のイベントループ上のタスクとして取得し直す。"""
+
+        with self._revalidating_lock:
+            if cafeteria_id in self._revalidating:
+                return False
+            self._revalidating.add(cafeteria_id)
+
+        async def run() -> None:
+            try:
+                await async_menu_flight.do(
+                    f"snapshot:{cafeteria_id}",
+                    lambda: self._locked_refresh_async(cafeteria_id, use_playwright=use_playwright),
+                )
+            except BaseException as exc:  # SystemExitでイベントループを止めない
+                logger.warning("メニューの再取得に失敗しました (%s): %s", cafeteria_id, exc)
+            finally:
+                with self._revalidating_lock:
+                    self._revalidating.discard(cafeteria_id)
+                # リクエストの外で使ったDB接続は request_finished で片付かないため、
+                # 使ったスレッド (sync_to_async の共有スレッド) で期限切れ・異常な接続を閉じる
+                await sync_to_async(close_old_connections)()
+
+        # 裏での取得を呼び出し元のリクエストの計測に含めないよう、空のcontextで実行する
+        task = asyncio.get_running_loop().create_task(run(), context=contextvars.Context())
+        # タスクが途中で回収されないよう参照を保持する
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+
+    def revalidate(self, cafeteria_id: str, *, use_playwright: bool = True) -> bool:
+        """裏でメニューを取得し直す。既に同じ食堂を取得中なら何もせずFalseを返す。"""
+
+        with self._revalidating_lock:
+            if cafeteria_id in self._revalidating:
+                return False
+            self._revalidating.add(cafeteria_id)
+
+        def run() -> None:
+            try:
+                menu_flight.do(
+                    f"snapshot:{cafeteria_id}",
+                    lambda: self._locked_refresh(cafeteria_id, use_playwright=use_playwright),
+                )
+            except BaseException as exc:  # SystemExitでスレッドを落とさない
+                logger.warning("メニューの再取得に失敗しました (%s): %s", cafeteria_id, exc)
+            finally:
+                with self._revalidating_lock:
+                    self._revalidating.discard(cafeteria_id)
+                # スレッドはここで終わるため、このスレッドが開いたDB接続をすべて閉じる
+                connections.close_all()
+
+        threading.Thread(target=run, name=f"menu-revalidate-{cafeteria_id}", daemon=True).start()
+        return True
+
+    def _locked_refresh(self, cafeteria_id: str, *, use_playwright: bool) -> MenuSnapshot:
+        with process_lock(cafeteria_url(cafeteria_id)):
+            # ロック待ちの間に別ワーカーが保存したスナップショットがあればそれを使う
+            snapshot = self.get(cafeteria_id)
+            if snapshot is None:
+                snapshot = self.refresh(cafeteria_id, use_playwright=use_playwright)
+        return snapshot
+
+    def invalidate(self, cafeteria_id: Optional[str] = None) -> None:
+        """指定した食堂、または全食堂のスナップショットを破棄する。"""
+
+        if cafeteria_id is None:
+            self.backend.clear()
+        else:
+            self.backend.delete(cafeteria_id)
+
+
+_menu_cache: Optional[MenuSnapshotCache] = None
+_menu_cache_lock = threading.Lock()
+
+
+def _build_backend(config: dict[str, Any]) -> SnapshotBackend:
+    backend_name = config.get("BACKEND", "locmem")
+    backend_cls = BACKEND_ALIASES.get(backend_name) or import_string(backend_name)
+    options = {key.lower(): value for key, value in config.get("OPTIONS", {}).items()}
+    # MENU_CACHE_DIR はファイル保存のバックエンドにだけ渡す (他のバックエンドは directory を受け取らない)
+    directory = config.get("DIRECTORY")
+    if directory and issubclass(backend_cls, FileSnapshotBackend):
+        options.setdefault("directory", directory)
+    try:
+        return backend_cls(**options)
+    except TypeError as exc:
+        raise ImproperlyConfigured(f"MENU_SNAPSHOT_CACHE の OPTIONS が {backend_name} に対応していません: {exc}") from exc
+
+
+def get_menu_cache() -> MenuSnapshotCache:
+    """設定 `MENU_SNAPSHOT_CACHE` に基づくキャッシュを返す。"""
+
+    global _menu_cache
+    if _menu_cache is None:
+        with _menu_cache_lock:
+            if _menu_cache is None:
+                config = getattr(settings, "MENU_SNAPSHOT_CACHE", {})
+                _menu_cache = MenuSnapshotCache(
+                    _build_backend(config),
+                    ttl=float(config.get("TTL", DEFAULT_TTL)),
+                    max_stale=float(config.get("MAX_STALE", DEFAULT_MAX_STALE)),
+                    frontier_max_budget=int(config.get("FRONTIER_MAX_BUDGET", DEFAULT_FRONTIER_MAX_BUDGET)),
+                    result_cache_size=int(config.get("RESULT_CACHE_SIZE", DEFAULT_RESULT_CACHE_SIZE)),
+                )
+    return _menu_cache
+
+
+def invalidate_menu(cafeteria_id: Optional[str] = None) -> None:
+    """メニューキャッシュを明示的に破棄する。"""
+
+    get_menu_cache().invalidate(cafeteria_id)
@@ -0,0 +1,94 @@
+"""全食堂のメニューを並行して取得し、スナップショットキャッシュを温めるユーティリティ。"""
+from __future__ import annotations
+
+import dataclasses
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Sequence
+
+from django.db import close_old_connections
+
+from .cafeterias import cafeteria_name, cafeteria_url
+from .coalescing import process_lock
+from .menu_cache import MenuSnapshotCache, get_menu_cache
+
+
+DEFAULT_WORKERS = 4
+DEFAULT_TIMEOUT = 120.0
+DEFAULT_JITTER = 1.0
+
+
+@dataclasses.dataclass(frozen=True)
+class RefreshResult:
+    """食堂1件分の取得結果。"""
+
+    cafeteria_id: str
+    name: str
+    ok: bool
+    duration: float
+    item_count: int = 0
+    error: Optional[str] = None
+
+
+def refresh_cafeteria(
+    cafeteria_id: str,
+    *,
+    cache: Optional[MenuSnapshotCache] = None,
+    use_playwright: bool = True,
+    timeout: Optional[float] = DEFAULT_TIMEOUT,
+    jitter: float = 0.0,
+) -> RefreshResult:
+    """1食堂のメニューを取得し直してキャッシュに保存する。例外は結果として返す。
+
+    `timeout` は `fetch_menu` に渡し、ブラウザの空き待ちとHTTP通信をその秒数で打ち切る。
+    """
+
+    cache = cache or get_menu_cache()
+    if jitter > 0:
+        # 上流サイトへのアクセスが同時刻に集中しないよう開始をずらす
+        time.sleep(random.uniform(0, jitter))
+
+    name = cafeteria_name(cafeteria_id)
+    start = time.monotonic()
+    try:
+        with process_lock(cafeteria_url(cafeteria_id)):
+            snapshot = cache.refresh(cafeteria_id, use_playwright=use_playwright, timeout=timeout)
+    except (SystemExit, Exception) as exc:
+        return RefreshResult(cafeteria_id, name, False, time.monotonic() - start, error=str(exc) or type(exc).__name__)
+    finally:
+        # database バックエンド・ロックの接続をリクエスト外のスレッドに残さない
+        close_old_connections()
+    return RefreshResult(cafeteria_id, name, True, time.monotonic() - start, item_count=len(snapshot.items))
+
+
+def refresh_cafeterias(
+    cafeteria_ids: Sequence[str],
+    *,
+    workers: int = DEFAULT_WORKERS,
+    use_playwright: bool = True,
+    timeout: Optional[float] = DEFAULT_TIMEOUT,
+    jitter: float = DEFAULT_JITTER,
+    on_result: Optional[Callable[[RefreshResult], None]] = None,
+) -> List[RefreshResult]:
+    """複数食堂のメニューを `workers` 並列で取得し、入力順の結果一覧を返す。
+
+    `on_result` を渡すと、各食堂の取得が終わるたびに呼び出す。
+    """
+
+    cache = get_menu_cache()
+
+    def run(cafeteria_id: str) -> RefreshResult:
+        result = refresh_cafeteria(
+            cafeteria_id,
+            cache=cache,
+            use_playwright=use_playwright,
+            timeout=timeout,
+            jitter=jitter,
+        )
+        if on_result is not None:
+            on_result(result)
+        return result
+
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="menu-refresh") as executor:
+        return list(executor.map(run, cafeteria_ids))
@@ -0,0 +1,140 @@
+"""取得したメニューをデータベースへ保存・読み出しするユーティリティ。"""
+from __future__ import annotations
+
+import datetime
+from typing import Any, Optional, Sequence
+
+from django.db import IntegrityError, transaction
+from django.db.models import Subquery
+from django.utils import timezone
+
+from meal_calculator import MenuTable
+
+from .cafeterias import cafeteria_name
+from .models import Cafeteria, MenuItemRecord, MenuSnapshotRecord
+
+
+BULK_BATCH_SIZE = 500
+
+
+def menu_content_hash(items: Sequence) -> str:
+    """メニュー一覧の内容 (並び順を含む) からSHA-256ハッシュを求める。"""
+
+    return MenuTable.from_items(items).fingerprint()
+
+
+def store_menu(
+    cafeteria_id: str,
+    items: Sequence,
+    *,
+    fetched_at: Optional[float] = None,
+    frontiers: Sequence[dict[str, Any]] = (),
+) -> bool:
+    """メニューを保存する。新しいスナップショットを作成した場合はTrueを返す。
+
+    同じ提供日に同じ内容のスナップショットがあれば、品目は書き込まず取得日時 (と `frontiers`
+    を渡した場合はそれ) だけを更新する。`frontiers` は `BudgetFrontier.to_dict()` の一覧。
+    """
+
+    table = MenuTable.from_items(items)
+    fetched = (
+        timezone.now()
+        if fetched_at is None
+        else datetime.datetime.fromtimestamp(fetched_at, tz=datetime.timezone.utc)
+    )
+    served_date = timezone.localdate(fetched)
+    content_hash = menu_content_hash(table)
+    updates: dict[str, Any] = {"fetched_at": fetched}
+    if frontiers:
+        updates["frontiers"] = list(frontiers)
+
+    with transaction.atomic():
+        cafeteria, _ = Cafeteria.objects.get_or_create(
+            identifier=cafeteria_id,
+            defaults={"name": cafeteria_name(cafeteria_id)},
+        )
+        existing = MenuSnapshotRecord.objects.filter(
+            cafeteria=cafeteria,
+            served_date=served_date,
+            content_hash=content_hash,
+        )
+        if existing.update(**updates):
+            return False
+        try:
+            with transaction.atomic():
+                snapshot = MenuSnapshotRecord.objects.create(
+                    cafeteria=cafeteria,
+                    served_date=served_date,
+                    fetched_at=fetched,
+                    content_hash=content_hash,
+                    item_count=len(table),
+                    frontiers=list(frontiers),
+                )
+        except IntegrityError:
+            # 別ワーカーが同じ内容を先に保存した
+            existing.update(**updates)
+            return False
+        MenuItemRecord.objects.bulk_create(
+            [
+                MenuItemRecord(
+                    snapshot=snapshot,
+                    position=position,
+                    name=row.name,
+                    price=row.price,
+                    category=row.category,
+                )
+                for position, row in enumerate(table)
+            ],
+            batch_size=BULK_BATCH_SIZE,
+        )
+    return True
+
+
+def load_latest_menu(cafeteria_id: str) -> Optional[tuple[MenuTable, float]]:
+    """最新のスナップショットを (メニュー, 取得時刻のUNIX秒) として1回のクエリで読み出す。"""
+
+    latest = (
+        MenuSnapshotRecord.objects.filter(cafeteria__identifier=cafeteria_id)
+        .order_by("-fetched_at")
+        .values("pk")[:1]
+    )
+    rows = list(
+        MenuItemRecord.objects.filter(snapshot_id=Subquery(latest))
+        .order_by("position")
+        .values_list("name", "price", "category", "snapshot__fetched_at", "snapshot__content_hash")
+    )
+    if not rows:
+        return None
+
+    codes: dict[Optional[str], int] = {None: 0}
+    category_codes = [codes.setdefault(category, len(codes)) for _, _, category, _, _ in rows]
+    # content_hash は保存時の `MenuTable.fingerprint()` なので、そのまま指紋として使う
+    table = MenuTable(
+        [name for name, _, _, _, _ in rows],
+        [price for _, price, _, _, _ in rows],
+        category_codes,
+        list(codes),
+        fingerprint=rows[0][4],
+    )
+    return table, rows[0][3].timestamp()
+
+
+def load_frontiers(cafeteria_id: str, content_hash: str) -> list[dict[str, Any]]:
+    """同じ内容の最新のスナップショットに保存された `BudgetFrontier.to_dict()` の一覧を返す。"""
+
+    frontiers = (
+        MenuSnapshotRecord.objects.filter(cafeteria__identifier=cafeteria_id, content_hash=content_hash)
+        .order_by("-fetched_at")
+        .values_list("frontiers", flat=True)
+        .first()
+    )
+    return frontiers or []
+
+
+def delete_menus(cafeteria_id: Optional[str] = None) -> None:
+    """指定した食堂、または全食堂のスナップショットを削除する。"""
+
+    snapshots = MenuSnapshotRecord.objects.all()
+    if cafeteria_id is not None:
+        snapshots = snapshots.filter(cafeteria__identifier=cafeteria_id)
+    snapshots.delete()
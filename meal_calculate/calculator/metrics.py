@@ -0,0 +1,183 @@
+"""Prometheus形式のメトリクス (メニュー取得・キャッシュ・探索) を集計するユーティリティ。
+
+`prometheus_client` がなければ記録は何もしない。環境変数 `PROMETHEUS_MULTIPROC_DIR` を指定すると、
+gunicornの複数ワーカーの値を共有ディレクトリ経由で合算する (マルチプロセスモード)。
+"""
+from __future__ import annotations
+
+import os
+import time
+from typing import Any, Iterator, Optional
+
+from meal_calculator import Timings
+
+from .cafeterias import CAFETERIAS
+
+try:
+    import prometheus_client
+except ImportError:  # pragma: no cover - 依存ライブラリがない環境
+    prometheus_client = None
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 予算を区切るラベル。上限を超える予算は最後の区間に入る
+BUDGET_BUCKETS = (500, 1000, 3000, 10000)
+
+
+def budget_bucket(budget: int) -> str:
+    """予算を `BUDGET_BUCKETS` で区切った区間のラベルに変換する (例: "500-1000")。"""
+
+    lower = 0
+    for upper in BUDGET_BUCKETS:
+        if budget < upper:
+            return f"{lower}-{upper}"
+        lower = upper
+    return f"{lower}+"
+
+
+if prometheus_client is not None:
+    SCRAPE_DURATION = prometheus_client.Histogram(
+        "meal_scrape_duration_seconds",
+        "食堂ごとのメニュー取得 (ページ・断片の取得と解析) の所要時間",
+        ["cafeteria"],
+        buckets=(0.5, 1, 2, 5, 10, 20, 30, 60, 120),
+    )
+    PARSE_DURATION = prometheus_client.Histogram(
+        "meal_parse_duration_seconds",
+        "取得したHTMLの解析の所要時間",
+        buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+    )
+    SCRAPE_FAILURES = prometheus_client.Counter(
+        "meal_scrape_failures_total",
+        "メニューを取得できなかった回数",
+        ["cafeteria"],
+    )
+    SNAPSHOT_LOOKUPS = prometheus_client.Counter(
+        "meal_snapshot_lookups_total",
+        "スナップショットキャッシュの参照回数 (fresh: 有効 / stale: 期限切れを返して裏で更新 / miss: 取得を待った)",
+        ["result"],
+    )
+    SOLVER_DURATION = prometheus_client.Histogram(
+        "meal_solver_duration_seconds",
+        "最適な組み合わせを求める所要時間",
+        ["mode", "budget_bucket"],
+        buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10),
+    )
+    FLIGHT_EXECUTIONS = prometheus_client.Counter(
+        "meal_fetch_executions_total",
+        "同時呼び出しの集約 (single-flight) を経て実際に行ったメニュー取得の回数 (mode: sync / async)",
+        ["mode"],
+    )
+    FLIGHT_COALESCED = prometheus_client.Counter(
+        "meal_fetch_coalesced_total",
+        "実行中の同じ食堂の取得を待って結果を共有し、取得を省略した呼び出しの回数",
+        ["mode"],
+    )
+    FLIGHT_IN_FLIGHT = prometheus_client.Gauge(
+        "meal_fetch_in_flight",
+        "実行中のメニュー取得の件数",
+        ["mode"],
+        multiprocess_mode="livesum",
+    )
+    COMBINATION_SOURCES = prometheus_client.Counter(
+        "meal_combinations_total",
+        "組み合わせの求め方ごとの回数 (cache: 計算結果キャッシュ / frontier: 予算ごとの最適解 / solver: 探索)",
+        ["source"],
+    )
+
+
+def observe_scrape(cafeteria_id: str, timings: Timings) -> None:
+    """メニュー1回分の取得にかかった時間と、そのうちの解析時間を記録する。"""
+
+    if prometheus_client is None:
+        return
+    SCRAPE_DURATION.labels(cafeteria_id).observe(timings.elapsed())
+    parse = timings.summary().get("parse")
+    if parse is not None:
+        PARSE_DURATION.observe(parse / 1000)
+
+
+def scrape_failed(cafeteria_id: str) -> None:
+    if prometheus_client is not None:
+        SCRAPE_FAILURES.labels(cafeteria_id).inc()
+
+
+def snapshot_lookup(result: str) -> None:
+    if prometheus_client is not None:
+        SNAPSHOT_LOOKUPS.labels(result).inc()
+
+
+def flight_started(mode: str, *, coalesced: bool) -> None:
+    """取得の集約で、実際に取得したか (coalesced=False) 実行中の取得を待ったかを記録する。"""
+
+    if prometheus_client is None:
+        return
+    if coalesced:
+        FLIGHT_COALESCED.labels(mode).inc()
+    else:
+        FLIGHT_EXECUTIONS.labels(mode).inc()
+        FLIGHT_IN_FLIGHT.labels(mode).inc()
+
+
+def flight_finished(mode: str) -> None:
+    if prometheus_client is not None:
+        FLIGHT_IN_FLIGHT.labels(mode).dec()
+
+
+def observe_solve(limit_primary: bool, budget: int, duration: float, source: str) -> None:
+    """組み合わせ1件を求めた時間を、制約の有無と予算の区間ごとに記録する。"""
+
+    if prometheus_client is None:
+        return
+    SOLVER_DURATION.labels("limit_primary" if limit_primary else "unrestricted", budget_bucket(budget)).observe(
+        duration
+    )
+    COMBINATION_SOURCES.labels(source).inc()
+
+
+class _SnapshotAgeCollector:
+    """出力時点でキャッシュ済みスナップショットの経過秒数を食堂ごとに読み出す。"""
+
+    def describe(self) -> list[Any]:
+        # 登録時にcollectを呼ばせない (キャッシュの読み出しを出力時だけにする)
+        return []
+
+    def collect(self) -> Iterator[Any]:
+        from prometheus_client.core import GaugeMetricFamily
+
+        from .menu_cache import get_menu_cache
+
+        gauge = GaugeMetricFamily(
+            "meal_snapshot_age_seconds",
+            "キャッシュ済みスナップショットの取得からの経過秒数",
+            labels=["cafeteria"],
+        )
+        backend = get_menu_cache().backend
+        now = time.time()
+        for cafeteria in CAFETERIAS:
+            snapshot = backend.get(cafeteria.identifier)
+            if snapshot is not None:
+                gauge.add_metric([cafeteria.identifier], now - snapshot.fetched_at)
+        yield gauge
+
+
+def render_metrics() -> Optional[bytes]:
+    """全メトリクスをテキスト形式で出力する。`prometheus_client` がなければNone。
+
+    マルチプロセスモードでは、共有ディレクトリに書き出された全ワーカーの値を合算する。
+    スナップショットの経過秒数は共有のキャッシュから出力時に読み出すため、合算の対象外とする。
+    """
+
+    if prometheus_client is None:
+        return None
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    snapshot_registry = prometheus_client.CollectorRegistry()
+    snapshot_registry.register(_SnapshotAgeCollector())
+    return prometheus_client.generate_latest(registry) + prometheus_client.generate_latest(snapshot_registry)
@@ -0,0 +1,70 @@
+# Generated by Django 4.2.30 on 2026-10-17 03:36
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Cafeteria',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('identifier', models.CharField(max_length=32, unique=True, verbose_name='食堂ID')),
+                ('name', models.CharField(max_length=100, verbose_name='食堂名')),
+            ],
+            options={
+                'verbose_name': '食堂',
+                'verbose_name_plural': '食堂',
+            },
+        ),
+        migrations.CreateModel(
+            name='MenuSnapshotRecord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('served_date', models.DateField(verbose_name='提供日')),
+                ('fetched_at', models.DateTimeField(verbose_name='最終取得日時')),
+                ('content_hash', models.CharField(max_length=64, verbose_name='内容ハッシュ')),
+                ('item_count', models.PositiveIntegerField(default=0, verbose_name='品数')),
+                ('frontiers', models.JSONField(blank=True, default=list, verbose_name='予算ごとの最適解')),
+                ('cafeteria', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='calculator.cafeteria')),
+            ],
+            options={
+                'verbose_name': 'メニュースナップショット',
+                'verbose_name_plural': 'メニュースナップショット',
+            },
+        ),
+        migrations.CreateModel(
+            name='MenuItemRecord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField(verbose_name='並び順')),
+                ('name', models.CharField(max_length=200, verbose_name='メニュー名')),
+                ('price', models.IntegerField(verbose_name='価格')),
+                ('category', models.CharField(blank=True, max_length=100, null=True, verbose_name='カテゴリ')),
+                ('snapshot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='calculator.menusnapshotrecord')),
+            ],
+            options={
+                'verbose_name': 'メニュー',
+                'verbose_name_plural': 'メニュー',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='menusnapshotrecord',
+            index=models.Index(fields=['cafeteria', '-fetched_at'], name='calc_snapshot_latest_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='menusnapshotrecord',
+            constraint=models.UniqueConstraint(fields=('cafeteria', 'served_date', 'content_hash'), name='calc_snapshot_unique_content'),
+        ),
+        migrations.AddConstraint(
+            model_name='menuitemrecord',
+            constraint=models.UniqueConstraint(fields=('snapshot', 'position'), name='calc_item_unique_position'),
+        ),
+    ]
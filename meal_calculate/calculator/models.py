@@ -0,0 +1,67 @@
+"""取得したメニューを永続化するモデル定義。"""
+from __future__ import annotations
+
+from django.db import models
+
+
+class Cafeteria(models.Model):
+    """食堂。`identifier` はメニューページのクエリ `t` の値。"""
+
+    identifier = models.CharField("食堂ID", max_length=32, unique=True)
+    name = models.CharField("食堂名", max_length=100)
+
+    class Meta:
+        verbose_name = "食堂"
+        verbose_name_plural = "食堂"
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class MenuSnapshotRecord(models.Model):
+    """ある提供日に取得したメニュー一式。内容が同じ間は1件を使い回す。"""
+
+    cafeteria = models.ForeignKey(Cafeteria, on_delete=models.CASCADE, related_name="snapshots")
+    served_date = models.DateField("提供日")
+    fetched_at = models.DateTimeField("最終取得日時")
+    content_hash = models.CharField("内容ハッシュ", max_length=64)
+    item_count = models.PositiveIntegerField("品数", default=0)
+    # `BudgetFrontier.to_dict()` の一覧。品目の添字は `MenuItemRecord.position` を指す
+    frontiers = models.JSONField("予算ごとの最適解", default=list, blank=True)
+
+    class Meta:
+        verbose_name = "メニュースナップショット"
+        verbose_name_plural = "メニュースナップショット"
+        # (cafeteria, served_date) での検索は一意制約のインデックスの先頭列で賄う
+        indexes = [
+            models.Index(fields=["cafeteria", "-fetched_at"], name="calc_snapshot_latest_idx"),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["cafeteria", "served_date", "content_hash"],
+                name="calc_snapshot_unique_content",
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.cafeteria_id} {self.served_date} ({self.item_count}品)"
+
+
+class MenuItemRecord(models.Model):
+    """スナップショットに含まれる1品。`position` は取得時の並び順。"""
+
+    snapshot = models.ForeignKey(MenuSnapshotRecord, on_delete=models.CASCADE, related_name="items")
+    position = models.PositiveIntegerField("並び順")
+    name = models.CharField("メニュー名", max_length=200)
+    price = models.IntegerField("価格")
+    category = models.CharField("カテゴリ", max_length=100, null=True, blank=True)
+
+    class Meta:
+        verbose_name = "メニュー"
+        verbose_name_plural = "メニュー"
+        constraints = [
+            models.UniqueConstraint(fields=["snapshot", "position"], name="calc_item_unique_position"),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.name}: {self.price}円"
@@ -0,0 +1,89 @@
+"""スタッフ向けに、1リクエスト分の処理をプロファイルして結果を返すデバッグ用ユーティリティ。
+
+設定 `MEAL_PROFILING_ENABLED` が有効な場合のみ、スタッフユーザーのリクエストに
+ヘッダー `X-Meal-Profile` またはクエリ `?profile=` で `cprofile` / `sample` を指定すると動作する。
+"""
+from __future__ import annotations
+
+import asyncio
+import functools
+import time
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpRequest, HttpResponse
+
+from meal_calculator import PROFILERS, Profiler
+
+
+PROFILE_HEADER = "X-Meal-Profile"
+PROFILE_PARAM = "profile"
+
+
+def _requested_mode(request: HttpRequest) -> Optional[str]:
+    if not getattr(settings, "MEAL_PROFILING_ENABLED", False):
+        return None
+    mode = request.headers.get(PROFILE_HEADER) or request.GET.get(PROFILE_PARAM)
+    if mode == "1":
+        return "cprofile"
+    return mode if mode in PROFILERS else None
+
+
+def is_staff_request(request: HttpRequest) -> bool:
+    """ログイン中の有効なスタッフユーザーからのリクエストかどうか。"""
+
+    user = getattr(request, "user", None)
+    return bool(user is not None and user.is_active and user.is_staff)
+
+
+def _profile_response(response: HttpResponse, profiler: Profiler, view_name: str) -> HttpResponse:
+    """ビューのレスポンスの代わりに、プロファイル結果をダウンロードさせるレスポンスを返す。"""
+
+    filename = f"{view_name}-{time.strftime('%Y%m%d-%H%M%S')}{profiler.suffix}"
+    report = profiler.report()
+    directory = getattr(settings, "MEAL_PROFILE_DIR", None)
+    if directory:
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        (Path(directory) / filename).write_bytes(report)
+    content_type = "application/octet-stream" if profiler.mode == "cprofile" else "text/plain; charset=utf-8"
+    profiled = HttpResponse(report, content_type=content_type)
+    profiled["Content-Disposition"] = f'attachment; filename="{filename}"'
+    # 元のレスポンスの結果だけはヘッダーで確認できるようにする
+    profiled["X-Meal-Profile-Status"] = str(response.status_code)
+    return profiled
+
+
+def profile_view(view: Callable[..., Any]) -> Callable[..., Any]:
+    """スタッフが要求した場合に、ビューの処理をプロファイルして結果を返す。
+
+    同期・async両方のビューに使える。asyncビューでは同じイベントループ上の他の処理も含まれる。
+    """
+
+    view_name = view.__name__
+    if asyncio.iscoroutinefunction(view):
+
+        @functools.wraps(view)
+        async def async_wrapper(request: HttpRequest, *args: Any, **kwargs: Any) -> HttpResponse:
+            mode = _requested_mode(request)
+            if mode is None or not await sync_to_async(is_staff_request)(request):
+                return await view(request, *args, **kwargs)
+            profiler = Profiler(mode)
+            with profiler:
+                response = await view(request, *args, **kwargs)
+            return _profile_response(response, profiler, view_name)
+
+        return async_wrapper
+
+    @functools.wraps(view)
+    def wrapper(request: HttpRequest, *args: Any, **kwargs: Any) -> HttpResponse:
+        mode = _requested_mode(request)
+        if mode is None or not is_staff_request(request):
+            return view(request, *args, **kwargs)
+        profiler = Profiler(mode)
+        with profiler:
+            response = view(request, *args, **kwargs)
+        return _profile_response(response, profiler, view_name)
+
+    return wrapper
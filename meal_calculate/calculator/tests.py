@@ -0,0 +1,509 @@
+"""`calculator` アプリのテスト。"""
+from __future__ import annotations
+
+import asyncio
+import datetime
+import http.server
+import importlib.util
+import random
+import tempfile
+import threading
+import time
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from meal_calculator import (
+    DEFAULT_CATEGORY_LABELS,
+    CombinationCache,
+    MenuHTMLParser,
+    MenuItem,
+    MenuTable,
+    SolverBusy,
+    SolverExecutor,
+    SolverTimeout,
+    best_combination,
+    budget_frontier,
+    fetch_menu,
+    is_don_primary,
+    is_primary_item,
+    is_rice_item,
+)
+
+from . import metrics
+from .coalescing import SingleFlight, async_process_lock
+from .menu_cache import DatabaseSnapshotBackend, LocMemSnapshotBackend, MenuSnapshot, MenuSnapshotCache
+from .menu_store import delete_menus, load_latest_menu, menu_content_hash, store_menu
+from .models import Cafeteria, MenuItemRecord, MenuSnapshotRecord
+
+CAFETERIA_ID = "650111"
+OTHER_CAFETERIA_ID = "650112"
+
+MENU = [
+    MenuItem("カレーライス", 400, "丼・カレー"),
+    MenuItem("サラダ", 100, "副菜"),
+    MenuItem("ライス(小)", 80),
+]
+OTHER_MENU = [MenuItem("きつねうどん", 300, "麺類")]
+
+
+def _timestamp(year: int, month: int, day: int, hour: int = 3) -> float:
+    return datetime.datetime(year, month, day, hour, tzinfo=datetime.timezone.utc).timestamp()
+
+
+def _rows(table: MenuTable) -> list[tuple[str, int, str | None]]:
+    return [(row.name, row.price, row.category) for row in table]
+
+
+class StoreMenuTests(TestCase):
+    def test_creates_snapshot_and_items(self) -> None:
+        self.assertTrue(store_menu(CAFETERIA_ID, MENU, fetched_at=_timestamp(2024, 4, 1)))
+
+        snapshot = MenuSnapshotRecord.objects.get()
+        self.assertEqual(snapshot.cafeteria.identifier, CAFETERIA_ID)
+        self.assertEqual(snapshot.item_count, len(MENU))
+        self.assertEqual(snapshot.content_hash, menu_content_hash(MENU))
+        self.assertEqual(
+            list(snapshot.items.order_by("position").values_list("name", "price", "category")),
+            [(item.name, item.price, item.category) for item in MENU],
+        )
+
+    def test_same_content_on_same_day_only_updates_fetched_at(self) -> None:
+        store_menu(CAFETERIA_ID, MENU, fetched_at=_timestamp(2024, 4, 1, 1))
+        self.assertFalse(store_menu(CAFETERIA_ID, MENU, fetched_at=_timestamp(2024, 4, 1, 5)))
+
+        snapshot = MenuSnapshotRecord.objects.get()
+        self.assertEqual(snapshot.fetched_at.timestamp(), _timestamp(2024, 4, 1, 5))
+        self.assertEqual(MenuItemRecord.objects.count(), len(MENU))
+
+    def test_new_content_or_new_day_creates_snapshot(self) -> None:
+        store_menu(CAFETERIA_ID, MENU, fetched_at=_timestamp(2024, 4, 1))
+        self.assertTrue(store_menu(CAFETERIA_ID, OTHER_MENU, fetched_at=_timestamp(2024, 4, 1, 5)))
+        self.assertTrue(store_menu(CAFETERIA_ID, MENU, fetched_at=_timestamp(2024, 4, 2)))
+
+        self.assertEqual(MenuSnapshotRecord.objects.count(), 3)
+        self.assertEqual(Cafeteria.objects.count(), 1)
+
+
+class LoadLatestMenuTests(TestCase):
+    def test_returns_none_without_snapshot(self) -> None:
+        self.assertIsNone(load_latest_menu(CAFETERIA_ID))
+
+    def test_returns_latest_snapshot_in_order(self) -> None:
+        store_menu(CAFETERIA_ID, OTHER_MENU, fetched_at=_timestamp(2024, 4, 1))
+        store_menu(CAFETERIA_ID, MENU, fetched_at=_timestamp(2024, 4, 2))
+        store_menu(OTHER_CAFETERIA_ID, OTHER_MENU, fetched_at=_timestamp(2024, 4, 3))
+
+        latest = load_latest_menu(CAFETERIA_ID)
+        self.assertIsNotNone(latest)
+        table, fetched_at = latest
+        self.assertEqual(_rows(table), [(item.name, item.price, item.category) for item in MENU])
+        self.assertEqual(list(table.flags), [item.flags for item in MENU])
+        self.assertEqual(fetched_at, _timestamp(2024, 4, 2))
+        self.assertEqual(table.fingerprint(), MenuTable.from_items(MENU).fingerprint())
+
+    def test_refetch_of_older_content_becomes_latest(self) -> None:
+        store_menu(CAFETERIA_ID, MENU, fetched_at=_timestamp(2024, 4, 1, 1))
+        store_menu(CAFETERIA_ID, OTHER_MENU, fetched_at=_timestamp(2024, 4, 1, 2))
+        store_menu(CAFETERIA_ID, MENU, fetched_at=_timestamp(2024, 4, 1, 3))
+
+        table, fetched_at = load_latest_menu(CAFETERIA_ID)
+        self.assertEqual(len(table), len(MENU))
+        self.assertEqual(fetched_at, _timestamp(2024, 4, 1, 3))
+
+
+class DeleteMenusTests(TestCase):
+    def setUp(self) -> None:
+        store_menu(CAFETERIA_ID, MENU, fetched_at=_timestamp(2024, 4, 1))
+        store_menu(OTHER_CAFETERIA_ID, OTHER_MENU, fetched_at=_timestamp(2024, 4, 1))
+
+    def test_deletes_only_given_cafeteria(self) -> None:
+        delete_menus(CAFETERIA_ID)
+
+        self.assertIsNone(load_latest_menu(CAFETERIA_ID))
+        self.assertIsNotNone(load_latest_menu(OTHER_CAFETERIA_ID))
+        self.assertEqual(MenuItemRecord.objects.count(), len(OTHER_MENU))
+
+    def test_deletes_all(self) -> None:
+        delete_menus()
+
+        self.assertFalse(MenuSnapshotRecord.objects.exists())
+        self.assertFalse(MenuItemRecord.objects.exists())
+
+
+class DatabaseSnapshotBackendTests(TestCase):
+    def setUp(self) -> None:
+        self.backend = DatabaseSnapshotBackend()
+
+    def test_round_trip(self) -> None:
+        self.assertIsNone(self.backend.get(CAFETERIA_ID))
+        table = MenuTable.from_items(MENU)
+        self.backend.set(MenuSnapshot(CAFETERIA_ID, table, _timestamp(2024, 4, 1)))
+
+        snapshot = self.backend.get(CAFETERIA_ID)
+        self.assertIsNotNone(snapshot)
+        self.assertEqual(snapshot.cafeteria_id, CAFETERIA_ID)
+        self.assertEqual(snapshot.fetched_at, _timestamp(2024, 4, 1))
+        self.assertEqual(_rows(snapshot.items), _rows(table))
+        self.assertEqual(snapshot.frontiers, {})
+
+    def test_frontiers_round_trip(self) -> None:
+        table = MenuTable.from_items(MENU)
+        frontiers = {limit_primary: budget_frontier(table, 1000, limit_primary) for limit_primary in (False, True)}
+        self.backend.set(MenuSnapshot(CAFETERIA_ID, table, _timestamp(2024, 4, 1), frontiers))
+
+        snapshot = self.backend.get(CAFETERIA_ID)
+        self.assertEqual(set(snapshot.frontiers), {False, True})
+        for limit_primary, frontier in frontiers.items():
+            self.assertEqual(snapshot.frontiers[limit_primary].max_budget, 1000)
+            self.assertEqual(list(snapshot.frontiers[limit_primary].steps()), list(frontier.steps()))
+
+    def test_set_same_menu_updates_fetched_at(self) -> None:
+        self.backend.set(MenuSnapshot(CAFETERIA_ID, MenuTable.from_items(MENU), _timestamp(2024, 4, 1, 1)))
+        self.backend.set(MenuSnapshot(CAFETERIA_ID, MenuTable.from_items(MENU), _timestamp(2024, 4, 1, 4)))
+
+        self.assertEqual(self.backend.get(CAFETERIA_ID).fetched_at, _timestamp(2024, 4, 1, 4))
+        self.assertEqual(MenuSnapshotRecord.objects.count(), 1)
+
+    def test_delete_and_clear(self) -> None:
+        self.backend.set(MenuSnapshot(CAFETERIA_ID, MenuTable.from_items(MENU), _timestamp(2024, 4, 1)))
+        self.backend.set(MenuSnapshot(OTHER_CAFETERIA_ID, MenuTable.from_items(OTHER_MENU), _timestamp(2024, 4, 1)))
+
+        self.backend.delete(CAFETERIA_ID)
+        self.assertIsNone(self.backend.get(CAFETERIA_ID))
+        self.assertIsNotNone(self.backend.get(OTHER_CAFETERIA_ID))
+
+        self.backend.clear()
+        self.assertIsNone(self.backend.get(OTHER_CAFETERIA_ID))
+
+
+class AsyncProcessLockTests(SimpleTestCase):
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(MENU_FETCH_LOCK={"BACKEND": "file", "DIRECTORY": directory.name})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    async def test_waiting_does_not_block_sync_to_async(self) -> None:
+        events: list[str] = []
+
+        async def holder() -> None:
+            async with async_process_lock("key"):
+                events.append("holder")
+                await asyncio.sleep(0.4)
+                events.append("released")
+
+        async def waiter() -> None:
+            await asyncio.sleep(0.05)
+            async with async_process_lock("key"):
+                events.append("waiter")
+
+        async def other() -> float:
+            # ロック待ちの間も、共有スレッドでの同期処理はすぐに終わる
+            await asyncio.sleep(0.1)
+            start = time.monotonic()
+            await sync_to_async(time.monotonic)()
+            return time.monotonic() - start
+
+        _, _, elapsed = await asyncio.gather(holder(), waiter(), other())
+        self.assertEqual(events, ["holder", "released", "waiter"])
+        self.assertLess(elapsed, 0.2)
+
+
+class SingleFlightMetricsTests(SimpleTestCase):
+    def test_coalesced_callers_are_counted(self) -> None:
+        flight = SingleFlight("test")
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow() -> int:
+            started.set()
+            release.wait(5)
+            return 1
+
+        leader = threading.Thread(target=flight.do, args=("key", slow))
+        leader.start()
+        started.wait(5)
+        waiters = [threading.Thread(target=flight.do, args=("key", slow)) for _ in range(3)]
+        for thread in waiters:
+            thread.start()
+        while flight.stats()["coalesced"] < 3:
+            time.sleep(0.01)
+        release.set()
+        for thread in [leader, *waiters]:
+            thread.join(5)
+
+        self.assertEqual(flight.stats(), {"executions": 1, "coalesced": 3, "in_flight": 0})
+        content = metrics.render_metrics().decode("utf-8")
+        self.assertIn('meal_fetch_executions_total{mode="test"} 1.0', content)
+        self.assertIn('meal_fetch_coalesced_total{mode="test"} 3.0', content)
+        self.assertIn('meal_fetch_in_flight{mode="test"} 0.0', content)
+
+
+class MetricsViewTests(SimpleTestCase):
+    @override_settings(MEAL_METRICS_ENABLED=False)
+    def test_disabled_returns_404(self) -> None:
+        self.assertEqual(self.client.get("/metrics").status_code, 404)
+
+    @override_settings(MEAL_METRICS_ENABLED=True, MEAL_METRICS_TOKEN=None)
+    def test_enabled_without_token(self) -> None:
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"meal_snapshot_lookups_total", response.content)
+
+    @override_settings(MEAL_METRICS_ENABLED=True, MEAL_METRICS_TOKEN="secret")
+    def test_requires_token(self) -> None:
+        self.assertEqual(self.client.get("/metrics").status_code, 401)
+        self.assertEqual(self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer wrong").status_code, 401)
+        self.assertEqual(self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer secret").status_code, 200)
+
+
+def _reference_best_combination(
+    items: list[MenuItem], budget: int, limit_primary: bool
+) -> tuple[int, list[MenuItem]]:
+    """書き換え前の素朴なDP。同じ金額では品数の少ない組み合わせを先に見つけたものから優先する。"""
+
+    def shorter(current: list[MenuItem] | None, candidate: list[MenuItem]) -> list[MenuItem]:
+        return candidate if current is None or len(candidate) < len(current) else current
+
+    if not limit_primary:
+        best: list[list[MenuItem] | None] = [[]] + [None] * budget
+        for item in items:
+            for total in range(item.price, budget + 1):
+                combo = best[total - item.price]
+                if combo is not None:
+                    best[total] = shorter(best[total], combo + [item])
+        total = max(total for total, combo in enumerate(best) if combo is not None)
+        return total, best[total]
+
+    def order(item: MenuItem) -> tuple[int, int]:
+        return (2 if is_rice_item(item) else 0 if is_primary_item(item) else 1, item.price)
+
+    ordered = sorted(items, key=order)
+    states: list[dict[tuple[bool, bool, bool], list[MenuItem]]] = [{} for _ in range(budget + 1)]
+    states[0][(False, False, False)] = []
+    for item in ordered:
+        primary, rice, don = is_primary_item(item), is_rice_item(item), is_don_primary(item)
+        if primary or rice:
+            for amount in range(budget - item.price, -1, -1):
+                for (has_primary, has_rice, primary_is_don), combo in list(states[amount].items()):
+                    if (primary and has_primary) or (rice and (has_rice or not has_primary or primary_is_don)):
+                        continue
+                    state = (has_primary or primary, has_rice or rice, don if primary else primary_is_don)
+                    target = states[amount + item.price]
+                    target[state] = shorter(target.get(state), combo + [item])
+        else:
+            for total in range(item.price, budget + 1):
+                for state, combo in list(states[total - item.price].items()):
+                    states[total][state] = shorter(states[total].get(state), combo + [item])
+    for total in range(budget, -1, -1):
+        chosen: tuple[tuple[bool, bool, bool], list[MenuItem]] | None = None
+        for state, combo in states[total].items():
+            if chosen is None or (state[0] and not chosen[0][0]) or (
+                state[0] == chosen[0][0] and len(combo) < len(chosen[1])
+            ):
+                chosen = (state, combo)
+        if chosen is not None:
+            return total, chosen[1]
+    return 0, []
+
+
+class BestCombinationTests(SimpleTestCase):
+    NAMES = ["カレー", "カツ丼", "きつねうどん", "ラーメン", "ライス", "唐揚定食", "ハンバーグ", "サラダ", "味噌汁", "焼き魚"]
+    CATEGORIES = [None, "主菜", "副菜", "麺類", "丼・カレー", "ライス", "デザート"]
+    SOLVERS = ["python"] + (["numpy"] if importlib.util.find_spec("numpy") else [])
+
+    def _menu(self, rng: random.Random) -> list[MenuItem]:
+        step = rng.choice([10, 10, 1])
+        items = []
+        for index in range(rng.randint(0, 12)):
+            price = rng.randint(0 if rng.random() < 0.03 else 3, 60) * step
+            items.append(MenuItem(f"{rng.choice(self.NAMES)}{index}", price, rng.choice(self.CATEGORIES)))
+        return items
+
+    def test_matches_reference(self) -> None:
+        rng = random.Random(0)
+        for case in range(200):
+            items = self._menu(rng)
+            budget = rng.choice([0, 100, 500, 650, 1000, rng.randint(0, 1200)])
+            for limit_primary in (False, True):
+                total, combo = _reference_best_combination(items, budget, limit_primary)
+                expected = (total, [(item.name, item.price, item.category) for item in combo])
+                for solver in self.SOLVERS:
+                    for menu in (items, MenuTable.from_items(items)):
+                        table = menu is not items
+                        with self.subTest(case=case, limit_primary=limit_primary, solver=solver, table=table):
+                            total, combo = best_combination(menu, budget, limit_primary, solver=solver)
+                            actual = (total, [(item.name, item.price, item.category) for item in combo])
+                            self.assertEqual(actual, expected)
+
+
+class MenuHTMLParserTests(SimpleTestCase):
+    HTML = """
+    <p class="toggleTitle" id="on_x"><img src="fish.png"></p>
+    <div class="catMenu"><ul><li><span class="name">焼き魚</span><span class="price">300円</span></li></ul></div>
+    <p class="toggleTitle" id="on_a"></p>
+    <div class="catMenu"><ul><li><span class="name">唐揚</span><span class="price">1,050円</span></li></ul></div>
+    <nav><p class="toggleTitle" id="on_x">主菜 (日替わり)</p></nav>
+    """
+
+    def _items(self, **kwargs) -> list[tuple[str, int, str | None]]:
+        parser = MenuHTMLParser(category_labels=DEFAULT_CATEGORY_LABELS, **kwargs)
+        parser.feed(self.HTML)
+        parser.close()
+        return [(item.name, item.price, item.category) for item in parser.get_items()]
+
+    def test_labels_after_items(self) -> None:
+        self.assertEqual(self._items(collect_labels=True), [("焼き魚", 300, "主菜"), ("唐揚", 1050, "主菜")])
+
+    def test_unknown_toggle_without_collected_labels(self) -> None:
+        self.assertEqual(self._items(), [("焼き魚", 300, "on_x"), ("唐揚", 1050, "主菜")])
+
+
+class _ConditionalMenuHandler(http.server.BaseHTTPRequestHandler):
+    body = '<ul><li><span class="name">カレーライス</span><span class="price">400円</span></li></ul>'.encode()
+    requests: list[tuple[str | None, int]] = []
+
+    def do_GET(self) -> None:
+        etag = '"v1"'
+        status = 304 if self.headers.get("If-None-Match") == etag else 200
+        self.requests.append((self.headers.get("If-None-Match"), status))
+        self.send_response(status)
+        self.send_header("ETag", etag)
+        if status == 304:
+            self.end_headers()
+            return
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+class ConditionalFetchTests(SimpleTestCase):
+    def setUp(self) -> None:
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _ConditionalMenuHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        _ConditionalMenuHandler.requests = []
+        self.url = f"http://127.0.0.1:{server.server_port}/sp/menu.php?t=1"
+
+    def test_not_modified_returns_previous_parse(self) -> None:
+        first = fetch_menu(self.url, use_playwright=False)
+        second = fetch_menu(self.url, use_playwright=False)
+
+        self.assertEqual(_rows(first), [("カレーライス", 400, None)])
+        self.assertIs(second, first)
+        self.assertEqual(_ConditionalMenuHandler.requests, [(None, 200), ('"v1"', 304)])
+
+
+class StaleWhileRevalidateTests(SimpleTestCase):
+    def test_stale_hits_schedule_one_revalidation(self) -> None:
+        cache = MenuSnapshotCache(LocMemSnapshotBackend(), ttl=60, max_stale=600, frontier_max_budget=0)
+        stale = MenuSnapshot(CAFETERIA_ID, MenuTable.from_items(MENU), time.time() - 120)
+        cache.backend.set(stale)
+        started = threading.Event()
+        release = threading.Event()
+        calls: list[str] = []
+
+        def fetch(url: str, **kwargs) -> list[MenuItem]:
+            calls.append(url)
+            started.set()
+            release.wait(5)
+            return OTHER_MENU
+
+        with mock.patch("calculator.menu_cache.fetch_menu", fetch):
+            for _ in range(3):
+                snapshot, is_stale = cache.get_snapshot(CAFETERIA_ID, use_playwright=False)
+                self.assertIs(snapshot, stale)
+                self.assertTrue(is_stale)
+            self.assertTrue(started.wait(5))
+            self.assertIs(cache.get_snapshot(CAFETERIA_ID, use_playwright=False)[0], stale)
+            release.set()
+            deadline = time.monotonic() + 5
+            while cache.get(CAFETERIA_ID) is None and time.monotonic() < deadline:
+                time.sleep(0.01)
+
+        self.assertEqual(len(calls), 1)
+        snapshot, is_stale = cache.get_snapshot(CAFETERIA_ID)
+        self.assertFalse(is_stale)
+        self.assertEqual(_rows(snapshot.items), [("きつねうどん", 300, "麺類")])
+
+
+class MenuTableFingerprintTests(SimpleTestCase):
+    def test_depends_only_on_rows(self) -> None:
+        table = MenuTable.from_items(MENU + OTHER_MENU)
+        expected = MenuTable.from_items(MENU).fingerprint()
+
+        # カテゴリ表を共有した部分テーブルや、カテゴリ表の並びが異なるテーブルでも同じ指紋になる
+        self.assertEqual(table.take(range(len(MENU))).fingerprint(), expected)
+        self.assertEqual(table[: len(MENU)].fingerprint(), expected)
+        self.assertEqual(MenuTable.from_items(list(reversed(MENU)))[::-1].fingerprint(), expected)
+        self.assertNotEqual(MenuTable.from_items(list(reversed(MENU))).fingerprint(), expected)
+        self.assertNotEqual(table.fingerprint(), expected)
+
+
+class CombinationCacheTests(SimpleTestCase):
+    def test_changed_menu_invalidates_previous_results(self) -> None:
+        cache = CombinationCache(16)
+        expected = best_combination(MENU, 500)
+        for budget in (500, 500, 300):
+            cache.best_combination(MENU, budget, menu_key=CAFETERIA_ID)
+        self.assertEqual(cache.best_combination(MENU, 500, menu_key=CAFETERIA_ID), expected)
+        self.assertEqual(cache.stats(), {"hits": 2, "misses": 2, "evictions": 0, "invalidations": 0, "entries": 2})
+
+        self.assertEqual(cache.best_combination(OTHER_MENU, 500, menu_key=CAFETERIA_ID)[0], 300)
+        self.assertEqual(cache.stats()["invalidations"], 2)
+        self.assertEqual(cache.stats()["entries"], 1)
+
+    def test_same_menu_under_other_key_is_kept(self) -> None:
+        cache = CombinationCache(16)
+        cache.best_combination(MENU, 500, menu_key=CAFETERIA_ID)
+        cache.best_combination(MENU, 500, menu_key=OTHER_CAFETERIA_ID)
+        cache.best_combination(OTHER_MENU, 500, menu_key=OTHER_CAFETERIA_ID)
+        self.assertEqual(cache.best_combination(MENU, 500, menu_key=CAFETERIA_ID), best_combination(MENU, 500))
+        self.assertEqual(cache.stats()["invalidations"], 0)
+        self.assertEqual(cache.stats()["hits"], 2)
+
+
+class SolverExecutorTests(SimpleTestCase):
+    # Python版の制約付き探索で数秒以上かかる問題
+    SLOW = ([MenuItem(f"定食{index}", 300 + index, "主菜") for index in range(150)], 200_000)
+
+    def _executor(self, **kwargs) -> SolverExecutor:
+        executor = SolverExecutor(1, **{"inline_cells": 0, **kwargs})
+        self.addCleanup(executor.close)
+        return executor
+
+    def test_small_problem_runs_inline(self) -> None:
+        executor = self._executor(inline_cells=10_000)
+        self.assertEqual(executor.best_combination(MENU, 500), best_combination(MENU, 500))
+        self.assertEqual(executor.stats()["inline"], 1)
+        self.assertEqual(executor.stats()["offloaded"], 0)
+
+    def test_full_queue_raises_busy(self) -> None:
+        executor = self._executor(max_queue=1)
+        items, budget = self.SLOW
+        job = executor.submit(items, budget, True, solver="python")
+        with self.assertRaises(SolverBusy):
+            executor.submit(MENU, 500)
+        self.assertTrue(job.cancel())
+        self.assertEqual(executor.stats()["rejected"], 1)
+
+    def test_timeout_restarts_pool(self) -> None:
+        executor = self._executor(timeout=0.2)
+        items, budget = self.SLOW
+        with self.assertRaises(SolverTimeout):
+            executor.best_combination(items, budget, True, solver="python")
+        self.assertEqual(executor.stats()["timeouts"], 1)
+        self.assertEqual(executor.stats()["restarts"], 1)
+
+        # 取り残された探索は終了され、次のジョブは新しいプールで解かれる
+        executor.timeout = 30
+        self.assertEqual(executor.best_combination(MENU, 500), best_combination(MENU, 500))
+        self.assertEqual(executor.stats()["pending"], 0)
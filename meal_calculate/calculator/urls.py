@@ -1,4 +1,5 @@
 """calculatorアプリのURL設定。"""
+from django.conf import settings
 from django.urls import path
 
 from . import views
@@ -6,5 +7,8 @@ from . import views
 app_name = "calculator"
 
 urlpatterns = [
-    path("", views.index, name="index"),
+    # ASGIサーバーで動かす場合はasync版のビューでメニュー取得中もワーカーを塞がない
+    path("", views.index_async if settings.MEAL_ASYNC_VIEWS else views.index, name="index"),
+    path("frontier", views.frontier, name="frontier"),
+    path("metrics", views.metrics_view, name="metrics"),
 ]
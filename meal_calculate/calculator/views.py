@@ -1,12 +1,25 @@
 """ビュー定義。"""
 from __future__ import annotations
 
-from django.http import HttpRequest, HttpResponse, JsonResponse
+import asyncio
+import bisect
+import hmac
+
+from django import forms
+from django.conf import settings
+from django.http import Http404, HttpRequest, HttpResponse, JsonResponse
 from django.shortcuts import render
 
+from . import metrics
 from .cafeterias import cafeteria_name, cafeteria_url
-from .forms import BudgetForm
-from meal_calculator import best_combination, fetch_menu, format_result
+from .forms import BudgetForm, FrontierForm
+from .instrumentation import instrument
+from .menu_cache import MenuSnapshot, get_menu_cache
+from .profiling import profile_view
+from meal_calculator import MenuJSONEncoder, SolverUnavailable, current_timings, format_result, timed
+
+# 混雑で計算できなかった場合に、再試行まで待つよう返す秒数
+SOLVER_RETRY_AFTER = 1
 
 
 def _expects_json(request: HttpRequest, form: BudgetForm) -> bool:
@@ -19,7 +32,7 @@ def _expects_json(request: HttpRequest, form: BudgetForm) -> bool:
     return form.data.get("output_format") == "json"
 
 
-def _serialize_form_errors(form: BudgetForm) -> dict[str, list[str]]:
+def _serialize_form_errors(form: forms.Form) -> dict[str, list[str]]:
     """フォームのエラーをJSONレスポンス用に整形する。"""
     errors: dict[str, list[str]] = {}
     for field, messages in form.errors.get_json_data().items():
@@ -27,8 +40,8 @@ def _serialize_form_errors(form: BudgetForm) -> dict[str, list[str]]:
     return errors
 
 
-def index(request: HttpRequest) -> HttpResponse:
-    """予算入力フォームと結果を表示するビュー。"""
+def _index_context(request: HttpRequest) -> tuple[BudgetForm, dict[str, object]]:
+    """トップページのフォームと、結果を埋める前のテンプレートコンテキストを作る。"""
 
     form = BudgetForm(request.POST or None)
     context: dict[str, object] = {
@@ -39,79 +52,232 @@ def index(request: HttpRequest) -> HttpResponse:
     current_cafeteria = form["cafeteria"].value()
     if current_cafeteria:
         context["selected_cafeteria"] = cafeteria_name(current_cafeteria)
+    return form, context
+
+
+def _form_response(request: HttpRequest, form: BudgetForm, context: dict[str, object]) -> HttpResponse:
+    """フォームのみ (GET、または入力エラー) のレスポンスを返す。"""
+
+    if request.method == "POST" and _expects_json(request, form):
+        return JsonResponse(
+            {
+                "error": "入力内容を確認してください。",
+                "field_errors": _serialize_form_errors(form),
+            },
+            status=400,
+            json_dumps_params={"ensure_ascii": False},
+        )
+    return render(request, "calculator/index.html", context)
+
+
+def _error_response(
+    request: HttpRequest, form: BudgetForm, context: dict[str, object], exc: BaseException
+) -> HttpResponse:
+    """メニューを取得できなかった、または混雑で計算できなかった場合のレスポンスを返す。"""
 
-    if request.method == "POST":
-        expects_json = _expects_json(request, form)
-        if form.is_valid():
-            budget = form.cleaned_data["budget"]
-            cafeteria_id = form.cleaned_data["cafeteria"]
-            url = cafeteria_url(cafeteria_id)
-            selected_cafeteria = cafeteria_name(cafeteria_id)
-            output_format = form.cleaned_data["output_format"]
-            limit_primary = form.cleaned_data["limit_primary"]
-            use_playwright = True
-
-            try:
-                items = fetch_menu(url, use_playwright=use_playwright)
-                total, combo = best_combination(items, budget, limit_primary=limit_primary)
-            except SystemExit as exc:
-                if expects_json or output_format == "json":
-                    return JsonResponse(
-                        {"error": str(exc)},
-                        status=400,
-                        json_dumps_params={"ensure_ascii": False},
-                    )
-                context.update(
-                    {
-                        "error": str(exc),
-                        "limit_primary_checked": limit_primary,
-                        "selected_cafeteria": selected_cafeteria,
-                    }
-                )
-                return render(request, "calculator/index.html", context)
-
-            payload = {
-                "total": total,
-                "items": [
-                    {"name": item.name, "price": item.price, "category": item.category}
-                    for item in combo
-                ],
-                "menu_items": [
-                    {"name": item.name, "price": item.price, "category": item.category}
-                    for item in items
-                ],
-                "budget": budget,
-                "url": url,
-                "cafeteria_id": cafeteria_id,
-                "cafeteria_name": selected_cafeteria,
-                "limit_primary": limit_primary,
-                "use_playwright": use_playwright,
+    status = 503 if isinstance(exc, SolverUnavailable) else 400
+    if _expects_json(request, form) or form.cleaned_data["output_format"] == "json":
+        response: HttpResponse = JsonResponse(
+            {"error": str(exc)},
+            status=status,
+            json_dumps_params={"ensure_ascii": False},
+        )
+    else:
+        context.update(
+            {
+                "error": str(exc),
+                "limit_primary_checked": form.cleaned_data["limit_primary"],
+                "selected_cafeteria": cafeteria_name(form.cleaned_data["cafeteria"]),
             }
+        )
+        response = render(request, "calculator/index.html", context, status=status)
+    if status == 503:
+        response["Retry-After"] = str(SOLVER_RETRY_AFTER)
+    return response
+
+
+def _result_response(
+    request: HttpRequest,
+    form: BudgetForm,
+    context: dict[str, object],
+    snapshot: MenuSnapshot,
+    stale: bool,
+    result: tuple[int, list],
+    *,
+    use_playwright: bool,
+) -> HttpResponse:
+    """計算結果をJSONまたはHTMLで返す。"""
+
+    budget = form.cleaned_data["budget"]
+    cafeteria_id = form.cleaned_data["cafeteria"]
+    selected_cafeteria = cafeteria_name(cafeteria_id)
+    output_format = form.cleaned_data["output_format"]
+    limit_primary = form.cleaned_data["limit_primary"]
+    items = snapshot.items
+    total, combo = result
+
+    if _expects_json(request, form) or output_format == "json":
+        payload = {
+            "total": total,
+            "items": combo,
+            "menu_items": items,
+            "budget": budget,
+            "url": cafeteria_url(cafeteria_id),
+            "cafeteria_id": cafeteria_id,
+            "cafeteria_name": selected_cafeteria,
+            "limit_primary": limit_primary,
+            "use_playwright": use_playwright,
+            "stale": stale,
+        }
+        timings = current_timings()
+        if timings is not None and getattr(settings, "MEAL_TIMINGS_IN_PAYLOAD", False):
+            payload["timings"] = timings.to_dict()
+        json_kwargs: dict[str, object] = {"ensure_ascii": False}
+        if output_format == "json":
+            json_kwargs["indent"] = 2
+        with timed("render"):
+            return JsonResponse(payload, encoder=MenuJSONEncoder, json_dumps_params=json_kwargs)
+
+    context.update(
+        {
+            "result": format_result(total, combo),
+            "items": combo,
+            "menu_items": items,
+            "total": total,
+            "stale": stale,
+            "limit_primary_checked": limit_primary,
+            "selected_cafeteria": selected_cafeteria,
+        }
+    )
+    with timed("render"):
+        return render(request, "calculator/index.html", context)
+
+
+@instrument
+@profile_view
+def index(request: HttpRequest) -> HttpResponse:
+    """予算入力フォームと結果を表示するビュー。"""
 
-            if expects_json or output_format == "json":
-                json_kwargs: dict[str, object] = {"ensure_ascii": False}
-                if output_format == "json":
-                    json_kwargs["indent"] = 2
-                return JsonResponse(payload, json_dumps_params=json_kwargs)
-
-            context.update(
-                {
-                    "result": format_result(total, combo),
-                    "items": combo,
-                    "menu_items": items,
-                    "total": total,
-                    "limit_primary_checked": limit_primary,
-                    "selected_cafeteria": selected_cafeteria,
-                }
+    form, context = _index_context(request)
+    if request.method != "POST" or not form.is_valid():
+        return _form_response(request, form, context)
+
+    cafeteria_id = form.cleaned_data["cafeteria"]
+    use_playwright = True
+    try:
+        cache = get_menu_cache()
+        with timed("snapshot"):
+            snapshot, stale = cache.get_snapshot(cafeteria_id, use_playwright=use_playwright)
+        with timed("solve"):
+            result = cache.best_combination(
+                snapshot, form.cleaned_data["budget"], limit_primary=form.cleaned_data["limit_primary"]
             )
-        else:
-            if expects_json:
-                return JsonResponse(
-                    {
-                        "error": "入力内容を確認してください。",
-                        "field_errors": _serialize_form_errors(form),
-                    },
-                    status=400,
-                    json_dumps_params={"ensure_ascii": False},
-                )
-    return render(request, "calculator/index.html", context)
+    except (SystemExit, SolverUnavailable) as exc:
+        return _error_response(request, form, context, exc)
+    return _result_response(request, form, context, snapshot, stale, result, use_playwright=use_playwright)
+
+
+@instrument
+@profile_view
+async def index_async(request: HttpRequest) -> HttpResponse:
+    """`index` のasync版。ASGIサーバー上で、メニュー取得中もワーカーを塞がない。
+
+    メニューの取得はイベントループ上で待ち、最適解の計算はスレッドプールで行う。
+    """
+
+    form, context = _index_context(request)
+    if request.method != "POST" or not form.is_valid():
+        return _form_response(request, form, context)
+
+    cafeteria_id = form.cleaned_data["cafeteria"]
+    use_playwright = True
+    try:
+        cache = get_menu_cache()
+        with timed("snapshot"):
+            snapshot, stale = await cache.get_snapshot_async(cafeteria_id, use_playwright=use_playwright)
+        with timed("solve"):
+            result = await asyncio.to_thread(
+                cache.best_combination,
+                snapshot,
+                form.cleaned_data["budget"],
+                limit_primary=form.cleaned_data["limit_primary"],
+            )
+    except (SystemExit, SolverUnavailable) as exc:
+        return _error_response(request, form, context, exc)
+    return _result_response(request, form, context, snapshot, stale, result, use_playwright=use_playwright)
+
+
+@instrument
+def frontier(request: HttpRequest) -> JsonResponse:
+    """0円から上限金額までの全予算の最適解を、最適合計が変わる金額ごとに返すAPI。
+
+    各段の `items` は `menu_items` の添字列。予算Bの結果は `total` がB以下で最大の段になる。
+    """
+
+    form = FrontierForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse(
+            {
+                "error": "入力内容を確認してください。",
+                "field_errors": _serialize_form_errors(form),
+            },
+            status=400,
+            json_dumps_params={"ensure_ascii": False},
+        )
+
+    cafeteria_id = form.cleaned_data["cafeteria"]
+    limit_primary = form.cleaned_data["limit_primary"]
+    cache = get_menu_cache()
+    try:
+        with timed("snapshot"):
+            snapshot, stale = cache.get_snapshot(cafeteria_id)
+    except SystemExit as exc:
+        return JsonResponse({"error": str(exc)}, status=400, json_dumps_params={"ensure_ascii": False})
+
+    with timed("frontier"):
+        frontier = cache.frontier(snapshot, limit_primary)
+    max_budget = form.cleaned_data["max_budget"]
+    if max_budget is None:
+        max_budget = frontier.max_budget
+    elif max_budget > frontier.max_budget:
+        return JsonResponse(
+            {
+                "error": "入力内容を確認してください。",
+                "field_errors": {"max_budget": [f"{frontier.max_budget}以下の値を入力してください。"]},
+            },
+            status=400,
+            json_dumps_params={"ensure_ascii": False},
+        )
+
+    steps = bisect.bisect_right(frontier.totals, max_budget)
+    payload = {
+        "cafeteria_id": cafeteria_id,
+        "cafeteria_name": cafeteria_name(cafeteria_id),
+        "limit_primary": limit_primary,
+        "max_budget": max_budget,
+        "stale": stale,
+        "steps": [
+            {"total": frontier.totals[step], "items": frontier.combo_indices(step)}
+            for step in range(steps)
+        ],
+        "menu_items": snapshot.items,
+    }
+    return JsonResponse(payload, encoder=MenuJSONEncoder, json_dumps_params={"ensure_ascii": False})
+
+
+def metrics_view(request: HttpRequest) -> HttpResponse:
+    """メニュー取得・キャッシュ・探索のメトリクスをPrometheusのテキスト形式で返す。"""
+
+    if not getattr(settings, "MEAL_METRICS_ENABLED", False):
+        raise Http404
+    token = getattr(settings, "MEAL_METRICS_TOKEN", None)
+    if token and not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+        return HttpResponse(status=401, headers={"WWW-Authenticate": "Bearer"})
+    content = metrics.render_metrics()
+    if content is None:
+        return HttpResponse(
+            "prometheus_client がインストールされていません。`pip install prometheus-client` を実行してください。",
+            status=503,
+            content_type="text/plain; charset=utf-8",
+        )
+    return HttpResponse(content, content_type=metrics.CONTENT_TYPE)
@@ -0,0 +1,26 @@
+"""gunicornの設定。`gunicorn` を meal_calculate ディレクトリで起動すると自動で読み込まれる。
+
+環境変数 `PROMETHEUS_MULTIPROC_DIR` を指定した場合、メトリクスを全ワーカーで合算するため
+起動時に共有ディレクトリを空にし、終了したワーカーの値を集計対象から外す。
+"""
+import os
+from pathlib import Path
+
+
+def on_starting(server):
+    directory = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if not directory:
+        return
+    path = Path(directory)
+    path.mkdir(parents=True, exist_ok=True)
+    # 前回起動時のワーカーの値が残らないようにする
+    for stale in path.glob("*.db"):
+        stale.unlink()
+
+
+def child_exit(server, worker):
+    if not os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        return
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
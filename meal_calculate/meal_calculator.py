@@ -2,18 +2,54 @@
 from __future__ import annotations
 
 import argparse
+import asyncio
+import atexit
+import base64
+import bisect
+import contextlib
+import contextvars
 import dataclasses
+import functools
+import hashlib
 import html
+import http.client
+import importlib.util
+import io
 import json
+import math
+import os
+import queue
 import re
+import ssl
+import sys
+import threading
+import time
 import urllib.error
-import urllib.request
 import urllib.parse
+import urllib.request
+import weakref
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from html.parser import HTMLParser
-from typing import List, Optional, Sequence, Tuple
+from pathlib import Path
+from typing import Any, Callable, Iterator, List, Optional, Sequence, Tuple, Union
 
 
 MENU_URL = "https://west2-univ.jp/sp/menu.php?t=650111"
+FRAGMENT_TIMEOUT = 10.0
+FRAGMENT_RETRIES = 2
+FRAGMENT_BACKOFF = 0.5
+FRAGMENT_MAX_PER_HOST = 4
+INTERCEPT_TIMEOUT = 15.0
+# ブラウザでのページ取得1件 (空き待ちを含む) の上限秒数
+BROWSER_TIMEOUT = 60.0
+# ドライバの起動に失敗したスレッドが再試行するまでの待ち時間 (失敗ごとに倍、上限あり)
+BROWSER_START_BACKOFF = 1.0
+BROWSER_START_BACKOFF_MAX = 30.0
+INTERCEPT_QUIET_PERIOD = 0.3
+BLOCKED_RESOURCE_TYPES = {"image", "font", "stylesheet", "media"}
+HTTP_USER_AGENT = "meal-calculate/1.0 (+https://github.com/yayuyokano/meal_calculate)"
 DEFAULT_CATEGORY_LABELS = {
     "on_a": "主菜",
     "on_b": "副菜",
@@ -63,34 +99,137 @@ SIDE_DISH_KEYWORDS = [
 ]
 
 
+ITEM_PRIMARY = 1
+ITEM_RICE = 2
+ITEM_DON = 4
+
+_NAME_DON = 1
+_NAME_NOODLE = 2
+_NAME_RICE = 4
+_NAME_MAIN = 8
+
+
+class _KeywordAutomaton:
+    """複数のキーワードを1回の走査で検出するAho-Corasickオートマトン。
+
+    各キーワードには整数の値を対応させ、テキスト中に現れたキーワードの値の論理和 (`mask`)
+    または最小値 (`first`) を返す。
+    """
+
+    def __init__(self, keywords: Sequence[tuple[str, int]]) -> None:
+        self._goto: List[dict[str, int]] = [{}]
+        outputs: List[List[int]] = [[]]
+        for keyword, value in keywords:
+            state = 0
+            for char in keyword:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    outputs.append([])
+                state = next_state
+            outputs[state].append(value)
+
+        self._fail = [0] * len(self._goto)
+        pending = list(self._goto[0].values())
+        while pending:
+            state = pending.pop(0)
+            for char, next_state in self._goto[state].items():
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[next_state] = target if target != next_state else 0
+                outputs[next_state].extend(outputs[self._fail[next_state]])
+                pending.append(next_state)
+
+        self._mask = [0] * len(outputs)
+        self._first: List[Optional[int]] = [None] * len(outputs)
+        for state, values in enumerate(outputs):
+            for value in values:
+                self._mask[state] |= value
+            self._first[state] = min(values) if values else None
+
+    def _states(self, text: str):
+        goto, fail = self._goto, self._fail
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            yield state
+
+    def mask(self, text: str) -> int:
+        """テキスト中に現れたキーワードの値の論理和を返す。"""
+
+        result = 0
+        mask = self._mask
+        for state in self._states(text):
+            result |= mask[state]
+        return result
+
+    def first(self, text: str) -> Optional[int]:
+        """テキスト中に現れたキーワードの値の最小値を返す。見つからなければNone。"""
+
+        result: Optional[int] = None
+        first = self._first
+        for state in self._states(text):
+            value = first[state]
+            if value is not None and (result is None or value < result):
+                result = value
+        return result
+
+
+_CATEGORY_MATCHER = _KeywordAutomaton([(keyword, index) for index, (keyword, _) in enumerate(CATEGORY_KEYWORD_RULES)])
+_NAME_MATCHER = _KeywordAutomaton(
+    [(keyword, _NAME_DON) for keyword in CURRY_DON_KEYWORDS]
+    + [(keyword, _NAME_NOODLE) for keyword in NOODLE_KEYWORDS]
+    + [(keyword, _NAME_RICE) for keyword in RICE_KEYWORDS]
+    + [(keyword, _NAME_MAIN) for keyword in MAIN_DISH_KEYWORDS]
+)
+# 英語表記は小文字化した品名に対しても照合する
+_LOWER_NAME_MATCHER = _KeywordAutomaton(
+    [("curry", _NAME_DON), ("don", _NAME_DON), ("noodle", _NAME_NOODLE), ("rice", _NAME_RICE)]
+)
+
+
 def canonical_category(label: Optional[str]) -> Optional[str]:
     """カテゴリ名を規格化する。既知キーワードが含まれる場合は統一名を返す。"""
 
     if not label:
         return None
     clean = label.strip()
-    for keyword, canonical in CATEGORY_KEYWORD_RULES:
-        if keyword in clean:
-            return canonical
+    # 複数のキーワードが含まれる場合は CATEGORY_KEYWORD_RULES で先に定義された規則を優先する
+    rule = _CATEGORY_MATCHER.first(clean)
+    if rule is not None:
+        return CATEGORY_KEYWORD_RULES[rule][1]
     return clean
 
 
-def infer_category_from_name(name: str) -> Optional[str]:
-    """品名から推測したカテゴリを返す。確信が持てない場合はNone。"""
-
+def _name_keyword_mask(name: str) -> int:
     normalized = name.strip()
-    lower = normalized.lower()
-    if any(keyword in normalized for keyword in CURRY_DON_KEYWORDS) or any(keyword in lower for keyword in ("curry", "don")):
+    return _NAME_MATCHER.mask(normalized) | _LOWER_NAME_MATCHER.mask(normalized.lower())
+
+
+def _category_from_name_mask(mask: int) -> Optional[str]:
+    if mask & _NAME_DON:
         return "丼・カレー"
-    if any(keyword in normalized for keyword in NOODLE_KEYWORDS) or any(keyword in lower for keyword in ("noodle",)):
+    if mask & _NAME_NOODLE:
         return "麺類"
-    if any(keyword in normalized for keyword in RICE_KEYWORDS) or any(keyword in lower for keyword in ("rice",)):
+    if mask & _NAME_RICE:
         return "ライス"
-    if any(keyword in normalized for keyword in MAIN_DISH_KEYWORDS):
+    if mask & _NAME_MAIN:
         return "主菜"
     return None
 
 
+def infer_category_from_name(name: str) -> Optional[str]:
+    """品名から推測したカテゴリを返す。確信が持てない場合はNone。"""
+
+    return _category_from_name_mask(_name_keyword_mask(name))
+
+
 def is_primary_category(label: Optional[str]) -> bool:
     """主菜系カテゴリかどうかを判定する。"""
 
@@ -105,128 +244,359 @@ def is_rice_category(label: Optional[str]) -> bool:
     return canonical == "ライス"
 
 
+def classify_item(name: str, category: Optional[str]) -> int:
+    """品名とカテゴリから分類ビット (ITEM_PRIMARY / ITEM_RICE / ITEM_DON) を求める。"""
+
+    canonical = canonical_category(category)
+    name_mask = _name_keyword_mask(name)
+    inferred = _category_from_name_mask(name_mask)
+
+    flags = 0
+    is_rice = canonical == "ライス" or inferred == "ライス"
+    if is_rice:
+        flags |= ITEM_RICE
+    if canonical in PRIMARY_LIMIT_CATEGORIES or (not is_rice and inferred in PRIMARY_LIMIT_CATEGORIES):
+        flags |= ITEM_PRIMARY
+    if canonical == "丼・カレー" or inferred == "丼・カレー":
+        flags |= ITEM_DON
+    return flags
+
+
 def is_primary_item(item: MenuItem) -> bool:
     """品目が主菜グループに属するかどうかを判定する。"""
 
-    if is_primary_category(item.category):
-        return True
-    if is_rice_item(item):
-        return False
-    inferred = infer_category_from_name(item.name)
-    if inferred in PRIMARY_LIMIT_CATEGORIES:
-        return True
-    normalized = item.name.strip()
-    if any(keyword in normalized for keyword in SIDE_DISH_KEYWORDS):
-        return False
-    return False
+    return bool(item.flags & ITEM_PRIMARY)
 
 
 def is_don_primary(item: MenuItem) -> bool:
     """主菜が丼・カレー系かどうかを判定する。"""
 
-    if canonical_category(item.category) == "丼・カレー":
-        return True
-    inferred = infer_category_from_name(item.name)
-    return inferred == "丼・カレー"
+    return bool(item.flags & ITEM_DON)
 
 
 def is_rice_item(item: MenuItem) -> bool:
     """品目がライスカテゴリかどうかを判定する。"""
 
-    if is_rice_category(item.category):
-        return True
-    inferred = infer_category_from_name(item.name)
-    return inferred == "ライス"
+    return bool(item.flags & ITEM_RICE)
 
 
 @dataclasses.dataclass(frozen=True)
 class MenuItem:
-    """メニュー名と価格を保持するデータクラス。"""
+    """メニュー名と価格を保持するデータクラス。
+
+    分類ビット `flags` は生成時に1回だけ計算して保持する (引数・比較・reprの対象外)。
+    """
 
     name: str
     price: int
     category: Optional[str] = None
+    flags: int = dataclasses.field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        object.__setattr__(self, "flags", classify_item(self.name, self.category))
+
+
+class MenuRow:
+    """`MenuTable` の1行を指す読み取り専用ビュー。
+
+    値は複製せずテーブルの配列を参照する。`MenuItem` と同じ属性を持ち、同じ値の
+    `MenuItem` とは等価・同一ハッシュとして扱われる。
+    """
+
+    __slots__ = ("_table", "_index")
+
+    def __init__(self, table: "MenuTable", index: int) -> None:
+        self._table = table
+        self._index = index
+
+    @property
+    def name(self) -> str:
+        return self._table.names[self._index]
+
+    @property
+    def price(self) -> int:
+        return self._table.prices[self._index]
+
+    @property
+    def category(self) -> Optional[str]:
+        return self._table.categories[self._table.category_codes[self._index]]
+
+    @property
+    def flags(self) -> int:
+        return self._table.flags[self._index]
+
+    def _key(self) -> tuple[str, int, Optional[str]]:
+        return (self.name, self.price, self.category)
+
+    def to_item(self) -> MenuItem:
+        return MenuItem(self.name, self.price, self.category)
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, (MenuRow, MenuItem)):
+            return self._key() == (other.name, other.price, other.category)
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        # frozen dataclassであるMenuItemのハッシュと一致させる
+        return hash(self._key())
+
+    def __repr__(self) -> str:
+        return f"MenuItem(name={self.name!r}, price={self.price!r}, category={self.category!r})"
+
+
+class MenuTable(Sequence[MenuRow]):
+    """メニュー一覧を列ごとの配列で保持する読み取り専用テーブル。
+
+    価格と分類ビットは整数配列、カテゴリは重複を除いたカテゴリ表への番号、名前は
+    intern済み文字列のタプルとして保持する。添字アクセスでは `MenuRow` を返す。
+    """
+
+    __slots__ = ("names", "prices", "category_codes", "categories", "flags", "_fingerprint")
+
+    def __init__(
+        self,
+        names: Sequence[str],
+        prices: Sequence[int],
+        category_codes: Sequence[int],
+        categories: Sequence[Optional[str]],
+        flags: Optional[Sequence[int]] = None,
+        *,
+        fingerprint: Optional[str] = None,
+    ) -> None:
+        if not len(names) == len(prices) == len(category_codes):
+            raise ValueError("names, prices, category_codesの長さが一致しません")
+        self.names: tuple[str, ...] = tuple(sys.intern(name) for name in names)
+        self.prices = array("i", prices)
+        self.category_codes = array("H", category_codes)
+        self.categories: tuple[Optional[str], ...] = tuple(
+            None if label is None else sys.intern(label) for label in categories
+        )
+        if flags is None:
+            flags = [
+                classify_item(name, self.categories[code])
+                for name, code in zip(self.names, self.category_codes)
+            ]
+        self.flags = array("B", flags)
+        # 保存済みの `fingerprint()` の値 (同じ内容のもの) を渡せば計算を省ける
+        self._fingerprint = fingerprint
+
+    @classmethod
+    def from_items(cls, items: Sequence[Any]) -> "MenuTable":
+        """`MenuItem` (または同じ属性を持つオブジェクト) の列からテーブルを作る。"""
+
+        if isinstance(items, MenuTable):
+            return items
+        codes: dict[Optional[str], int] = {None: 0}
+        category_codes = []
+        for item in items:
+            category_codes.append(codes.setdefault(item.category, len(codes)))
+        return cls(
+            [item.name for item in items],
+            [item.price for item in items],
+            category_codes,
+            list(codes),
+            [item.flags for item in items],
+        )
+
+    @classmethod
+    def from_records(cls, records: Sequence[dict[str, Any]]) -> "MenuTable":
+        """`{"name", "price", "category"}` 形式の辞書の列からテーブルを作る。"""
+
+        return cls.from_items(
+            [MenuItem(str(entry["name"]), int(entry["price"]), entry.get("category")) for entry in records]
+        )
+
+    def to_records(self) -> List[dict[str, Any]]:
+        """JSON出力用に `{"name", "price", "category"}` 形式の辞書の一覧へ変換する。"""
+
+        categories = self.categories
+        return [
+            {"name": name, "price": price, "category": categories[code]}
+            for name, price, code in zip(self.names, self.prices, self.category_codes)
+        ]
+
+    def to_dict(self) -> dict[str, Any]:
+        """列ごとの形式で辞書化する。`from_dict` で復元できる。"""
+
+        return {
+            "names": list(self.names),
+            "prices": self.prices.tolist(),
+            "category_codes": self.category_codes.tolist(),
+            "categories": list(self.categories),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any], *, fingerprint: Optional[str] = None) -> "MenuTable":
+        return cls(
+            data["names"], data["prices"], data["category_codes"], data["categories"], fingerprint=fingerprint
+        )
+
+    def fingerprint(self) -> str:
+        """内容 (並び順を含む) から求めたSHA-256ハッシュ。初回のみ計算する。
+
+        カテゴリ表の並びや未使用のカテゴリ (`take` で共有したものなど) に左右されないよう、
+        (名前, 価格, カテゴリ名) の列だけから求める。
+        """
+
+        if self._fingerprint is None:
+            categories = self.categories
+            rows = [
+                [name, price, categories[code]]
+                for name, price, code in zip(self.names, self.prices, self.category_codes)
+            ]
+            encoded = json.dumps(rows, ensure_ascii=False, separators=(",", ":"))
+            self._fingerprint = hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+        return self._fingerprint
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __getitem__(self, index: Any) -> Any:
+        if isinstance(index, slice):
+            return self.take(range(len(self.names))[index])
+        if index < 0:
+            index += len(self.names)
+        if not 0 <= index < len(self.names):
+            raise IndexError("MenuTable index out of range")
+        return MenuRow(self, index)
+
+    def __iter__(self) -> Iterator[MenuRow]:
+        for index in range(len(self.names)):
+            yield MenuRow(self, index)
+
+    def take(self, indices: Sequence[int]) -> "MenuTable":
+        """指定した行だけを持つテーブルを返す。カテゴリ表は共有する。"""
+
+        return MenuTable(
+            [self.names[index] for index in indices],
+            [self.prices[index] for index in indices],
+            [self.category_codes[index] for index in indices],
+            self.categories,
+            [self.flags[index] for index in indices],
+        )
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, MenuTable):
+            return self.to_records() == other.to_records()
+        if isinstance(other, (list, tuple)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    __hash__ = None  # type: ignore[assignment]
+
+    def __repr__(self) -> str:
+        return f"MenuTable({len(self)} items)"
+
+
+class MenuJSONEncoder(json.JSONEncoder):
+    """`MenuTable`・`MenuRow`・`MenuItem`・`BudgetFrontier` をそのままJSON化できるエンコーダ。
+
+    `BudgetFrontier` は各段の組み合わせを `menu_items` の添字列として出力する。
+    """
+
+    def default(self, o: Any) -> Any:
+        if isinstance(o, MenuTable):
+            return o.to_records()
+        if isinstance(o, (MenuRow, MenuItem)):
+            return {"name": o.name, "price": o.price, "category": o.category}
+        if isinstance(o, BudgetFrontier):
+            return {
+                "max_budget": o.max_budget,
+                "limit_primary": o.limit_primary,
+                "steps": [
+                    {"total": total, "items": o.combo_indices(step)}
+                    for step, total in enumerate(o.totals)
+                ],
+                "menu_items": o.items,
+            }
+        return super().default(o)
+
+
+def _keyword_pattern(keywords: set[str]) -> re.Pattern[str]:
+    return re.compile("|".join(re.escape(keyword) for keyword in sorted(keywords)))
+
+
+class _ToggleRef:
+    """カテゴリ見出し (toggleTitle) のidへの参照。表示名は項目を返す時点で解決する。"""
+
+    __slots__ = ("toggle_id",)
+
+    def __init__(self, toggle_id: str) -> None:
+        self.toggle_id = toggle_id
 
 
 class MenuHTMLParser(HTMLParser):
-    """学食メニューのHTMLから項目を抽出するパーサー。"""
+    """学食メニューのHTMLからカテゴリ見出しと項目を1回の走査で抽出するパーサー。
+
+    `collect_labels` がTrueの場合、文書中の見出し (toggleTitle) の表示名も収集し、
+    `category_labels` より優先して項目のカテゴリ解決に用いる。見出しの解決は
+    `get_items` の時点で行うため、見出しが項目より後に現れても結果は変わらない。
+    """
 
     _price_pattern = re.compile(r"(\d[\d,]*)")
     _name_keywords = {"name", "menu", "item", "title", "meal", "dish", "セット", "商品", "品名", "メニュー"}
     _price_keywords = {"price", "yen", "amount", "value", "cost", "料金", "価格", "金額", "税込"}
     _entry_keywords = {"item", "entry", "row", "menu", "list", "card", "line", "block"}
+    _name_re = _keyword_pattern(_name_keywords)
+    _price_re = _keyword_pattern(_price_keywords)
+    _entry_re = _keyword_pattern(_entry_keywords)
+    _role_attrs = ("class", "id", "data-role", "data-type", "aria-label", "itemprop")
+    _entry_attrs = ("class", "id", "data-role", "data-type")
+    _heading_tags = {"h1", "h2", "h3", "h4", "h5", "h6"}
+    _entry_tags = {"div", "section", "article", "dl"}
 
     def __init__(
         self,
         category: Optional[str] = None,
         *,
         category_labels: Optional[dict[str, Optional[str]]] = None,
+        collect_labels: bool = False,
     ) -> None:
         super().__init__()
-        self._stack: List[str] = []
-        self._capture_stack: List[Optional[str]] = []
+        self._depth = 0
+        self._role_stack: List[Optional[str]] = []
         self._current_name_parts: List[str] = []
         self._current_price: Optional[int] = None
-        self._items: List[MenuItem] = []
+        self._entries: List[tuple[str, int, object]] = []
         self._seen_pairs: set[tuple[str, int]] = set()
         self._base_category = canonical_category(category)
-        self._current_category: Optional[str] = self._base_category
+        self._current_category: object = self._base_category
         self._category_labels: dict[str, Optional[str]] = {
             key: canonical_category(value) if value else None
             for key, value in (category_labels or {}).items()
         }
-        self._pending_category: Optional[str] = None
-        self._category_context_stack: List[Optional[str]] = []
+        self._collect_labels = collect_labels
+        self.labels: dict[str, str] = {}
+        self._label_capture_id: Optional[str] = None
+        self._pending_category: object = None
+        self._category_context_stack: List[object] = []
 
     @staticmethod
-    def _has_keyword(value: Optional[str], keywords: set[str]) -> bool:
-        if not value:
-            return False
-        lower = value.lower()
-        for keyword in keywords:
-            if keyword in lower or keyword in value:
-                return True
-        return False
+    def _attr_role(value: Optional[str]) -> Optional[str]:
+        return _classify_attr_role(value) if value else None
+
+    @staticmethod
+    def _attr_is_entry(value: Optional[str]) -> bool:
+        return _classify_attr_entry(value) if value else False
 
     def _detect_role(self, tag: str, attrs: dict[str, Optional[str]]) -> Optional[str]:
-        if tag in {"h1", "h2", "h3", "h4", "h5", "h6"}:
+        if tag in self._heading_tags:
             return "name"
         if attrs.get("data-price"):
             return "price"
-        for key in ("class", "id", "data-role", "data-type", "aria-label", "itemprop"):
-            value = attrs.get(key)
-            if self._has_keyword(value, self._price_keywords):
-                return "price"
-            if self._has_keyword(value, self._name_keywords):
-                return "name"
-        if tag in {"th", "thead"}:
-            return None
-        itemprop = attrs.get("itemprop")
-        if itemprop:
-            if self._has_keyword(itemprop, self._price_keywords):
-                return "price"
-            if self._has_keyword(itemprop, self._name_keywords):
-                return "name"
+        for key in self._role_attrs:
+            role = self._attr_role(attrs.get(key))
+            if role:
+                return role
         return None
 
     def _maybe_start_new_entry(self, tag: str, attrs: dict[str, Optional[str]]) -> None:
-        if tag in {"li", "tr"}:
-            self._commit_if_ready()
-            self._current_name_parts = []
-            self._current_price = None
-            return
-        if tag == "dt":
+        if tag in {"li", "tr", "dt"} or (
+            tag in self._entry_tags and any(self._attr_is_entry(attrs.get(key)) for key in self._entry_attrs)
+        ):
             self._commit_if_ready()
             self._current_name_parts = []
             self._current_price = None
-            return
-        if tag in {"div", "section", "article", "dl"}:
-            for key in ("class", "id", "data-role", "data-type"):
-                if self._has_keyword(attrs.get(key), self._entry_keywords):
-                    self._commit_if_ready()
-                    self._current_name_parts = []
-                    self._current_price = None
-                    return
 
     def _commit_if_ready(self) -> None:
         if not self._current_name_parts or self._current_price is None:
@@ -237,36 +607,37 @@ class MenuHTMLParser(HTMLParser):
         pair = (name, self._current_price)
         if pair in self._seen_pairs:
             return
-        category = canonical_category(self._current_category or self._base_category)
-        self._items.append(MenuItem(name, self._current_price, category))
+        self._entries.append((name, self._current_price, self._current_category))
         self._seen_pairs.add(pair)
         self._current_name_parts = []
         self._current_price = None
 
     def handle_starttag(self, tag: str, attrs: Sequence[Tuple[str, Optional[str]]]) -> None:
         attrs_dict = dict(attrs)
-        self._stack.append(tag)
+        self._depth += 1
         self._maybe_start_new_entry(tag, attrs_dict)
 
         new_category = self._current_category
         if tag == "p" and attrs_dict.get("class") == "toggleTitle":
             toggle_id = attrs_dict.get("id")
             if toggle_id:
-                pending = self._category_labels.get(toggle_id)
-                if pending is None:
-                    pending = toggle_id
-                self._pending_category = pending
+                self._pending_category = _ToggleRef(toggle_id)
+                if self._collect_labels:
+                    self._label_capture_id = toggle_id
         else:
             classes = (attrs_dict.get("class") or "").split()
             if "catMenu" in classes:
-                new_category = self._pending_category if self._pending_category is not None else None
+                new_category = self._pending_category
                 self._pending_category = None
 
         self._category_context_stack.append(self._current_category)
         self._current_category = new_category
 
         role = self._detect_role(tag, attrs_dict)
-        self._capture_stack.append(role)
+        if role is None and self._role_stack:
+            # 直近の役割付き祖先を引き継ぎ、テキスト処理時にスタックを遡らずに済ませる
+            role = self._role_stack[-1]
+        self._role_stack.append(role)
 
         data_price = attrs_dict.get("data-price")
         if data_price:
@@ -276,30 +647,38 @@ class MenuHTMLParser(HTMLParser):
                 pass
 
     def handle_endtag(self, tag: str) -> None:
-        if self._stack:
-            self._stack.pop()
-        if self._capture_stack:
-            self._capture_stack.pop()
+        if self._depth:
+            self._depth -= 1
+        if self._role_stack:
+            self._role_stack.pop()
         if self._category_context_stack:
             self._current_category = self._category_context_stack.pop()
         else:
             self._current_category = self._base_category
+        if tag == "p":
+            self._label_capture_id = None
         if tag in {"li", "tr"}:
             self._commit_if_ready()
 
     def handle_data(self, data: str) -> None:
-        if not self._capture_stack:
+        if self._label_capture_id is not None:
+            label = data.strip()
+            if label:
+                self.labels[self._label_capture_id] = label.split()[0]
+        if not self._role_stack:
+            return
+        role = self._role_stack[-1]
+        if role is None:
             return
         text = data.strip()
         if not text:
             return
 
-        role = next((entry for entry in reversed(self._capture_stack) if entry), None)
         if role == "name":
             if self._current_name_parts and self._current_price is not None:
                 self._commit_if_ready()
             self._current_name_parts.append(text)
-        elif role == "price":
+        else:
             match = self._price_pattern.search(text)
             if match:
                 try:
@@ -318,349 +697,2598 @@ class MenuHTMLParser(HTMLParser):
             return
         self.handle_data(char)
 
+    @property
+    def category_labels(self) -> dict[str, Optional[str]]:
+        """与えられた見出し名に、文書中で収集した見出し名を上書きした対応表を返す。"""
+
+        return {
+            **self._category_labels,
+            **{key: canonical_category(value) for key, value in self.labels.items()},
+        }
+
     def get_items(self) -> List[MenuItem]:
         """抽出したメニュー項目一覧を返す。"""
 
         self._commit_if_ready()
-        return list(self._items)
+        labels = self.category_labels
+        items: List[MenuItem] = []
+        for name, price, category in self._entries:
+            if isinstance(category, _ToggleRef):
+                resolved = labels.get(category.toggle_id)
+                category = category.toggle_id if resolved is None else resolved
+            items.append(MenuItem(name, price, canonical_category(category or self._base_category)))
+        return items
+
+
+# 属性値ごとの判定結果。同じclass名などが繰り返し現れるため全パーサーで共有するが、
+# 属性値は取得元のHTML次第で際限なく増えうるため件数を制限する
+_ATTR_CACHE_SIZE = 4096
+
+
+@functools.lru_cache(maxsize=_ATTR_CACHE_SIZE)
+def _classify_attr_role(value: str) -> Optional[str]:
+    lower = value.lower()
+    if MenuHTMLParser._price_re.search(lower):
+        return "price"
+    if MenuHTMLParser._name_re.search(lower):
+        return "name"
+    return None
 
 
-class CategoryLabelParser(HTMLParser):
-    """カテゴリ見出し (toggleTitle) の id と表示名を抽出するパーサー。"""
+@functools.lru_cache(maxsize=_ATTR_CACHE_SIZE)
+def _classify_attr_entry(value: str) -> bool:
+    return bool(MenuHTMLParser._entry_re.search(value.lower()))
 
-    def __init__(self) -> None:
-        super().__init__()
-        self.labels: dict[str, str] = {}
-        self._capture_id: Optional[str] = None
 
-    def handle_starttag(self, tag: str, attrs: Sequence[Tuple[str, Optional[str]]]) -> None:
-        if tag != "p":
-            return
-        attrs_dict = dict(attrs)
-        if attrs_dict.get("class") != "toggleTitle":
-            return
-        toggle_id = attrs_dict.get("id")
-        if not toggle_id:
-            return
-        self._capture_id = toggle_id
+class Timings:
+    """1回の処理 (リクエストやCLI実行) のフェーズごとの所要時間を記録する。
 
-    def handle_endtag(self, tag: str) -> None:
-        if tag == "p":
-            self._capture_id = None
+    `record_timings` で有効にした範囲内の `timed` が記録先になる。別スレッドやタスクへは
+    contextvarsで引き継ぐ。`parent` を渡すと、記録を親にも追加する。
+    """
+
+    def __init__(self, parent: Optional["Timings"] = None) -> None:
+        self.entries: List[tuple[str, float, Optional[str]]] = []
+        self.parent = parent
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+
+    def add(self, name: str, duration: float, detail: Optional[str] = None) -> None:
+        """フェーズ `name` の所要時間 (秒) を記録する。`detail` には断片URLなどの補足を渡す。"""
+
+        with self._lock:
+            self.entries.append((name, duration, detail))
+        if self.parent is not None:
+            self.parent.add(name, duration, detail)
+
+    def elapsed(self) -> float:
+        """記録開始からの経過秒数。"""
+
+        return time.perf_counter() - self._start
+
+    def summary(self) -> dict[str, float]:
+        """フェーズ名ごとの合計所要時間 (ミリ秒) を記録順に返す。"""
+
+        totals: dict[str, float] = {}
+        with self._lock:
+            for name, duration, _ in self.entries:
+                totals[name] = totals.get(name, 0.0) + duration * 1000
+        return {name: round(total, 2) for name, total in totals.items()}
+
+    def to_dict(self) -> dict[str, Any]:
+        """JSON出力用に、全体の経過時間・フェーズごとの合計・個々の記録をまとめて返す。"""
+
+        return {"total_ms": round(self.elapsed() * 1000, 2), "phases": self.summary(), "entries": self.to_list()}
+
+    def to_list(self) -> List[dict[str, Any]]:
+        """記録を `{"name", "ms", "detail"}` の一覧として返す。"""
+
+        with self._lock:
+            return [
+                {"name": name, "ms": round(duration * 1000, 2), "detail": detail}
+                for name, duration, detail in self.entries
+            ]
+
+    def server_timing(self, *, details: bool = True) -> str:
+        """`Server-Timing` ヘッダーの値を作る。末尾に全体の経過時間を `total` として加える。
+
+        `details` がFalseなら、取得先のURLなどの詳細 (`desc`) を含めない。
+        """
+
+        def metric(name: str, duration: float, detail: Optional[str]) -> str:
+            value = f"{re.sub(r'[^A-Za-z0-9_.-]', '_', name)};dur={duration * 1000:.1f}"
+            if detail and details:
+                escaped = detail.replace("\\", "\\\\").replace('"', '\\"')
+                value += f';desc="{escaped.encode("ascii", "backslashreplace").decode("ascii")}"'
+            return value
+
+        with self._lock:
+            entries = list(self.entries)
+        return ", ".join([metric(*entry) for entry in entries] + [metric("total", self.elapsed(), None)])
+
+    def format(self) -> str:
+        """フェーズごとの内訳を表示用に整形する。"""
+
+        lines = [f"処理時間: {self.elapsed() * 1000:.1f}ms"]
+        with self._lock:
+            entries = list(self.entries)
+        for name, duration, detail in entries:
+            label = f" {detail}" if detail else ""
+            lines.append(f"- {name}{label}: {duration * 1000:.1f}ms")
+        return "\n".join(lines)
+
+
+_current_timings: contextvars.ContextVar[Optional[Timings]] = contextvars.ContextVar("meal_timings", default=None)
+
+
+def current_timings() -> Optional[Timings]:
+    """記録中の `Timings` を返す。`record_timings` の範囲外ではNone。"""
+
+    return _current_timings.get()
 
-    def handle_data(self, data: str) -> None:
-        if not self._capture_id:
-            return
-        text = data.strip()
-        if not text:
-            return
-        self.labels[self._capture_id] = text.split()[0]
 
+@contextlib.contextmanager
+def record_timings(timings: Optional[Timings] = None) -> Iterator[Timings]:
+    """範囲内の `timed` の計測結果を `timings` に記録する。
 
-def _download_with_urllib(url: str) -> tuple[str, str]:
-    """urllibを用いてHTMLを取得する。"""
+    省略時は新しく作り、外側で記録中の `Timings` があればそれを親にする。
+    """
 
+    timings = timings or Timings(_current_timings.get())
+    token = _current_timings.set(timings)
     try:
-        with urllib.request.urlopen(url) as response:
-            base_url = response.geturl()
-            html_content = response.read().decode(response.headers.get_content_charset() or "utf-8")
-    except urllib.error.URLError as exc:  # pragma: no cover - ネットワーク失敗は実行時に処理
-        raise SystemExit(f"メニューのダウンロードに失敗しました: {exc}") from exc
-    return html_content, base_url
+        yield timings
+    finally:
+        _current_timings.reset(token)
 
 
-def _fetch_with_playwright(url: str) -> tuple[str, str]:
-    """Playwrightを利用してJS実行後のHTMLを取得する。"""
+@contextlib.contextmanager
+def timed(name: str, detail: Optional[str] = None) -> Iterator[None]:
+    """範囲内の所要時間をフェーズ `name` として記録する。記録中でなければ何もしない。"""
 
+    timings = _current_timings.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
     try:
-        from playwright.sync_api import sync_playwright
-    except ImportError as exc:  # pragma: no cover - Playwright未インストール
-        raise SystemExit(
-            "Playwrightがインストールされていません。`pip install playwright` と "
-            "`playwright install chromium` を実行してください。"
-        ) from exc
-
-    with sync_playwright() as playwright:
-        browser = playwright.chromium.launch(headless=True)
-        page = browser.new_page()
-        try:
-            page.goto(url, wait_until="networkidle")
-            toggle_ids: List[str] = page.eval_on_selector_all(
-                "p.toggleTitle[id]", "els => els.map(el => el.id)"
-            )
-            for toggle_id in toggle_ids:
-                try:
-                    page.click(f"#{toggle_id}")
-                    page.wait_for_timeout(200)
-                    page.wait_for_load_state("networkidle")
-                except Exception:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - start, detail)
+
+
+PROFILERS = ("cprofile", "sample")
+
+
+class StackSampler:
+    """スレッドのスタックを一定間隔で採取し、collapsed形式 (flamegraph.pl などの入力) で集計する。
+
+    `thread_id` を省略すると、採取用スレッド以外の全スレッドを対象にし、先頭にスレッド名を付ける。
+    """
+
+    def __init__(self, interval: float = 0.001, *, thread_id: Optional[int] = None) -> None:
+        self.interval = interval
+        self.thread_id = thread_id
+        self.samples: dict[str, int] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _label(self, frame: Any) -> str:
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    def _collect(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own or (self.thread_id is not None and ident != self.thread_id):
                     continue
-            html_content = page.content()
-            base_url = page.url
-        finally:
-            browser.close()
-    return html_content, base_url
+                stack = []
+                while frame is not None:
+                    stack.append(self._label(frame))
+                    frame = frame.f_back
+                if self.thread_id is None:
+                    stack.append(names.get(ident, str(ident)))
+                key = ";".join(reversed(stack))
+                self.samples[key] = self.samples.get(key, 0) + 1
 
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._collect, name="stack-sampler", daemon=True)
+        self._thread.start()
 
-def _extract_items_from_html(
-    html_content: str,
-    base_url: str,
-    *,
-    fetch_fragments: bool,
-) -> List[MenuItem]:
-    """HTMLコンテンツからMenuItemの一覧を抽出する。"""
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
 
-    aggregated: list[MenuItem] = []
-    label_parser = CategoryLabelParser()
-    label_parser.feed(html_content)
-    raw_labels = {**DEFAULT_CATEGORY_LABELS, **label_parser.labels}
-    category_labels = {key: canonical_category(value) for key, value in raw_labels.items()}
+    def collapsed(self) -> str:
+        """`関数;関数;関数 採取回数` の行からなるテキストを返す。"""
 
-    parser = MenuHTMLParser(category_labels=category_labels)
-    parser.feed(html_content)
-    aggregated.extend(parser.get_items())
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(self.samples.items()))
 
-    if fetch_fragments:
-        ajax_urls: set[str] = set()
-        for match in re.findall(r"menu_load\.php\?[^\"')]+", html_content):
-            full_url = urllib.parse.urljoin(base_url, match)
-            ajax_urls.add(full_url)
 
-        for ajax_url in sorted(ajax_urls):
-            try:
-                with urllib.request.urlopen(ajax_url) as response:
-                    fragment = response.read().decode(response.headers.get_content_charset() or "utf-8")
-            except urllib.error.URLError:
-                continue
-            parsed_url = urllib.parse.urlparse(ajax_url)
-            query = urllib.parse.parse_qs(parsed_url.query)
-            category_code = query.get("a", [""])[0]
-            category_label = canonical_category(category_labels.get(category_code))
-            sub_parser = MenuHTMLParser(category_label, category_labels=category_labels)
-            sub_parser.feed(fragment)
-            aggregated.extend(sub_parser.get_items())
+class Profiler:
+    """範囲内の処理をcProfile、またはスタックの採取 (sample) でプロファイルする。
 
-    unique: dict[tuple[str, int], MenuItem] = {}
-    for item in aggregated:
-        key = (item.name, item.price)
-        if key not in unique or (unique[key].category is None and item.category):
-            unique[key] = item
-    return list(unique.values())
+    `report` はcProfileならpstats形式 (`pstats.Stats` で読める) のバイト列、sampleならcollapsed形式のテキスト。
+    """
 
+    def __init__(self, mode: str = "cprofile", *, interval: float = 0.001, all_threads: bool = False) -> None:
+        if mode not in PROFILERS:
+            raise ValueError(f"modeは {', '.join(PROFILERS)} のいずれかである必要があります")
+        self.mode = mode
+        self.interval = interval
+        self.all_threads = all_threads
+        self._profile: Any = None
+        self._sampler: Optional[StackSampler] = None
+
+    @property
+    def suffix(self) -> str:
+        return ".pstats" if self.mode == "cprofile" else ".collapsed"
+
+    def __enter__(self) -> "Profiler":
+        if self.mode == "cprofile":
+            import cProfile
+
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            thread_id = None if self.all_threads else threading.get_ident()
+            self._sampler = StackSampler(self.interval, thread_id=thread_id)
+            self._sampler.start()
+        return self
 
-def fetch_menu(url: str = MENU_URL, *, use_playwright: bool = True) -> List[MenuItem]:
-    """指定URLからメニューを取得し、`MenuItem`のリストを返す。"""
+    def __exit__(self, *exc_info: Any) -> None:
+        if self._profile is not None:
+            self._profile.disable()
+        if self._sampler is not None:
+            self._sampler.stop()
 
-    if use_playwright:
-        html_content, base_url = _fetch_with_playwright(url)
-    else:
-        html_content, base_url = _download_with_urllib(url)
+    def report(self) -> bytes:
+        if self._profile is not None:
+            import marshal
 
-    items = _extract_items_from_html(
-        html_content,
-        base_url,
-        fetch_fragments=True,
-    )
+            # `Profile.dump_stats` と同じ形式
+            self._profile.create_stats()
+            return marshal.dumps(self._profile.stats)
+        assert self._sampler is not None
+        return self._sampler.collapsed().encode("utf-8")
 
-    if not items:
-        raise SystemExit("メニューが見つかりません。ページ構造が変更された可能性があります。")
-    return items
+    def write(self, path: Union[str, Path]) -> Path:
+        """結果をファイルに書き出し、そのパスを返す。"""
 
+        path = Path(path)
+        path.write_bytes(self.report())
+        return path
 
-def _choose_better_combo(current: Optional[List[MenuItem]], candidate: List[MenuItem]) -> List[MenuItem]:
-    """既存の組み合わせと比較し、好ましい方を返す。"""
+    def summary(self, limit: int = 20) -> str:
+        """cProfileの場合は累積時間の上位、sampleの場合は採取回数の多いスタックの末尾を整形して返す。"""
 
-    if current is None:
-        return candidate
-    if len(candidate) < len(current):
-        return candidate
-    return current
+        if self._profile is not None:
+            import pstats
 
+            output = io.StringIO()
+            pstats.Stats(self._profile, stream=output).sort_stats("cumulative").print_stats(limit)
+            return output.getvalue()
+        assert self._sampler is not None
+        top = sorted(self._sampler.samples.items(), key=lambda entry: entry[1], reverse=True)[:limit]
+        return "\n".join(f"{count:6d} {';'.join(stack.split(';')[-3:])}" for stack, count in top)
 
-def best_combination(items: Sequence[MenuItem], budget: int, limit_primary: bool = False) -> Tuple[int, List[MenuItem]]:
-    """予算内で最大の合計金額となるメニュー組み合わせを探索する。
 
-    Args:
-        items: 候補となるメニュー一覧。
-        budget: 予算上限。
-        limit_primary: Trueの場合、`PRIMARY_LIMIT_CATEGORIES`に属するメニューは合計で1品のみ選択する。
-    """
+def _fragment_label(url: str) -> str:
+    """計測結果に載せる断片URLの表記。ホスト名を除いたパスとクエリ。"""
 
-    if budget < 0:
-        raise ValueError("budgetは0以上の整数である必要があります")
+    parsed = urllib.parse.urlsplit(url)
+    return f"{parsed.path}?{parsed.query}" if parsed.query else parsed.path
 
-    if limit_primary:
-        # 制限モードではカテゴリの制約を考慮したDPを用いる。
-        def sort_key(item: MenuItem) -> tuple[int, int]:
-            if is_rice_item(item):
-                return (2, item.price)
-            if is_primary_item(item):
-                return (0, item.price)
-            return (1, item.price)
-
-        ordered_items = sorted(items, key=sort_key)
-        best_states: List[dict[tuple[bool, bool, bool], List[MenuItem]]] = [dict() for _ in range(budget + 1)]
-        best_states[0][(False, False, False)] = []
-
-        for item in ordered_items:
-            is_primary = is_primary_item(item)
-            is_rice = is_rice_item(item)
-            is_don = is_don_primary(item)
-
-            if is_primary or is_rice:
-                for amount in range(budget - item.price, -1, -1):
-                    states = list(best_states[amount].items())
-                    if not states:
-                        continue
-                    for (has_primary, has_rice, primary_is_don), combo in states:
-                        if is_primary and has_primary:
-                            continue
-                        if is_rice:
-                            if has_rice or not has_primary or primary_is_don:
-                                continue
-                        new_primary = has_primary or is_primary
-                        new_rice = has_rice or is_rice
-                        new_primary_is_don = primary_is_don
-                        if is_primary and not has_primary:
-                            new_primary_is_don = is_don
-                        new_total = amount + item.price
-                        if new_total > budget:
-                            continue
-                        new_combo = combo + [item]
-                        existing = best_states[new_total].get((new_primary, new_rice, new_primary_is_don))
-                        chosen = _choose_better_combo(existing, new_combo)
-                        if chosen is not existing:
-                            best_states[new_total][(new_primary, new_rice, new_primary_is_don)] = chosen
-            else:
-                for new_total in range(item.price, budget + 1):
-                    prev_total = new_total - item.price
-                    states = list(best_states[prev_total].items())
-                    if not states:
-                        continue
-                    for state, combo in states:
-                        new_combo = combo + [item]
-                        existing = best_states[new_total].get(state)
-                        chosen = _choose_better_combo(existing, new_combo)
-                        if chosen is not existing:
-                            best_states[new_total][state] = chosen
-
-        for total in range(budget, -1, -1):
-            state_map = best_states[total]
-            if not state_map:
-                continue
-            preferred_state: Optional[tuple[bool, bool, bool]] = None
-            preferred_combo: Optional[List[MenuItem]] = None
-            for state, combo in state_map.items():
-                has_primary, _, _ = state
-                if preferred_state is None:
-                    preferred_state = state
-                    preferred_combo = combo
-                    continue
-                prefers_current = has_primary and not preferred_state[0]
-                same_primary = has_primary == preferred_state[0]
-                better_length = len(combo) < len(preferred_combo or [])
-                if prefers_current or (same_primary and better_length):
-                    preferred_state = state
-                    preferred_combo = combo
-            if preferred_combo is not None:
-                return total, preferred_combo
-        return 0, []
 
-    # 各金額に対し最良の組み合わせを記録
-    best: List[Optional[List[MenuItem]]] = [None] * (budget + 1)
-    best[0] = []
+@dataclasses.dataclass(frozen=True)
+class HTTPResult:
+    """HTTP取得結果。`not_modified` はサーバーが304を返し、保存済みの本文を再利用したことを示す。"""
+
+    url: str
+    text: str
+    not_modified: bool = False
 
-    for item in items:
-        for amount in range(item.price, budget + 1):
-            combo = best[amount - item.price]
-            if combo is None:
-                continue
-            new_total = amount
-            new_combo = combo + [item]
-            existing = best[new_total]
-            chosen = _choose_better_combo(existing, new_combo)
-            if chosen is not existing:
-                best[new_total] = chosen
 
-    for total in range(budget, -1, -1):
-        combo = best[total]
-        if combo is not None:
-            return total, combo
+@dataclasses.dataclass(frozen=True)
+class _CachedBody:
+    etag: Optional[str]
+    last_modified: Optional[str]
+    text: str
 
-    return 0, []
 
+class HTTPSession:
+    """ホストごとにkeep-alive接続を使い回し、ETag/Last-Modifiedによる条件付きGETを行うクライアント。
 
-def parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
-    """コマンドライン引数を解析する。"""
+    `urllib.request.urlopen` と同様に環境変数 `HTTP_PROXY` / `HTTPS_PROXY` / `NO_PROXY` に従い、
+    httpはプロキシへ絶対URIで、httpsはCONNECTによるトンネルで送る。
+    """
 
-    parser = argparse.ArgumentParser(description="指定予算で最適なメニュー組み合わせを検索します。")
-    parser.add_argument("budget", type=int, help="最大予算（円）")
-    parser.add_argument(
-        "--url",
-        default=MENU_URL,
-        help="メニューを取得するURL。デフォルトは指定の学食メニューです。",
-    )
-    parser.add_argument(
-        "--json",
-        action="store_true",
-        help="結果をJSON形式で出力します。",
-    )
-    parser.add_argument(
-        "--limit-primary",
-        action="store_true",
-        help="主菜・麺類・丼・カレー・オーダー・ケバブ&ベジタリアンカテゴリからは1品のみ選択します。",
-    )
-    parser.add_argument(
-        "--no-playwright",
-        action="store_true",
-        help="Playwrightを使用せず、静的HTMLとAJAX断片のみでメニューを取得します。",
-    )
-    return parser.parse_args(argv)
+    max_redirects = 5
 
+    def __init__(self, *, max_idle_per_host: int = FRAGMENT_MAX_PER_HOST) -> None:
+        self.max_idle_per_host = max_idle_per_host
+        self._proxies = urllib.request.getproxies()
+        self._idle: dict[tuple[str, str], List[http.client.HTTPConnection]] = {}
+        self._bodies: dict[str, _CachedBody] = {}
+        # asyncio版の接続はイベントループに紐づくため、ループごとに保持する
+        self._async_idle: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict[tuple[str, str], list]]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._lock = threading.Lock()
 
-def format_result(total: int, items: Sequence[MenuItem]) -> str:
-    """組み合わせ結果を人間が読みやすい形式に整形する。"""
+    def _proxy(self, parts: urllib.parse.SplitResult) -> Optional[urllib.parse.SplitResult]:
+        """URLの取得に使うプロキシ。使わない場合はNone。"""
 
-    lines = [f"最適合計: {total}円 (品数: {len(items)})"]
-    for item in items:
-        label = f" ({item.category})" if item.category else ""
-        lines.append(f"- {item.name}{label}: {item.price}円")
-    return "\n".join(lines)
+        proxy = self._proxies.get(parts.scheme)
+        if not proxy or urllib.request.proxy_bypass(parts.hostname or ""):
+            return None
+        return urllib.parse.urlsplit(proxy if "://" in proxy else f"http://{proxy}")
 
+    @staticmethod
+    def _proxy_headers(proxy: urllib.parse.SplitResult) -> dict[str, str]:
+        if proxy.username is None:
+            return {}
+        credentials = f"{urllib.parse.unquote(proxy.username)}:{urllib.parse.unquote(proxy.password or '')}"
+        return {"Proxy-Authorization": "Basic " + base64.b64encode(credentials.encode("utf-8")).decode("ascii")}
 
-def format_menu_items(items: Sequence[MenuItem]) -> str:
-    """取得したメニュー全件を表示用に整形する。"""
+    @staticmethod
+    def _request_target(parts: urllib.parse.SplitResult, proxy: Optional[urllib.parse.SplitResult]) -> str:
+        # httpをプロキシ経由で送る場合は絶対URIで指定する
+        if proxy is not None and parts.scheme == "http":
+            return urllib.parse.urlunsplit(parts._replace(fragment=""))
+        path = parts.path or "/"
+        return f"{path}?{parts.query}" if parts.query else path
+
+    def _acquire(
+        self, parts: urllib.parse.SplitResult, proxy: Optional[urllib.parse.SplitResult], timeout: float
+    ) -> tuple[http.client.HTTPConnection, bool]:
+        with self._lock:
+            idle = self._idle.get((parts.scheme, parts.netloc))
+            conn = idle.pop() if idle else None
+        if conn is not None:
+            conn.timeout = timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            return conn, True
+        conn_cls = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        if proxy is None:
+            return conn_cls(parts.netloc, timeout=timeout), False
+        conn = conn_cls(proxy.hostname, proxy.port or 80, timeout=timeout)
+        if parts.scheme == "https":
+            conn.set_tunnel(parts.hostname, parts.port or 443, headers=self._proxy_headers(proxy))
+        return conn, False
+
+    def _release(self, scheme: str, netloc: str, conn: http.client.HTTPConnection) -> None:
+        with self._lock:
+            idle = self._idle.setdefault((scheme, netloc), [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def _request(
+        self, url: str, headers: dict[str, str], timeout: float
+    ) -> tuple[http.client.HTTPResponse, bytes]:
+        parts = urllib.parse.urlsplit(url)
+        proxy = self._proxy(parts)
+        target = self._request_target(parts, proxy)
+        if proxy is not None and parts.scheme == "http":
+            headers = {**headers, **self._proxy_headers(proxy)}
+        while True:
+            conn, reused = self._acquire(parts, proxy, timeout)
+            try:
+                conn.request("GET", target, headers=headers)
+                response = conn.getresponse()
+                body = response.read()
+            except (http.client.HTTPException, OSError) as exc:
+                conn.close()
+                # 使い回した接続がサーバー側で切断済みだった場合のみ、新しい接続でやり直す
+                # (タイムアウトはやり直すと期限を超えるため、そのまま送出する)
+                if reused and not isinstance(exc, TimeoutError):
+                    continue
+                raise
+            if response.will_close:
+                conn.close()
+            else:
+                self._release(parts.scheme, parts.netloc, conn)
+            return response, body
+
+    def _request_headers(self, url: str) -> tuple[dict[str, str], Optional[_CachedBody]]:
+        headers = {"User-Agent": HTTP_USER_AGENT, "Accept-Encoding": "identity"}
+        with self._lock:
+            cached = self._bodies.get(url)
+        if cached is not None:
+            if cached.etag:
+                headers["If-None-Match"] = cached.etag
+            if cached.last_modified:
+                headers["If-Modified-Since"] = cached.last_modified
+        return headers, cached
+
+    def _handle_response(
+        self,
+        url: str,
+        status: int,
+        reason: str,
+        headers: http.client.HTTPMessage,
+        body: bytes,
+        cached: Optional[_CachedBody],
+    ) -> HTTPResult | str:
+        """応答を `HTTPResult` に変換する。リダイレクトの場合は移動先のURLを返す。"""
+
+        location = headers.get("Location")
+        if status in (301, 302, 303, 307, 308) and location:
+            return urllib.parse.urljoin(url, location)
+        if status == 304 and cached is not None:
+            return HTTPResult(url, cached.text, not_modified=True)
+        if status != 200:
+            raise urllib.error.HTTPError(url, status, reason, headers, None)
+
+        text = body.decode(headers.get_content_charset() or "utf-8")
+        etag = headers.get("ETag")
+        last_modified = headers.get("Last-Modified")
+        if etag or last_modified:
+            with self._lock:
+                self._bodies[url] = _CachedBody(etag, last_modified, text)
+        return HTTPResult(url, text)
+
+    def get(self, url: str, *, timeout: float = FRAGMENT_TIMEOUT) -> HTTPResult:
+        """URLを取得する。前回の検証子が使える場合は条件付きGETを送る。"""
+
+        for _ in range(self.max_redirects + 1):
+            headers, cached = self._request_headers(url)
+            response, body = self._request(url, headers, timeout)
+            outcome = self._handle_response(url, response.status, response.reason, response.headers, body, cached)
+            if isinstance(outcome, HTTPResult):
+                return outcome
+            url = outcome
+        raise urllib.error.URLError(f"リダイレクトが多すぎます: {url}")
+
+    async def _acquire_async(
+        self, parts: urllib.parse.SplitResult, proxy: Optional[urllib.parse.SplitResult], timeout: float
+    ) -> tuple[tuple[asyncio.StreamReader, asyncio.StreamWriter], bool]:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            idle = self._async_idle.setdefault(loop, {}).setdefault((parts.scheme, parts.netloc), [])
+        while idle:
+            reader, writer = idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return (reader, writer), True
+            writer.close()
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        ssl_context = ssl.create_default_context() if parts.scheme == "https" else None
+        if proxy is None:
+            connection = await asyncio.wait_for(
+                asyncio.open_connection(parts.hostname, port, ssl=ssl_context), timeout
+            )
+            return connection, False
+        connection = await asyncio.wait_for(asyncio.open_connection(proxy.hostname, proxy.port or 80), timeout)
+        if ssl_context is not None:
+            try:
+                await asyncio.wait_for(self._open_tunnel(connection, parts.hostname, port, proxy, ssl_context), timeout)
+            except BaseException:
+                connection[1].close()
+                raise
+        return connection, False
 
-    lines = [f"取得メニュー一覧: {len(items)}件"]
-    for item in items:
-        label = f" ({item.category})" if item.category else ""
-        lines.append(f"- {item.name}{label}: {item.price}円")
-    return "\n".join(lines)
+    async def _open_tunnel(
+        self,
+        connection: tuple[asyncio.StreamReader, asyncio.StreamWriter],
+        host: str,
+        port: int,
+        proxy: urllib.parse.SplitResult,
+        ssl_context: ssl.SSLContext,
+    ) -> None:
+        """プロキシにCONNECTを送り、確立したトンネル上でTLSを開始する。"""
+
+        reader, writer = connection
+        lines = [f"CONNECT {host}:{port} HTTP/1.1", f"Host: {host}:{port}"]
+        lines.extend(f"{name}: {value}" for name, value in self._proxy_headers(proxy).items())
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        await writer.drain()
+        status_line, _, _ = (await reader.readuntil(b"\r\n\r\n")).partition(b"\r\n")
+        status = status_line.decode("latin-1").split(" ", 2)[1:2]
+        if status != ["200"]:
+            raise OSError(f"プロキシのトンネルを確立できません: {status_line.decode('latin-1')}")
+        await writer.start_tls(ssl_context, server_hostname=host)
+
+    def _release_async(
+        self, scheme: str, netloc: str, connection: tuple[asyncio.StreamReader, asyncio.StreamWriter]
+    ) -> None:
+        with self._lock:
+            idle = self._async_idle.setdefault(asyncio.get_running_loop(), {}).setdefault((scheme, netloc), [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append(connection)
+                return
+        connection[1].close()
+
+    @staticmethod
+    async def _read_response(
+        reader: asyncio.StreamReader,
+    ) -> tuple[int, str, http.client.HTTPMessage, bytes, bool]:
+        """HTTP/1.1の応答を1件読み取り、(ステータス, 理由, ヘッダー, 本文, 接続を閉じるか) を返す。"""
+
+        head = await reader.readuntil(b"\r\n\r\n")
+        status_line, _, header_block = head.partition(b"\r\n")
+        version, status_text, *rest = status_line.decode("latin-1").split(" ", 2)
+        status = int(status_text)
+        headers = http.client.parse_headers(io.BytesIO(header_block))
+        will_close = version == "HTTP/1.0" or headers.get("Connection", "").lower() == "close"
+
+        if status in (204, 304) or 100 <= status < 200:
+            body = b""
+        elif "chunked" in headers.get("Transfer-Encoding", "").lower():
+            chunks: List[bytes] = []
+            while True:
+                size = int((await reader.readuntil(b"\r\n")).split(b";", 1)[0].strip(), 16)
+                if size == 0:
+                    # トレーラーを読み飛ばす
+                    while await reader.readuntil(b"\r\n") != b"\r\n":
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            body = b"".join(chunks)
+        elif headers.get("Content-Length") is not None:
+            body = await reader.readexactly(int(headers["Content-Length"]))
+        else:
+            body = await reader.read()
+            will_close = True
+        return status, rest[0] if rest else "", headers, body, will_close
+
+    async def _request_async(
+        self, url: str, headers: dict[str, str], timeout: float
+    ) -> tuple[int, str, http.client.HTTPMessage, bytes]:
+        parts = urllib.parse.urlsplit(url)
+        proxy = self._proxy(parts)
+        if proxy is not None and parts.scheme == "http":
+            headers = {**headers, **self._proxy_headers(proxy)}
+        lines = [f"GET {self._request_target(parts, proxy)} HTTP/1.1", f"Host: {parts.netloc}"]
+        lines.extend(f"{name}: {value}" for name, value in headers.items())
+        request = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+        while True:
+            connection, reused = await self._acquire_async(parts, proxy, timeout)
+            reader, writer = connection
+            try:
+                writer.write(request)
+                await writer.drain()
+                status, reason, response_headers, body, will_close = await asyncio.wait_for(
+                    self._read_response(reader), timeout
+                )
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError, OSError) as exc:
+                writer.close()
+                # 使い回した接続がサーバー側で切断済みだった場合のみ、新しい接続でやり直す
+                if reused and not isinstance(exc, TimeoutError):
+                    continue
+                if isinstance(exc, (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError)):
+                    raise http.client.HTTPException(str(exc)) from exc
+                raise
+            if will_close:
+                writer.close()
+            else:
+                self._release_async(parts.scheme, parts.netloc, connection)
+            return status, reason, response_headers, body
 
+    async def get_async(self, url: str, *, timeout: float = FRAGMENT_TIMEOUT) -> HTTPResult:
+        """`get` のasyncio版。条件付きGETの検証子は同期版と共有する。"""
 
-def main(argv: Optional[Sequence[str]] = None) -> int:
-    """コマンドラインツールのエントリポイント。"""
+        for _ in range(self.max_redirects + 1):
+            headers, cached = self._request_headers(url)
+            status, reason, response_headers, body = await self._request_async(url, headers, timeout)
+            outcome = self._handle_response(url, status, reason, response_headers, body, cached)
+            if isinstance(outcome, HTTPResult):
+                return outcome
+            url = outcome
+        raise urllib.error.URLError(f"リダイレクトが多すぎます: {url}")
 
-    args = parse_args(argv)
-    use_playwright = not args.no_playwright
-    items = fetch_menu(args.url, use_playwright=use_playwright)
-    total, combo = best_combination(items, args.budget, limit_primary=args.limit_primary)
+    def close(self) -> None:
+        """保持しているkeep-alive接続をすべて閉じる。"""
+
+        with self._lock:
+            connections = [conn for idle in self._idle.values() for conn in idle]
+            self._idle.clear()
+        for conn in connections:
+            conn.close()
+
+
+_http_session = HTTPSession()
+_parsed_menus: dict[str, MenuTable] = {}
+_parsed_menus_lock = threading.Lock()
+
+
+def _download_with_urllib(url: str, *, timeout: float = FRAGMENT_TIMEOUT) -> HTTPResult:
+    """共有のHTTPセッションを用いてHTMLを取得する。"""
+
+    try:
+        with timed("page"):
+            return _http_session.get(url, timeout=timeout)
+    except (urllib.error.URLError, http.client.HTTPException, OSError) as exc:  # pragma: no cover - ネットワーク失敗は実行時に処理
+        raise SystemExit(f"メニューのダウンロードに失敗しました: {exc}") from exc
+
+
+def _descendant_rss_mb() -> float:
+    """自プロセス配下 (Playwrightドライバやブラウザ) の合計RSSをMB単位で返す。"""
+
+    proc_dir = Path("/proc")
+    if not proc_dir.is_dir():
+        return 0.0
+    children: dict[int, list[int]] = {}
+    rss_pages: dict[int, int] = {}
+    for entry in proc_dir.iterdir():
+        if not entry.name.isdigit():
+            continue
+        try:
+            stat = (entry / "stat").read_text()
+        except OSError:
+            continue
+        fields = stat.rsplit(")", 1)[-1].split()
+        pid = int(entry.name)
+        children.setdefault(int(fields[1]), []).append(pid)
+        rss_pages[pid] = int(fields[21])
+    total = 0
+    pending = list(children.get(os.getpid(), []))
+    while pending:
+        pid = pending.pop()
+        total += rss_pages.get(pid, 0)
+        pending.extend(children.get(pid, []))
+    return total * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+class _BrowserJob:
+    """ブラウザスレッドで実行する処理1件分の状態。"""
+
+    def __init__(self, func: Callable[[Any], Any]) -> None:
+        self.func = func
+        # 呼び出し元の計測先 (`record_timings`) をブラウザスレッドへ引き継ぐ
+        self.context = contextvars.copy_context()
+        self.done = threading.Event()
+        self.cancelled = False
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class BrowserPool:
+    """Chromiumを常駐させ、ページを貸し出すプール。
+
+    Playwrightの同期APIは起動したスレッドからしか操作できないため、
+    ブラウザごとに専用スレッドを持ち、貸し出したページでの処理はそのスレッド上で実行する。
+    """
+
+    def __init__(
+        self,
+        size: int = 1,
+        *,
+        headless: bool = True,
+        max_pages_per_browser: int = 200,
+        max_rss_mb: Optional[float] = None,
+    ) -> None:
+        self.size = max(1, size)
+        self.headless = headless
+        self.max_pages_per_browser = max_pages_per_browser
+        self.max_rss_mb = max_rss_mb
+        self._jobs: "queue.Queue[Optional[_BrowserJob]]" = queue.Queue()
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._closed = False
+        self._stopped = threading.Event()
+        # ドライバを起動できずに再試行を待っているスレッドの数と、最後の起動エラー
+        self._failing = 0
+        self._start_error: Optional[BaseException] = None
+        self._launches = 0
+        self._recycles = 0
+        self._pages = 0
+
+    def _ensure_started(self) -> None:
+        if importlib.util.find_spec("playwright") is None:  # pragma: no cover - Playwright未インストール
+            raise SystemExit(
+                "Playwrightがインストールされていません。`pip install playwright` と "
+                "`playwright install chromium` を実行してください。"
+            )
+
+        with self._lock:
+            if self._pid != os.getpid():
+                # fork後の子プロセスには親のスレッドが存在しないため作り直す
+                self._pid = os.getpid()
+                self._jobs = queue.Queue()
+                self._threads = []
+                self._closed = False
+                self._stopped = threading.Event()
+                self._failing = 0
+                self._start_error = None
+            if self._closed:
+                raise SystemExit("ブラウザプールは既に終了しています。")
+            while len(self._threads) < self.size:
+                thread = threading.Thread(
+                    target=self._worker,
+                    name=f"browser-pool-{len(self._threads)}",
+                    daemon=True,
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def _needs_recycle(self, pages_served: int) -> bool:
+        if self.max_pages_per_browser and pages_served >= self.max_pages_per_browser:
+            return True
+        if self.max_rss_mb and _descendant_rss_mb() > self.max_rss_mb:
+            return True
+        return False
+
+    def _worker(self) -> None:
+        from playwright.sync_api import sync_playwright
+
+        # ドライバを起動できない間はキューに触れず、間隔を延ばしながら起動を再試行する。
+        # 待機中の処理は起動できた他のスレッドが受け持つ (全スレッドが失敗中なら `run` 側で失敗させる)
+        delay = BROWSER_START_BACKOFF
+        while not self._stopped.is_set():
+            try:
+                with sync_playwright() as playwright:
+                    self._serve(playwright)
+                return
+            except BaseException as exc:
+                with self._lock:
+                    self._failing += 1
+                    self._start_error = exc
+                stopped = self._stopped.wait(delay)
+                with self._lock:
+                    self._failing -= 1
+                if stopped:
+                    return
+                delay = min(delay * 2, BROWSER_START_BACKOFF_MAX)
+
+    def _all_failing(self) -> bool:
+        with self._lock:
+            return self._start_error is not None and self._failing >= len(self._threads)
+
+    def _serve(self, playwright: Any) -> None:
+        with self._lock:
+            self._start_error = None
+        browser = None
+        pages_served = 0
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            if job.cancelled:
+                job.done.set()
+                continue
+            try:
+                # ヘルスチェック: 切断済み、または上限に達したブラウザは起動し直す
+                if browser is not None and (not browser.is_connected() or self._needs_recycle(pages_served)):
+                    with self._lock:
+                        self._recycles += 1
+                    try:
+                        browser.close()
+                    except Exception:
+                        pass
+                    browser = None
+                if browser is None:
+                    browser = playwright.chromium.launch(headless=self.headless)
+                    pages_served = 0
+                    with self._lock:
+                        self._launches += 1
+                context = browser.new_context()
+                try:
+                    job.result = job.context.run(job.func, context.new_page())
+                finally:
+                    context.close()
+                    pages_served += 1
+                    with self._lock:
+                        self._pages += 1
+            except BaseException as exc:
+                job.error = exc
+            finally:
+                job.done.set()
+        if browser is not None:
+            browser.close()
+
+    def run(self, func: Callable[[Any], Any], *, timeout: Optional[float] = BROWSER_TIMEOUT) -> Any:
+        """プールのページを1枚借りて `func(page)` を実行し、その戻り値を返す。
+
+        `timeout` 秒 (空き待ちを含む) で終わらなければSystemExit。全スレッドがドライバを起動できず
+        再試行を待っている間は、待たずに起動エラーでSystemExitにする。
+        """
+
+        self._ensure_started()
+        job = _BrowserJob(func)
+        self._jobs.put(job)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not job.done.wait(0.5 if deadline is None else min(0.5, max(0.0, deadline - time.monotonic()))):
+            if self._all_failing():
+                job.cancelled = True
+                raise SystemExit(f"ブラウザを起動できません: {self._start_error}")
+            if deadline is not None and time.monotonic() >= deadline:
+                job.cancelled = True
+                raise SystemExit("ブラウザでの取得がタイムアウトしました。")
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def stats(self) -> dict[str, int]:
+        """起動回数・再起動回数・処理したページ数を返す。"""
+
+        with self._lock:
+            return {
+                "size": self.size,
+                "launches": self._launches,
+                "recycles": self._recycles,
+                "pages": self._pages,
+            }
+
+    def close(self, timeout: float = 10.0) -> None:
+        """全ブラウザを終了する。"""
+
+        with self._lock:
+            if self._closed or self._pid != os.getpid():
+                return
+            self._closed = True
+            threads = list(self._threads)
+        self._stopped.set()
+        for _ in threads:
+            self._jobs.put(None)
+        for thread in threads:
+            thread.join(timeout)
+
+
+_browser_pool: Optional[BrowserPool] = None
+_browser_pool_lock = threading.Lock()
+
+
+def get_browser_pool(size: Optional[int] = None) -> BrowserPool:
+    """プロセス共通のブラウザプールを返す。設定は環境変数 `MEAL_BROWSER_*` で行う。
+
+    `size` はプールを初めて作るときだけ使われ、`MEAL_BROWSER_POOL_SIZE` より優先する。
+    """
+
+    global _browser_pool
+    with _browser_pool_lock:
+        if _browser_pool is None:
+            max_rss = os.environ.get("MEAL_BROWSER_MAX_RSS_MB")
+            _browser_pool = BrowserPool(
+                size if size is not None else int(os.environ.get("MEAL_BROWSER_POOL_SIZE", "1")),
+                max_pages_per_browser=int(os.environ.get("MEAL_BROWSER_MAX_PAGES", "200")),
+                max_rss_mb=float(max_rss) if max_rss else None,
+            )
+            atexit.register(_browser_pool.close)
+        return _browser_pool
+
+
+def _render_menu_page(page: Any, url: str) -> tuple[str, str]:
+    """ページを開いて全カテゴリを展開し、HTMLと最終URLを返す。"""
+
+    with timed("navigate"):
+        page.goto(url, wait_until="networkidle")
+    with timed("expand"):
+        toggle_ids: List[str] = page.eval_on_selector_all(
+            "p.toggleTitle[id]", "els => els.map(el => el.id)"
+        )
+        for toggle_id in toggle_ids:
+            try:
+                page.click(f"#{toggle_id}")
+                page.wait_for_timeout(200)
+                page.wait_for_load_state("networkidle")
+            except Exception:
+                continue
+    return page.content(), page.url
+
+
+def _render_menu_page_intercepted(page: Any, url: str) -> tuple[str, str, dict[str, str]]:
+    """全カテゴリを一度に展開し、`menu_load.php` のレスポンス本文をブラウザ内で捕捉する。
+
+    画像・フォント・CSSは読み込まない。戻り値は (HTML, 最終URL, {断片URL: 本文})。
+    """
+
+    pending: set[Any] = set()
+    finished: List[Any] = []
+
+    def route_handler(route: Any) -> None:
+        if route.request.resource_type in BLOCKED_RESOURCE_TYPES:
+            route.abort()
+        else:
+            route.continue_()
+
+    def on_request(request: Any) -> None:
+        if "menu_load.php" in request.url:
+            pending.add(request)
+
+    def on_request_finished(request: Any) -> None:
+        if request in pending:
+            pending.discard(request)
+            finished.append(request)
+
+    page.route("**/*", route_handler)
+    page.on("request", on_request)
+    page.on("requestfinished", on_request_finished)
+    page.on("requestfailed", lambda request: pending.discard(request))
+
+    with timed("navigate"):
+        page.goto(url, wait_until="domcontentloaded")
+    with timed("expand"):
+        page.eval_on_selector_all("p.toggleTitle[id]", "els => els.forEach(el => el.click())")
+
+        # 断片の通信が一定時間途絶えるまで待つ (イベントはwait中に処理される)
+        deadline = time.monotonic() + INTERCEPT_TIMEOUT
+        quiet_since = time.monotonic()
+        while time.monotonic() < deadline:
+            page.wait_for_timeout(50)
+            if pending:
+                quiet_since = time.monotonic()
+            elif time.monotonic() - quiet_since >= INTERCEPT_QUIET_PERIOD:
+                break
+
+    fragments: dict[str, str] = {}
+    for request in finished:
+        response = request.response()
+        if response is None or not response.ok:
+            continue
+        try:
+            fragments[request.url] = response.text()
+        except Exception:
+            continue
+    return page.content(), page.url, fragments
+
+
+def _fetch_with_playwright(
+    url: str, *, intercept: bool = True, timeout: Optional[float] = BROWSER_TIMEOUT
+) -> tuple[str, str, dict[str, str]]:
+    """Playwrightを利用してJS実行後のHTMLと、捕捉できたAJAX断片を取得する。"""
+
+    with timed("browser"):
+        if intercept:
+            return get_browser_pool().run(lambda page: _render_menu_page_intercepted(page, url), timeout=timeout)
+        html_content, base_url = get_browser_pool().run(lambda page: _render_menu_page(page, url), timeout=timeout)
+    return html_content, base_url, {}
+
+
+def _download_fragment(
+    url: str,
+    host_limits: dict[str, threading.BoundedSemaphore],
+    *,
+    timeout: float,
+    retries: int,
+    backoff: float,
+    deadline: Optional[float] = None,
+) -> Optional[HTTPResult]:
+    """AJAX断片を1件取得する。失敗時はバックオフ付きで再試行し、最終的に失敗すればNone。
+
+    `deadline` (`time.monotonic()` の値) を過ぎた場合は再試行せずにNoneを返す。
+    """
+
+    limit = host_limits[urllib.parse.urlparse(url).netloc]
+    with timed("fragment", _fragment_label(url)):
+        for attempt in range(retries + 1):
+            attempt_timeout = timeout if deadline is None else min(timeout, deadline - time.monotonic())
+            if attempt_timeout <= 0:
+                return None
+            try:
+                with limit:
+                    return _http_session.get(url, timeout=attempt_timeout)
+            except urllib.error.HTTPError as exc:
+                if exc.code < 500:
+                    return None
+            except (http.client.HTTPException, OSError):
+                pass
+            if attempt < retries:
+                delay = backoff * (2 ** attempt)
+                if deadline is not None:
+                    delay = min(delay, max(0.0, deadline - time.monotonic()))
+                time.sleep(delay)
+    return None
+
+
+def _fetch_fragments(
+    urls: Sequence[str],
+    *,
+    timeout: float = FRAGMENT_TIMEOUT,
+    retries: int = FRAGMENT_RETRIES,
+    backoff: float = FRAGMENT_BACKOFF,
+    max_per_host: int = FRAGMENT_MAX_PER_HOST,
+    deadline: Optional[float] = None,
+) -> List[Optional[HTTPResult]]:
+    """複数のAJAX断片を並行に取得し、`urls` と同じ順序で結果 (失敗時はNone) を返す。"""
+
+    if not urls:
+        return []
+    hosts = {urllib.parse.urlparse(url).netloc for url in urls}
+    host_limits = {host: threading.BoundedSemaphore(max(1, max_per_host)) for host in hosts}
+    max_workers = min(len(urls), max(1, max_per_host) * len(hosts))
+    with timed("fragments"), ThreadPoolExecutor(
+        max_workers=max_workers, thread_name_prefix="menu-fragment"
+    ) as executor:
+        # 計測先を引き継ぐため、断片ごとに呼び出し元のcontextのコピー上で実行する
+        contexts = [contextvars.copy_context() for _ in urls]
+        return list(
+            executor.map(
+                lambda context, url: context.run(
+                    _download_fragment,
+                    url,
+                    host_limits,
+                    timeout=timeout,
+                    retries=retries,
+                    backoff=backoff,
+                    deadline=deadline,
+                ),
+                contexts,
+                urls,
+            )
+        )
+
+
+def _fragment_urls(html_content: str, base_url: str) -> List[str]:
+    """HTML中の `menu_load.php` 呼び出しを絶対URLに変換し、ソート済みで返す。"""
+
+    ajax_urls: set[str] = set()
+    for match in re.findall(r"menu_load\.php\?[^\"')]+", html_content):
+        full_url = urllib.parse.urljoin(base_url, match)
+        ajax_urls.add(full_url)
+    return sorted(ajax_urls)
+
+
+def _parse_menu(html_content: str, fragments: Sequence[tuple[str, str]]) -> List[MenuItem]:
+    """メインページと (URL, 本文) の断片一覧からMenuItemの一覧を抽出する。"""
+
+    aggregated: list[MenuItem] = []
+    with timed("parse"):
+        parser = MenuHTMLParser(category_labels=DEFAULT_CATEGORY_LABELS, collect_labels=True)
+        parser.feed(html_content)
+        aggregated.extend(parser.get_items())
+        category_labels = parser.category_labels
+
+        for ajax_url, fragment in fragments:
+            parsed_url = urllib.parse.urlparse(ajax_url)
+            query = urllib.parse.parse_qs(parsed_url.query)
+            category_code = query.get("a", [""])[0]
+            category_label = canonical_category(category_labels.get(category_code))
+            sub_parser = MenuHTMLParser(category_label, category_labels=category_labels)
+            sub_parser.feed(fragment)
+            aggregated.extend(sub_parser.get_items())
+
+    unique: dict[tuple[str, int], MenuItem] = {}
+    for item in aggregated:
+        key = (item.name, item.price)
+        if key not in unique or (unique[key].category is None and item.category):
+            unique[key] = item
+    return list(unique.values())
+
+
+def _extract_items_from_html(
+    html_content: str,
+    base_url: str,
+    *,
+    fetch_fragments: bool,
+    captured: Optional[dict[str, str]] = None,
+    deadline: Optional[float] = None,
+) -> List[MenuItem]:
+    """HTMLコンテンツからMenuItemの一覧を抽出する。
+
+    `captured` にはブラウザ内で捕捉済みの {断片URL: 本文} を渡せる。
+    """
+
+    bodies: dict[str, str] = {html.unescape(key): value for key, value in (captured or {}).items()}
+    if fetch_fragments:
+        # ブラウザで捕捉できなかった断片だけをHTTPで取得する
+        missing = [url for url in _fragment_urls(html_content, base_url) if html.unescape(url) not in bodies]
+        for ajax_url, result in zip(missing, _fetch_fragments(missing, deadline=deadline)):
+            if result is not None:
+                bodies[html.unescape(ajax_url)] = result.text
+    # 取得は並行に行うが、結合はURL順で行いuniqueの重複排除結果を安定させる
+    return _parse_menu(html_content, sorted(bodies.items()))
+
+
+def _menu_from_results(
+    url: str,
+    page: HTTPResult,
+    ordered_urls: Sequence[str],
+    results: Sequence[Optional[HTTPResult]],
+) -> MenuTable:
+    """ページと断片の取得結果を解析する。すべて304なら前回の解析結果を返す。"""
+
+    if page.not_modified and all(result is not None and result.not_modified for result in results):
+        with _parsed_menus_lock:
+            previous = _parsed_menus.get(url)
+        if previous is not None:
+            return previous
+
+    fragments = [
+        (ajax_url, result.text)
+        for ajax_url, result in zip(ordered_urls, results)
+        if result is not None
+    ]
+    items = MenuTable.from_items(_parse_menu(page.text, fragments))
+    with _parsed_menus_lock:
+        _parsed_menus[url] = items
+    return items
+
+
+def _fetch_with_urllib(url: str, deadline: Optional[float] = None) -> MenuTable:
+    """条件付きGETでメニューを取得する。ページと断片がすべて304なら前回の解析結果を返す。"""
+
+    page = _download_with_urllib(url, timeout=_remaining(deadline, FRAGMENT_TIMEOUT))
+    ordered_urls = _fragment_urls(page.text, page.url)
+    fragments = _fetch_fragments(ordered_urls, deadline=deadline)
+    return _menu_from_results(url, page, ordered_urls, fragments)
+
+
+def _remaining(deadline: Optional[float], default: Optional[float]) -> Optional[float]:
+    """期限までの残り秒数 (`default` が上限)。期限を過ぎていればSystemExit。"""
+
+    if deadline is None:
+        return default
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise SystemExit("メニューの取得がタイムアウトしました。")
+    return remaining if default is None else min(default, remaining)
+
+
+def fetch_menu(
+    url: str = MENU_URL, *, use_playwright: bool = True, intercept: bool = True, timeout: Optional[float] = None
+) -> MenuTable:
+    """指定URLからメニューを取得し、`MenuTable` として返す。
+
+    `intercept` がTrueの場合、Playwright内でAJAX断片のレスポンスを直接捕捉する。
+    Falseの場合はカテゴリを1つずつクリックして展開する従来の方式を用いる。
+    `timeout` を指定すると、ブラウザの空き待ちを含めて取得全体をその秒数で打ち切る
+    (期限までに取得できなかった断片は欠けたまま解析する)。
+    """
+
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    if use_playwright:
+        html_content, base_url, captured = _fetch_with_playwright(
+            url, intercept=intercept, timeout=_remaining(deadline, BROWSER_TIMEOUT)
+        )
+        items = MenuTable.from_items(
+            _extract_items_from_html(
+                html_content,
+                base_url,
+                fetch_fragments=True,
+                captured=captured,
+                deadline=deadline,
+            )
+        )
+    else:
+        items = _fetch_with_urllib(url, deadline)
+
+    if not items:
+        raise SystemExit("メニューが見つかりません。ページ構造が変更された可能性があります。")
+    return items
+
+
+class AsyncBrowserPool:
+    """PlaywrightのasyncioAPIでChromiumを常駐させ、ページを貸し出すプール。
+
+    ブラウザは起動したイベントループでしか操作できないため、別のループから使われた場合は
+    新しく起動し直す。同時に開くページ数は `max_pages` までに制限する。
+    """
+
+    def __init__(self, max_pages: int = 4, *, headless: bool = True, max_pages_per_browser: int = 200) -> None:
+        self.max_pages = max(1, max_pages)
+        self.headless = headless
+        self.max_pages_per_browser = max_pages_per_browser
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._playwright: Any = None
+        self._browser: Any = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._start_lock: Optional[asyncio.Lock] = None
+        self._pages_served = 0
+        self._active = 0
+        self._launches = 0
+        self._recycles = 0
+        self._pages = 0
+
+    def _bind_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            if self._playwright is not None:
+                self._close_detached(self._loop, self._browser, self._playwright)
+            self._loop = loop
+            self._playwright = None
+            self._browser = None
+            self._semaphore = asyncio.Semaphore(self.max_pages)
+            self._start_lock = asyncio.Lock()
+
+    @staticmethod
+    def _close_detached(loop: Optional[asyncio.AbstractEventLoop], browser: Any, playwright: Any) -> None:
+        """別のループで起動したブラウザとドライバを、そのループ上で終了させる。
+
+        ループが既に閉じられている場合は操作できないため、そのまま手放す。
+        """
+
+        if loop is None or loop.is_closed():
+            return
+
+        async def close() -> None:
+            try:
+                if browser is not None:
+                    await browser.close()
+            finally:
+                await playwright.stop()
+
+        if loop.is_running():
+            asyncio.run_coroutine_threadsafe(close(), loop)
+        else:
+            # 停止中のループは他のスレッドからでも回せるため、終了処理だけを別スレッドで実行する
+            threading.Thread(
+                target=lambda: loop.run_until_complete(close()), name="async-browser-close", daemon=True
+            ).start()
+
+    async def _ensure_browser(self) -> Any:
+        try:
+            from playwright.async_api import async_playwright
+        except ImportError as exc:  # pragma: no cover - Playwright未インストール
+            raise SystemExit(
+                "Playwrightがインストールされていません。`pip install playwright` と "
+                "`playwright install chromium` を実行してください。"
+            ) from exc
+
+        assert self._start_lock is not None
+        async with self._start_lock:
+            if self._browser is not None and self._active == 0 and (
+                not self._browser.is_connected()
+                or (self.max_pages_per_browser and self._pages_served >= self.max_pages_per_browser)
+            ):
+                # 貸し出し中のページがないときだけ、切断済み・上限到達のブラウザを起動し直す
+                self._recycles += 1
+                try:
+                    await self._browser.close()
+                except Exception:
+                    pass
+                self._browser = None
+            if self._playwright is None:
+                self._playwright = await async_playwright().start()
+            if self._browser is None:
+                self._browser = await self._playwright.chromium.launch(headless=self.headless)
+                self._pages_served = 0
+                self._launches += 1
+            return self._browser
+
+    async def run(self, func: Callable[[Any], Any], *, timeout: Optional[float] = None) -> Any:
+        """ページを1枚借りて `await func(page)` を実行し、その戻り値を返す。"""
+
+        self._bind_loop()
+        assert self._semaphore is not None
+        async with self._semaphore:
+            browser = await self._ensure_browser()
+            context = None
+            # new_contextが失敗した場合 (ブラウザのクラッシュなど) も貸し出し数を戻し、次回に起動し直せるようにする
+            self._active += 1
+            try:
+                context = await browser.new_context()
+                return await asyncio.wait_for(func(await context.new_page()), timeout)
+            except asyncio.TimeoutError as exc:
+                raise SystemExit("ブラウザでの取得がタイムアウトしました。") from exc
+            finally:
+                self._active -= 1
+                self._pages_served += 1
+                self._pages += 1
+                if context is not None:
+                    await context.close()
+
+    def stats(self) -> dict[str, int]:
+        """起動回数・再起動回数・処理したページ数を返す。"""
+
+        return {
+            "size": self.max_pages,
+            "launches": self._launches,
+            "recycles": self._recycles,
+            "pages": self._pages,
+        }
+
+    async def close(self) -> None:
+        """ブラウザとPlaywrightドライバを終了する。"""
+
+        if self._browser is not None:
+            await self._browser.close()
+            self._browser = None
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
+
+
+_async_browser_pool: Optional[AsyncBrowserPool] = None
+
+
+def get_async_browser_pool() -> AsyncBrowserPool:
+    """プロセス共通のasyncio版ブラウザプールを返す。同時ページ数は `MEAL_BROWSER_MAX_CONCURRENT_PAGES` で設定する。"""
+
+    global _async_browser_pool
+    with _browser_pool_lock:
+        if _async_browser_pool is None:
+            _async_browser_pool = AsyncBrowserPool(
+                int(os.environ.get("MEAL_BROWSER_MAX_CONCURRENT_PAGES", "4")),
+                max_pages_per_browser=int(os.environ.get("MEAL_BROWSER_MAX_PAGES", "200")),
+            )
+        return _async_browser_pool
+
+
+async def _render_menu_page_async(page: Any, url: str) -> tuple[str, str]:
+    """`_render_menu_page` のasyncio版。"""
+
+    with timed("navigate"):
+        await page.goto(url, wait_until="networkidle")
+    with timed("expand"):
+        toggle_ids: List[str] = await page.eval_on_selector_all(
+            "p.toggleTitle[id]", "els => els.map(el => el.id)"
+        )
+        for toggle_id in toggle_ids:
+            try:
+                await page.click(f"#{toggle_id}")
+                await page.wait_for_timeout(200)
+                await page.wait_for_load_state("networkidle")
+            except Exception:
+                continue
+    return await page.content(), page.url
+
+
+async def _render_menu_page_intercepted_async(page: Any, url: str) -> tuple[str, str, dict[str, str]]:
+    """`_render_menu_page_intercepted` のasyncio版。"""
+
+    pending: set[Any] = set()
+    finished: List[Any] = []
+
+    async def route_handler(route: Any) -> None:
+        if route.request.resource_type in BLOCKED_RESOURCE_TYPES:
+            await route.abort()
+        else:
+            await route.continue_()
+
+    def on_request(request: Any) -> None:
+        if "menu_load.php" in request.url:
+            pending.add(request)
+
+    def on_request_finished(request: Any) -> None:
+        if request in pending:
+            pending.discard(request)
+            finished.append(request)
+
+    await page.route("**/*", route_handler)
+    page.on("request", on_request)
+    page.on("requestfinished", on_request_finished)
+    page.on("requestfailed", lambda request: pending.discard(request))
+
+    with timed("navigate"):
+        await page.goto(url, wait_until="domcontentloaded")
+    with timed("expand"):
+        await page.eval_on_selector_all("p.toggleTitle[id]", "els => els.forEach(el => el.click())")
+
+        deadline = time.monotonic() + INTERCEPT_TIMEOUT
+        quiet_since = time.monotonic()
+        while time.monotonic() < deadline:
+            await page.wait_for_timeout(50)
+            if pending:
+                quiet_since = time.monotonic()
+            elif time.monotonic() - quiet_since >= INTERCEPT_QUIET_PERIOD:
+                break
+
+    fragments: dict[str, str] = {}
+    for request in finished:
+        response = await request.response()
+        if response is None or not response.ok:
+            continue
+        try:
+            fragments[request.url] = await response.text()
+        except Exception:
+            continue
+    return await page.content(), page.url, fragments
+
+
+async def _download_fragment_async(
+    url: str,
+    host_limits: dict[str, asyncio.Semaphore],
+    *,
+    timeout: float,
+    retries: int,
+    backoff: float,
+) -> Optional[HTTPResult]:
+    """`_download_fragment` のasyncio版。"""
+
+    limit = host_limits[urllib.parse.urlparse(url).netloc]
+    with timed("fragment", _fragment_label(url)):
+        for attempt in range(retries + 1):
+            try:
+                async with limit:
+                    return await _http_session.get_async(url, timeout=timeout)
+            except urllib.error.HTTPError as exc:
+                if exc.code < 500:
+                    return None
+            except (http.client.HTTPException, OSError):
+                pass
+            if attempt < retries:
+                await asyncio.sleep(backoff * (2 ** attempt))
+    return None
+
+
+async def _fetch_fragments_async(
+    urls: Sequence[str],
+    *,
+    timeout: float = FRAGMENT_TIMEOUT,
+    retries: int = FRAGMENT_RETRIES,
+    backoff: float = FRAGMENT_BACKOFF,
+    max_per_host: int = FRAGMENT_MAX_PER_HOST,
+) -> List[Optional[HTTPResult]]:
+    """`_fetch_fragments` のasyncio版。スレッドを使わず並行に取得する。"""
+
+    hosts = {urllib.parse.urlparse(url).netloc for url in urls}
+    host_limits = {host: asyncio.Semaphore(max(1, max_per_host)) for host in hosts}
+    with timed("fragments"):
+        return list(
+            await asyncio.gather(
+                *(
+                    _download_fragment_async(url, host_limits, timeout=timeout, retries=retries, backoff=backoff)
+                    for url in urls
+                )
+            )
+        )
+
+
+async def _extract_items_from_html_async(
+    html_content: str,
+    base_url: str,
+    *,
+    captured: Optional[dict[str, str]] = None,
+) -> List[MenuItem]:
+    """`_extract_items_from_html` のasyncio版。捕捉できなかった断片だけを取得する。"""
+
+    bodies: dict[str, str] = {html.unescape(key): value for key, value in (captured or {}).items()}
+    missing = [url for url in _fragment_urls(html_content, base_url) if html.unescape(url) not in bodies]
+    for ajax_url, result in zip(missing, await _fetch_fragments_async(missing)):
+        if result is not None:
+            bodies[html.unescape(ajax_url)] = result.text
+    return _parse_menu(html_content, sorted(bodies.items()))
+
+
+async def _fetch_with_urllib_async(url: str) -> MenuTable:
+    """`_fetch_with_urllib` のasyncio版。"""
+
+    try:
+        with timed("page"):
+            page = await _http_session.get_async(url)
+    except (urllib.error.URLError, http.client.HTTPException, OSError) as exc:
+        raise SystemExit(f"メニューのダウンロードに失敗しました: {exc}") from exc
+    ordered_urls = _fragment_urls(page.text, page.url)
+    return _menu_from_results(url, page, ordered_urls, await _fetch_fragments_async(ordered_urls))
+
+
+async def fetch_menu_async(url: str = MENU_URL, *, use_playwright: bool = True, intercept: bool = True) -> MenuTable:
+    """`fetch_menu` のasyncio版。ブラウザ操作とHTTP通信の間イベントループを塞がない。"""
+
+    if use_playwright:
+        pool = get_async_browser_pool()
+        with timed("browser"):
+            if intercept:
+                html_content, base_url, captured = await pool.run(
+                    lambda page: _render_menu_page_intercepted_async(page, url), timeout=BROWSER_TIMEOUT
+                )
+            else:
+                html_content, base_url = await pool.run(
+                    lambda page: _render_menu_page_async(page, url), timeout=BROWSER_TIMEOUT
+                )
+                captured = {}
+        items = MenuTable.from_items(await _extract_items_from_html_async(html_content, base_url, captured=captured))
+    else:
+        items = await _fetch_with_urllib_async(url)
+
+    if not items:
+        raise SystemExit("メニューが見つかりません。ページ構造が変更された可能性があります。")
+    return items
+
+
+class _ComboNodes:
+    """組み合わせを (最後の品目, 直前のノード) の連結リストとして保持する整数配列。
+
+    遷移ごとにリストを複製する代わりにノードを1つ追加する。ノードは書き換えないため、
+    後から直前の金額のセルが更新されても、既に記録した組み合わせは変わらない。
+    """
+
+    __slots__ = ("item", "parent", "length")
+
+    def __init__(self) -> None:
+        # ノード0は空の組み合わせ
+        self.item = array("i", [-1])
+        self.parent = array("i", [-1])
+        self.length = array("i", [0])
+
+    def push(self, parent: int, item_index: int) -> int:
+        self.item.append(item_index)
+        self.parent.append(parent)
+        self.length.append(self.length[parent] + 1)
+        return len(self.item) - 1
+
+    def combo(self, node: int, items: Sequence[MenuItem]) -> List[MenuItem]:
+        """ノードを辿り、追加された順のMenuItemリストに復元する。"""
+
+        indices: List[int] = []
+        while node > 0:
+            indices.append(self.item[node])
+            node = self.parent[node]
+        return [items[index] for index in reversed(indices)]
+
+
+SOLVERS = ("auto", "python", "numpy")
+
+
+def _numpy_available() -> bool:
+    return importlib.util.find_spec("numpy") is not None
+
+
+_STATE_PRIMARY = 1
+_STATE_RICE = 2
+_STATE_DON = 4
+_STATE_SLOTS = 8
+# 到達し得る状態: 空、主菜(丼以外)、主菜(丼・カレー)、主菜(丼以外)+ライス
+_REACHABLE_STATES = (0, _STATE_PRIMARY, _STATE_PRIMARY | _STATE_DON, _STATE_PRIMARY | _STATE_RICE)
+
+
+def _limited_transitions(is_primary: bool, is_rice: bool, is_don: bool) -> List[int]:
+    """品目を追加したときの状態遷移表を返す。要素は遷移後の状態 (追加不可なら-1)。
+
+    状態は「主菜あり」「ライスあり」「主菜が丼・カレー」をビットで表した整数。
+    """
+
+    transitions: List[int] = []
+    for state in range(_STATE_SLOTS):
+        has_primary = bool(state & _STATE_PRIMARY)
+        has_rice = bool(state & _STATE_RICE)
+        primary_is_don = bool(state & _STATE_DON)
+        if is_primary and has_primary:
+            transitions.append(-1)
+            continue
+        if is_rice and (has_rice or not has_primary or primary_is_don):
+            transitions.append(-1)
+            continue
+        new_state = state
+        if is_primary:
+            new_state |= _STATE_PRIMARY
+            if is_don:
+                new_state |= _STATE_DON
+        if is_rice:
+            new_state |= _STATE_RICE
+        transitions.append(new_state)
+    return transitions
+
+
+_SolvedTable = Tuple[List[int], Callable[[int], List[MenuItem]]]
+
+
+def _fill_limited_python(items: Sequence[MenuItem], budget: int) -> _SolvedTable:
+    """主菜系1品までの制約付きで、予算までの全金額について最良の組み合わせを純Pythonで求める。
+
+    金額×状態ごとのノード番号を平坦な整数配列で持つ。同じ品数の候補では先に現れた状態を
+    優先するため、各金額で状態が追加された順序も3ビットずつ詰めた整数で記録する。
+
+    Returns:
+        (到達可能な合計金額の昇順リスト, 合計金額から組み合わせを復元する関数)
+    """
+
+    nodes = _ComboNodes()
+    # 内側のループではメソッド呼び出しを避け、ノード配列へ直接追加する
+    node_items, node_parents, lengths = nodes.item, nodes.parent, nodes.length
+
+    flags = [
+        (bool(item.flags & ITEM_PRIMARY), bool(item.flags & ITEM_RICE), bool(item.flags & ITEM_DON))
+        for item in items
+    ]
+
+    def sort_key(index: int) -> tuple[int, int]:
+        is_primary, is_rice, _ = flags[index]
+        if is_rice:
+            return (2, items[index].price)
+        if is_primary:
+            return (0, items[index].price)
+        return (1, items[index].price)
+
+    order = sorted(range(len(items)), key=sort_key)
+    ordered_items = [items[index] for index in order]
+
+    best = array("i", [-1]) * ((budget + 1) * _STATE_SLOTS)
+    state_order = array("i", [0]) * (budget + 1)
+    state_count = array("b", [0]) * (budget + 1)
+    best[0] = 0
+    state_count[0] = 1
+    # 詰めた追加順序から状態のタプルへの展開結果 (取り得る並びは高々数十通り)
+    unpacked: dict[int, tuple[int, ...]] = {}
+
+    for index, original_index in enumerate(order):
+        is_primary, is_rice, is_don = flags[original_index]
+        price = ordered_items[index].price
+        transitions = _limited_transitions(is_primary, is_rice, is_don)
+
+        if is_primary or is_rice:
+            # 主菜・ライスの追加元になり得る状態は、主菜なら「空」、ライスなら「丼以外の主菜のみ」の
+            # 1つだけなので、セル内の全状態を走査せず該当スロットだけを調べる
+            moves = [
+                (state, transitions[state])
+                for state in _REACHABLE_STATES
+                if transitions[state] >= 0
+            ]
+            for source in range(budget - price, -1, -1):
+                target = source + price
+                for state, new_state in moves:
+                    node = best[source * _STATE_SLOTS + state]
+                    if node < 0:
+                        continue
+                    slot = target * _STATE_SLOTS + new_state
+                    existing = best[slot]
+                    new_length = lengths[node] + 1
+                    if existing < 0:
+                        state_order[target] |= new_state << (3 * state_count[target])
+                        state_count[target] += 1
+                    elif new_length >= lengths[existing]:
+                        continue
+                    best[slot] = len(lengths)
+                    node_items.append(index)
+                    node_parents.append(node)
+                    lengths.append(new_length)
+            continue
+
+        # 主菜以外は状態を変えずに何品でも追加できる。新しく現れる状態の順序は追加元のセルの順序に従う
+        for target in range(price, budget + 1):
+            source = target - price
+            count = state_count[source]
+            if not count:
+                continue
+            packed = state_order[source]
+            # 状態0は末尾にも現れ得るため、件数も含めてキーにする
+            key = (packed << 3) | count
+            states = unpacked.get(key)
+            if states is None:
+                states = unpacked[key] = tuple((packed >> (3 * position)) & 7 for position in range(count))
+            for state in states:
+                node = best[source * _STATE_SLOTS + state]
+                slot = target * _STATE_SLOTS + state
+                existing = best[slot]
+                new_length = lengths[node] + 1
+                if existing < 0:
+                    state_order[target] |= state << (3 * state_count[target])
+                    state_count[target] += 1
+                elif new_length >= lengths[existing]:
+                    continue
+                best[slot] = len(lengths)
+                node_items.append(index)
+                node_parents.append(node)
+                lengths.append(new_length)
+
+    def combo_at(total: int) -> List[MenuItem]:
+        count = state_count[total]
+        packed = state_order[total]
+        preferred_state = packed & 7
+        preferred_node = best[total * _STATE_SLOTS + preferred_state]
+        for position in range(1, count):
+            state = (packed >> (3 * position)) & 7
+            node = best[total * _STATE_SLOTS + state]
+            has_primary = bool(state & _STATE_PRIMARY)
+            preferred_primary = bool(preferred_state & _STATE_PRIMARY)
+            prefers_current = has_primary and not preferred_primary
+            same_primary = has_primary == preferred_primary
+            if prefers_current or (same_primary and lengths[node] < lengths[preferred_node]):
+                preferred_state = state
+                preferred_node = node
+        return nodes.combo(preferred_node, ordered_items)
+
+    return [total for total in range(budget + 1) if state_count[total]], combo_at
+
+
+
+def _fill_limited_numpy(items: Sequence[MenuItem], budget: int) -> _SolvedTable:
+    """`_fill_limited_python` と同じ結果をNumPyの配列演算で求める。
+
+    到達し得る4状態 (空・主菜・丼の主菜・主菜+ライス) の品数を列に持つ。主菜は空の状態 (0円のみ) から、
+    ライスは主菜の状態からしか追加できないため、それぞれ1か所の更新と配列のずらしで済む。
+    主菜以外の品目は状態ごとに `_fill_unrestricted_numpy` と同じ累積最小値で更新する。
+    同じ品数の「主菜」と「丼の主菜」は先に現れた方を選ぶため、金額ごとにその順序も記録する。
+    """
+
+    import numpy as np
+
+    empty, primary, don, rice = range(len(_REACHABLE_STATES))
+    flags = [
+        (bool(item.flags & ITEM_PRIMARY), bool(item.flags & ITEM_RICE), bool(item.flags & ITEM_DON))
+        for item in items
+    ]
+
+    def sort_key(index: int) -> tuple[int, int]:
+        is_primary, is_rice, _ = flags[index]
+        return (2 if is_rice else 0 if is_primary else 1, items[index].price)
+
+    order = sorted(range(len(items)), key=sort_key)
+    ordered_items = [items[index] for index in order]
+    ordered_flags = [flags[index] for index in order]
+
+    size = budget + 1
+    unreachable = np.int64(1 << 40)
+    counts = np.full((size, len(_REACHABLE_STATES)), unreachable, dtype=np.int64)
+    counts[0, empty] = 0
+    # 品目ごとに、品数を改善した (金額, 状態) を状態のビットで記録する
+    updated = np.zeros((len(ordered_items), size), dtype=np.uint8)
+    # 「主菜」と「丼の主菜」の両方に到達した金額で、丼の主菜が先に現れたかどうか
+    don_first = np.zeros(size, dtype=bool)
+    weights = np.array([1 << empty, 1 << primary, 1 << don], dtype=np.uint8)
+
+    for index, item in enumerate(ordered_items):
+        is_primary, is_rice, is_don = ordered_flags[index]
+        price = item.price
+        # 主菜かつライスの品目はどの状態にも追加できない
+        if price > budget or (is_primary and is_rice):
+            continue
+
+        if is_primary:
+            column = don if is_don else primary
+            if counts[price, column] < unreachable:
+                continue
+            counts[price, column] = 1
+            updated[index, price] = 1 << column
+            other_reached = counts[price, primary + don - column] < unreachable
+            don_first[price] = (column == primary) if other_reached else (column == don)
+            continue
+
+        if is_rice:
+            candidate = counts[: size - price, primary] + 1
+            improved = candidate < counts[price:, rice]
+            counts[price:, rice][improved] = candidate[improved]
+            updated[index, price:][improved] = 1 << rice
+            continue
+
+        # 0円の品目は品数が増えるだけで改善にならない
+        if price <= 0:
+            continue
+        # 主菜以外の品目の段階では「主菜+ライス」には到達していないため、残りの3状態だけを更新する
+        rows = -(-size // price)
+        grid = np.full((rows * price, rice), unreachable, dtype=np.int64)
+        grid[:size] = counts[:, :rice]
+        grid = grid.reshape(rows, price, rice)
+        steps = np.arange(rows, dtype=np.int64)[:, None, None]
+        best = np.minimum.accumulate(grid - steps, axis=0) + steps
+        improved = best < grid
+        best = np.minimum(grid, best)
+
+        # 一方だけ先に到達していればそちらが先。この品目で両方に初めて到達した金額は、
+        # 追加元 (1行前の同じ剰余の金額) の順序を引き継ぐ
+        before = grid[..., primary:rice] < unreachable
+        after = best[..., primary:rice] < unreachable
+        first = np.zeros(rows * price, dtype=bool)
+        first[:size] = don_first
+        first = np.where(before.all(axis=-1), first.reshape(rows, price), before[..., 1])
+        both_new = after.all(axis=-1) & ~before.any(axis=-1)
+        source_rows = np.where(both_new, 0, np.arange(rows)[:, None])
+        first = np.take_along_axis(first, np.maximum.accumulate(source_rows, axis=0), axis=0)
+
+        counts[:, :rice] = best.reshape(-1, rice)[:size]
+        don_first = first.reshape(-1)[:size]
+        updated[index] = (improved * weights).sum(axis=-1, dtype=np.uint8).reshape(-1)[:size]
+
+    def combo_at(total: int) -> List[MenuItem]:
+        # 主菜を含む状態のうち品数が最少のもの (同数なら先に現れたもの)、なければ空の状態
+        row = counts[total]
+        column = empty
+        for state in ((don, primary) if don_first[total] else (primary, don)) + (rice,):
+            if row[state] < unreachable and (column == empty or row[state] < row[column]):
+                column = state
+        chosen: List[int] = []
+        amount = total
+        limit = len(ordered_items)
+        while amount > 0 or column != empty:
+            index = int(np.flatnonzero(updated[:limit, amount] & (1 << column))[-1])
+            chosen.append(index)
+            amount -= ordered_items[index].price
+            is_primary, is_rice, _ = ordered_flags[index]
+            if is_primary:
+                column = empty
+            elif is_rice:
+                column = primary
+            limit = index + 1
+        return [ordered_items[index] for index in reversed(chosen)]
+
+    return np.flatnonzero((counts < unreachable).any(axis=1)).tolist(), combo_at
+
+
+def _fill_unrestricted_python(items: Sequence[MenuItem], budget: int) -> _SolvedTable:
+    """制約なしで、予算までの全金額について最良の組み合わせを純Pythonで求める。"""
+
+    nodes = _ComboNodes()
+    lengths = nodes.length
+
+    # 各金額に対し最良の組み合わせのノード番号を記録 (-1は未到達)
+    candidates = list(items)
+    best = array("i", [-1]) * (budget + 1)
+    best[0] = 0
+
+    for index, item in enumerate(candidates):
+        price = item.price
+        for amount in range(price, budget + 1):
+            prev = best[amount - price]
+            if prev < 0:
+                continue
+            existing = best[amount]
+            if existing < 0 or lengths[prev] + 1 < lengths[existing]:
+                best[amount] = nodes.push(prev, index)
+
+    def combo_at(total: int) -> List[MenuItem]:
+        return nodes.combo(best[total], candidates)
+
+    return [total for total in range(budget + 1) if best[total] >= 0], combo_at
+
+
+
+def _fill_unrestricted_numpy(items: Sequence[MenuItem], budget: int) -> _SolvedTable:
+    """`_fill_unrestricted_python` と同じ結果をNumPyの配列演算で求める。
+
+    品目ごとに、金額を価格で割った剰余クラスの列に並べ替えると、個数制限なしの更新
+    `new[a] = min(old[a], new[a - price] + 1)` は累積最小値1回で計算できる。
+    各品目で品数が改善された金額を記録しておき、最後にそこから組み合わせを復元する。
+    """
+
+    import numpy as np
+
+    candidates = list(items)
+    size = budget + 1
+    unreachable = np.int64(1 << 40)
+    counts = np.full(size, unreachable, dtype=np.int64)
+    counts[0] = 0
+    updated = np.zeros((len(candidates), size), dtype=bool)
+
+    for index, item in enumerate(candidates):
+        price = item.price
+        # 0円の品目は品数が増えるだけで改善にならず、予算超過の品目は置けない
+        if price <= 0 or price > budget:
+            continue
+        rows = -(-size // price)
+        grid = np.full(rows * price, unreachable, dtype=np.int64)
+        grid[:size] = counts
+        grid = grid.reshape(rows, price)
+        steps = np.arange(rows, dtype=np.int64)[:, None]
+        best = np.minimum.accumulate(grid - steps, axis=0) + steps
+        updated[index] = (best < grid).reshape(-1)[:size]
+        counts = np.minimum(grid, best).reshape(-1)[:size]
+
+    def combo_at(total: int) -> List[MenuItem]:
+        # 金額aの組み合わせは「aを最後に改善した品目j」と「jの処理直後のa - price_jの組み合わせ」から成る
+        chosen: List[int] = []
+        amount = total
+        limit = len(candidates)
+        while amount > 0:
+            index = int(np.flatnonzero(updated[:limit, amount])[-1])
+            chosen.append(index)
+            amount -= candidates[index].price
+            limit = index + 1
+        return [candidates[index] for index in reversed(chosen)]
+
+    return np.flatnonzero(counts < unreachable).tolist(), combo_at
+
+
+
+def _compress_problem(
+    items: Sequence[MenuItem],
+    budget: int,
+    limit_primary: bool,
+) -> tuple[List[MenuItem], dict[int, int], int, int]:
+    """価格の最大公約数で金額を縮約し、解に現れ得ない重複品目を取り除いた問題を作る。
+
+    価格と分類が同じ品目は、探索順で先にある1品が常に同等以上の遷移を済ませているため、
+    後続の品目が組み合わせを改善することはない。そのため代表の1品だけを残しても結果は変わらない。
+
+    Returns:
+        (縮約後の品目, 縮約後の品目idから元の品目の添字への対応, 縮約率, 縮約後の予算)
+    """
+
+    if isinstance(items, MenuTable):
+        # 列配列を直接参照し、行ごとの属性参照を避ける
+        prices: Sequence[int] = items.prices
+        flags: Sequence[int] = items.flags
+    else:
+        prices = [item.price for item in items]
+        flags = [item.flags for item in items]
+    scale = 0
+    for price in prices:
+        scale = math.gcd(scale, price)
+    if scale <= 1 or min(prices) < 0:
+        scale = 1
+
+    reduced: List[MenuItem] = []
+    originals: dict[int, int] = {}
+    seen: set[tuple[int, ...]] = set()
+    for index, price in enumerate(prices):
+        if limit_primary:
+            key: tuple[int, ...] = (price, flags[index] & (ITEM_PRIMARY | ITEM_RICE | ITEM_DON))
+        else:
+            key = (price,)
+        if key in seen:
+            continue
+        seen.add(key)
+        item = items[index]
+        scaled = item if scale == 1 else MenuItem(item.name, price // scale, item.category)
+        reduced.append(scaled)
+        originals[id(scaled)] = index
+    return reduced, originals, scale, budget // scale
+
+
+def _check_solver(budget: int, solver: str) -> None:
+    if budget < 0:
+        raise ValueError("budgetは0以上の整数である必要があります")
+    if solver not in SOLVERS:
+        raise ValueError(f"solverは {', '.join(SOLVERS)} のいずれかである必要があります")
+    if solver == "numpy" and not _numpy_available():
+        raise SystemExit("NumPyがインストールされていません。`pip install numpy` を実行してください。")
+
+
+def _solve_table(
+    items: Sequence[MenuItem],
+    budget: int,
+    limit_primary: bool,
+    solver: str,
+) -> tuple[List[int], Callable[[int], List[int]]]:
+    """予算までの全金額を解き、(到達可能な合計金額, 合計金額から元の品目の添字列を返す関数) を返す。"""
+
+    reduced, originals, scale, reduced_budget = _compress_problem(items, budget, limit_primary)
+    use_numpy = solver == "numpy" or (solver == "auto" and _numpy_available())
+    if limit_primary:
+        fill = _fill_limited_numpy if use_numpy else _fill_limited_python
+    else:
+        fill = _fill_unrestricted_numpy if use_numpy else _fill_unrestricted_python
+    reachable, combo_at = fill(reduced, reduced_budget)
+
+    def indices_at(total: int) -> List[int]:
+        return [originals[id(item)] for item in combo_at(total // scale)]
+
+    return [total * scale for total in reachable], indices_at
+
+
+def best_combination(
+    items: Sequence[MenuItem],
+    budget: int,
+    limit_primary: bool = False,
+    *,
+    solver: str = "auto",
+) -> Tuple[int, List[MenuItem]]:
+    """予算内で最大の合計金額となるメニュー組み合わせを探索する。
+
+    同じ金額の候補が複数ある場合は品数が少ない方を優先し、同数なら先に見つかった方を残す。
+
+    Args:
+        items: 候補となるメニュー一覧。`MenuTable` の場合は価格・分類の配列を直接参照する。
+        budget: 予算上限。
+        limit_primary: Trueの場合、`PRIMARY_LIMIT_CATEGORIES`に属するメニューは合計で1品のみ選択する。
+        solver: 探索エンジン。"numpy" はNumPyによるベクトル化版、"python" は純Python版、
+            "auto" はNumPyがあれば使う。
+    """
+
+    _check_solver(budget, solver)
+    if not items:
+        return 0, []
+
+    total, indices = _best_indices(items, budget, limit_primary, solver)
+    return total, [items[index] for index in indices]
+
+
+def _best_indices(items: Sequence[MenuItem], budget: int, limit_primary: bool, solver: str) -> Tuple[int, List[int]]:
+    reachable, indices_at = _solve_table(items, budget, limit_primary, solver)
+    total = reachable[-1]
+    return total, indices_at(total)
+
+
+class BudgetFrontier:
+    """0円から `max_budget` 円までの全予算に対する最適解を階段関数として保持する。
+
+    最適合計は到達可能な合計金額でしか変わらないため、その金額 (`totals`) ごとに組み合わせを
+    品目の添字列として記録する。組み合わせは `offsets` で区切った1本の整数配列 `indices` に詰める。
+    """
+
+    __slots__ = ("items", "max_budget", "limit_primary", "totals", "offsets", "indices")
+
+    def __init__(
+        self,
+        items: MenuTable,
+        max_budget: int,
+        limit_primary: bool,
+        totals: Sequence[int],
+        offsets: Sequence[int],
+        indices: Sequence[int],
+    ) -> None:
+        self.items = items
+        self.max_budget = max_budget
+        self.limit_primary = limit_primary
+        self.totals = array("i", totals)
+        self.offsets = array("i", offsets)
+        self.indices = array("i", indices)
+
+    def __len__(self) -> int:
+        return len(self.totals)
+
+    def covers(self, budget: int) -> bool:
+        return 0 <= budget <= self.max_budget
+
+    def combo_indices(self, step: int) -> List[int]:
+        return self.indices[self.offsets[step]:self.offsets[step + 1]].tolist()
+
+    def lookup(self, budget: int) -> Tuple[int, List[MenuItem]]:
+        """予算 `budget` に対する `best_combination` と同じ結果を二分探索で返す。"""
+
+        if not self.covers(budget):
+            raise ValueError(f"budgetは0以上{self.max_budget}以下である必要があります")
+        if not self.totals:
+            return 0, []
+        step = bisect.bisect_right(self.totals, budget) - 1
+        return self.totals[step], [self.items[index] for index in self.combo_indices(step)]
+
+    def steps(self) -> Iterator[Tuple[int, List[MenuItem]]]:
+        """(最適合計, 組み合わせ) を合計金額の昇順に返す。"""
+
+        for step, total in enumerate(self.totals):
+            yield total, [self.items[index] for index in self.combo_indices(step)]
+
+    def to_dict(self) -> dict[str, Any]:
+        """品目以外を辞書化する。品目は `from_dict` に別途渡す。"""
+
+        return {
+            "max_budget": self.max_budget,
+            "limit_primary": self.limit_primary,
+            "totals": self.totals.tolist(),
+            "offsets": self.offsets.tolist(),
+            "indices": self.indices.tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any], items: MenuTable) -> "BudgetFrontier":
+        return cls(
+            items,
+            int(data["max_budget"]),
+            bool(data["limit_primary"]),
+            data["totals"],
+            data["offsets"],
+            data["indices"],
+        )
+
+
+def budget_frontier(
+    items: Sequence[MenuItem],
+    max_budget: int,
+    limit_primary: bool = False,
+    *,
+    solver: str = "auto",
+) -> BudgetFrontier:
+    """1回の探索で、0円から `max_budget` 円までの全予算の最適解を求める。
+
+    各予算に対する結果は `best_combination(items, budget, limit_primary)` と一致する。
+    """
+
+    _check_solver(max_budget, solver)
+    table = MenuTable.from_items(items)
+    if not table:
+        return BudgetFrontier(table, max_budget, limit_primary, [], [0], [])
+
+    reachable, indices_at = _solve_table(table, max_budget, limit_primary, solver)
+    offsets = [0]
+    indices: List[int] = []
+    for total in reachable:
+        indices.extend(indices_at(total))
+        offsets.append(len(indices))
+    return BudgetFrontier(table, max_budget, limit_primary, reachable, offsets, indices)
+
+
+class CombinationCache:
+    """`best_combination` の結果を (メニューの指紋, 予算, 制約) ごとに保持するLRUキャッシュ。
+
+    `menu_key` (食堂IDなど) を渡すと、そのメニューの指紋が変わった時点で古い指紋の結果を破棄する。
+    """
+
+    def __init__(self, max_entries: int = 1024) -> None:
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple[str, int, bool], tuple[int, tuple[Any, ...]]]" = OrderedDict()
+        self._fingerprints: dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    def best_combination(
+        self,
+        items: Sequence[MenuItem],
+        budget: int,
+        limit_primary: bool = False,
+        *,
+        solver: str = "auto",
+        menu_key: Optional[str] = None,
+        solve: Optional[Callable[[], Tuple[int, List[Any]]]] = None,
+    ) -> Tuple[int, List[Any]]:
+        """キャッシュ済みの結果を返す。なければ `solve` (省略時は `best_combination`) で求めて保持する。
+
+        探索エンジンは結果に影響しないため、キーには含めない。`max_entries` が0以下なら
+        指紋を求めずにそのまま解く。
+        """
+
+        if self.max_entries <= 0:
+            with self._lock:
+                self._misses += 1
+            if solve is None:
+                return best_combination(items, budget, limit_primary, solver=solver)
+            return solve()
+
+        fingerprint = MenuTable.from_items(items).fingerprint()
+        key = (fingerprint, budget, limit_primary)
+        with self._lock:
+            if menu_key is not None:
+                self._observe(menu_key, fingerprint)
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return cached[0], list(cached[1])
+            self._misses += 1
+
+        if solve is None:
+            total, combo = best_combination(items, budget, limit_primary, solver=solver)
+        else:
+            total, combo = solve()
+        with self._lock:
+            self._entries[key] = (total, tuple(combo))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+        return total, list(combo)
+
+    def _observe(self, menu_key: str, fingerprint: str) -> None:
+        previous = self._fingerprints.get(menu_key)
+        if previous == fingerprint:
+            return
+        self._fingerprints[menu_key] = fingerprint
+        if previous is None or previous in self._fingerprints.values():
+            return
+        stale = [key for key in self._entries if key[0] == previous]
+        for key in stale:
+            del self._entries[key]
+        self._invalidations += len(stale)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._fingerprints.clear()
+
+    def stats(self) -> dict[str, int]:
+        """ヒット数・ミス数・容量超過による破棄数・メニュー変更による破棄数・保持件数を返す。"""
+
+        with self._lock:
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "invalidations": self._invalidations,
+                "entries": len(self._entries),
+            }
+
+
+class SolverUnavailable(RuntimeError):
+    """ソルバーの実行を受け付けられなかった、または時間内に終わらなかった。"""
+
+
+class SolverBusy(SolverUnavailable):
+    """プロセスプールの待ち行列が満杯。"""
+
+
+class SolverTimeout(SolverUnavailable):
+    """ジョブが制限時間内に終わらなかった。"""
+
+
+def _solve_compact(prices: bytes, flags: bytes, budget: int, limit_primary: bool, solver: str) -> Tuple[int, List[int]]:
+    """プロセスプール側で実行する。価格と分類ビットの配列だけから解き、(合計, 添字列) を返す。"""
+
+    price_column = array("i")
+    price_column.frombytes(prices)
+    flag_column = array("B")
+    flag_column.frombytes(flags)
+    count = len(price_column)
+    table = MenuTable([""] * count, price_column, [0] * count, (None,), flag_column)
+    return _best_indices(table, budget, limit_primary, solver)
+
+
+class SolverJob:
+    """プロセスプールに投入した探索1件。"""
+
+    def __init__(self, executor: "SolverExecutor", pool: Any, future: Any, items: Sequence[Any]) -> None:
+        self._executor = executor
+        self._pool = pool
+        self._future = future
+        self._items = items
+
+    def result(self, timeout: Optional[float] = None) -> Tuple[int, List[Any]]:
+        """結果を待って返す。`timeout` 秒を超えたらジョブを取り消して `SolverTimeout` を送出する。"""
+
+        from concurrent.futures import TimeoutError as FutureTimeoutError
+        from concurrent.futures.process import BrokenProcessPool
+
+        try:
+            total, indices = self._future.result(timeout)
+        except FutureTimeoutError:
+            self.cancel()
+            self._executor._count("timeouts")
+            raise SolverTimeout(f"組み合わせの計算が{timeout:g}秒以内に終わりませんでした。") from None
+        except BrokenProcessPool:
+            raise SolverUnavailable("組み合わせを計算するプロセスが終了しました。") from None
+        return total, [self._items[index] for index in indices]
+
+    def cancel(self) -> bool:
+        """ジョブを取り消す。実行中の場合はプールを退役させ、以降の投入は新しいプールへ回す。"""
+
+        if self._future.cancel():
+            return True
+        if self._future.done():
+            return False
+        self._executor._abandon(self._pool, self._future)
+        return True
+
+
+class SolverExecutor:
+    """`best_combination` を上限付きのプロセスプールで実行する。
+
+    GILを握ったままの探索でリクエスト処理のスレッドが止まらないよう、大きな問題は別プロセスへ回す。
+    品目数×予算 (制約付きは状態数倍) が `inline_cells` 以下の問題は、プロセス間の受け渡しの方が
+    高くつくため呼び出し元のスレッドで解く。プールへ送るのは価格と分類ビットの配列のみ。
+    未完了のジョブが `max_queue` 件に達している間は `SolverBusy` を送出する。
+
+    実行中のジョブがタイムアウトした場合、そのプールは退役させて新しいジョブを新しいプールへ回し、
+    退役したプールのワーカーは他の実行中のジョブがすべて終わってから終了させる (同じプールの他のジョブを
+    巻き添えで失敗させないため)。`concurrent.futures` には実行中のワーカーを止める公開APIがないので、
+    終了には `ProcessPoolExecutor._processes` を使う。属性がなければ `shutdown` のみ行い、
+    取り残された探索は完了するまで走り続ける。
+    """
+
+    def __init__(
+        self,
+        workers: int = 2,
+        *,
+        max_queue: int = 8,
+        inline_cells: int = 200_000,
+        timeout: Optional[float] = 10.0,
+    ) -> None:
+        self.workers = workers
+        self.max_queue = max_queue
+        self.inline_cells = inline_cells
+        self.timeout = timeout
+        self._pool: Any = None
+        # プールごとの、結果を待っている (タイムアウトで見放されていない) 未完了のジョブ
+        self._live: dict[Any, set[Any]] = {}
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._counts = {"inline": 0, "offloaded": 0, "rejected": 0, "timeouts": 0, "restarts": 0}
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counts[name] += 1
+
+    def _cells(self, items: Sequence[Any], budget: int, limit_primary: bool) -> int:
+        return len(items) * budget * (len(_REACHABLE_STATES) if limit_primary else 1)
+
+    def _ensure_pool(self) -> Any:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        if self._pid != os.getpid():
+            # fork後の子プロセスでは親のプールを使えないため作り直す
+            self._pool = None
+            self._live = {}
+            self._pending = 0
+            self._pid = os.getpid()
+        if self._pool is None:
+            # スレッドを持つWebワーカーからforkしないよう、forkserver (なければspawn) で起動する
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context(method))
+            self._live[self._pool] = set()
+        return self._pool
+
+    @staticmethod
+    def _terminate(pool: Any) -> None:
+        # 先にワーカーを終了させると、プールが未完了のジョブをすべてBrokenProcessPoolで完了させる
+        for process in list((getattr(pool, "_processes", None) or {}).values()):
+            process.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _retire(self, pool: Any) -> bool:
+        """`pool` を新しい投入先から外す。他に待たれているジョブがなければTrue (すぐに終了してよい)。
+
+        `self._lock` を保持して呼ぶ。
+        """
+
+        if self._pool is pool:
+            self._pool = None
+            self._counts["restarts"] += 1
+        live = self._live.get(pool)
+        if live:
+            return False
+        self._live.pop(pool, None)
+        return True
+
+    def _discard_pool(self, pool: Any) -> None:
+        with self._lock:
+            self._live[pool] = set()
+            self._retire(pool)
+        self._terminate(pool)
+
+    def _abandon(self, pool: Any, future: Any) -> None:
+        with self._lock:
+            self._live.get(pool, set()).discard(future)
+            finished = self._retire(pool)
+        if finished:
+            self._terminate(pool)
+
+    def _job_done(self, pool: Any, future: Any) -> None:
+        with self._lock:
+            self._pending -= 1
+            live = self._live.get(pool)
+            if live is None or future not in live:
+                return
+            live.discard(future)
+            # 退役済みのプールで最後に待たれていたジョブが終われば、残った (タイムアウトした) 探索ごと終了する
+            finished = self._pool is not pool and self._retire(pool)
+        if finished:
+            self._terminate(pool)
+
+    def submit(
+        self,
+        items: Sequence[MenuItem],
+        budget: int,
+        limit_primary: bool = False,
+        *,
+        solver: str = "auto",
+    ) -> SolverJob:
+        """探索をプロセスプールへ投入する。待ち行列が満杯なら `SolverBusy` を送出する。"""
+
+        table = MenuTable.from_items(items)
+        with self._lock:
+            if self._pending >= self.max_queue:
+                self._counts["rejected"] += 1
+                raise SolverBusy("混雑しているため組み合わせを計算できませんでした。しばらくしてから再度お試しください。")
+            pool = self._ensure_pool()
+            self._pending += 1
+            self._counts["offloaded"] += 1
+        try:
+            future = pool.submit(
+                _solve_compact, table.prices.tobytes(), table.flags.tobytes(), budget, limit_primary, solver
+            )
+        except BaseException:
+            with self._lock:
+                self._pending -= 1
+            self._discard_pool(pool)
+            raise
+        with self._lock:
+            self._live.setdefault(pool, set()).add(future)
+        future.add_done_callback(lambda done: self._job_done(pool, done))
+        return SolverJob(self, pool, future, items)
+
+    def best_combination(
+        self,
+        items: Sequence[MenuItem],
+        budget: int,
+        limit_primary: bool = False,
+        *,
+        solver: str = "auto",
+    ) -> Tuple[int, List[Any]]:
+        """`best_combination` と同じ結果を返す。大きな問題はプロセスプールで解く。"""
+
+        _check_solver(budget, solver)
+        if not items:
+            return 0, []
+        if self.workers <= 0 or self._cells(items, budget, limit_primary) <= self.inline_cells:
+            self._count("inline")
+            return best_combination(items, budget, limit_primary, solver=solver)
+        return self.submit(items, budget, limit_primary, solver=solver).result(self.timeout)
+
+    def stats(self) -> dict[str, int]:
+        """インライン実行数・プール投入数・拒否数・タイムアウト数・プール再作成数・未完了数を返す。"""
+
+        with self._lock:
+            return {**self._counts, "pending": self._pending}
+
+    def close(self) -> None:
+        """プロセスプールを終了する。"""
+
+        with self._lock:
+            pool, self._pool = self._pool, None
+            retired = [other for other in self._live if other is not pool]
+            self._live = {}
+        if self._pid != os.getpid():
+            return
+        for other in retired:
+            self._terminate(other)
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+_solver_executor: Optional[SolverExecutor] = None
+_solver_executor_lock = threading.Lock()
+
+
+def get_solver_executor() -> SolverExecutor:
+    """プロセス共通のソルバー実行器を返す。設定は環境変数 `MEAL_SOLVER_*` で行う。"""
+
+    global _solver_executor
+    with _solver_executor_lock:
+        if _solver_executor is None:
+            timeout = float(os.environ.get("MEAL_SOLVER_TIMEOUT", "10"))
+            _solver_executor = SolverExecutor(
+                int(os.environ.get("MEAL_SOLVER_WORKERS", "2")),
+                max_queue=int(os.environ.get("MEAL_SOLVER_MAX_QUEUE", "8")),
+                inline_cells=int(os.environ.get("MEAL_SOLVER_INLINE_CELLS", "200000")),
+                timeout=timeout if timeout > 0 else None,
+            )
+            atexit.register(_solver_executor.close)
+        return _solver_executor
+
+
+def parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
+    """コマンドライン引数を解析する。"""
+
+    parser = argparse.ArgumentParser(description="指定予算で最適なメニュー組み合わせを検索します。")
+    parser.add_argument("budget", type=int, help="最大予算（円）")
+    parser.add_argument(
+        "--url",
+        default=MENU_URL,
+        help="メニューを取得するURL。デフォルトは指定の学食メニューです。",
+    )
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        help="結果をJSON形式で出力します。",
+    )
+    parser.add_argument(
+        "--limit-primary",
+        action="store_true",
+        help="主菜・麺類・丼・カレー・オーダー・ケバブ&ベジタリアンカテゴリからは1品のみ選択します。",
+    )
+    parser.add_argument(
+        "--no-playwright",
+        action="store_true",
+        help="Playwrightを使用せず、静的HTMLとAJAX断片のみでメニューを取得します。",
+    )
+    parser.add_argument(
+        "--solver",
+        choices=SOLVERS,
+        default="auto",
+        help="制約なし探索のエンジン。auto はNumPyがあれば使用します。",
+    )
+    parser.add_argument(
+        "--frontier",
+        action="store_true",
+        help="0円から予算までの全予算について、最適合計が変わる金額ごとの組み合わせを出力します。",
+    )
+    parser.add_argument(
+        "--no-intercept",
+        action="store_true",
+        help="AJAX断片をブラウザ内で捕捉せず、カテゴリを1つずつクリックして展開します。",
+    )
+    parser.add_argument(
+        "--timings",
+        action="store_true",
+        help="ページ取得・断片取得・解析・探索などフェーズごとの処理時間を出力します。",
+    )
+    parser.add_argument(
+        "--replay",
+        metavar="DIR",
+        help="記録済みのメニュー (menu_replay.py record で保存) をローカルサーバーで再生し、そこから取得します。",
+    )
+    parser.add_argument(
+        "--replay-latency",
+        type=float,
+        default=0.0,
+        metavar="SEC",
+        help="--replay のサーバーが各応答に加える遅延 (秒)",
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="",
+        metavar="PATH",
+        help="処理全体をプロファイルして結果をファイルに書き出します (デフォルト: meal_calculator.pstats / .collapsed)。",
+    )
+    parser.add_argument(
+        "--profiler",
+        choices=PROFILERS,
+        default="cprofile",
+        help="cprofile はpstats形式、sample は全スレッドのスタックを採取したcollapsed形式 (flamegraph用) で出力します。",
+    )
+    return parser.parse_args(argv)
+
+
+def format_result(total: int, items: Sequence[MenuItem]) -> str:
+    """組み合わせ結果を人間が読みやすい形式に整形する。"""
+
+    lines = [f"最適合計: {total}円 (品数: {len(items)})"]
+    for item in items:
+        label = f" ({item.category})" if item.category else ""
+        lines.append(f"- {item.name}{label}: {item.price}円")
+    return "\n".join(lines)
+
+
+def format_frontier(frontier: BudgetFrontier) -> str:
+    """予算ごとの最適解の階段関数を、最適合計が変わる金額ごとに整形する。"""
+
+    lines = [f"予算ごとの最適解: 0〜{frontier.max_budget}円 ({len(frontier)}段)"]
+    for total, items in frontier.steps():
+        names = " / ".join(item.name for item in items) or "(なし)"
+        lines.append(f"- {total}円〜: {names} ({len(items)}品)")
+    return "\n".join(lines)
+
+
+def format_menu_items(items: Sequence[MenuItem]) -> str:
+    """取得したメニュー全件を表示用に整形する。"""
+
+    lines = [f"取得メニュー一覧: {len(items)}件"]
+    for item in items:
+        label = f" ({item.category})" if item.category else ""
+        lines.append(f"- {item.name}{label}: {item.price}円")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    """コマンドラインツールのエントリポイント。"""
+
+    args = parse_args(argv)
+    if args.profile is None:
+        return _run_timed(args)
+    profiler = Profiler(args.profiler, all_threads=True)
+    with profiler:
+        code = _run_timed(args)
+    path = profiler.write(args.profile or f"meal_calculator{profiler.suffix}")
+    print(f"プロファイルを書き出しました: {path}", file=sys.stderr)
+    print(profiler.summary(), file=sys.stderr)
+    return code
+
+
+def _run_timed(args: argparse.Namespace) -> int:
+    if not args.timings:
+        return _run(args, None)
+    with record_timings() as timings:
+        return _run(args, timings)
+
+
+def _run(args: argparse.Namespace, timings: Optional[Timings]) -> int:
+    use_playwright = not args.no_playwright
+    with contextlib.ExitStack() as stack:
+        url = args.url
+        if args.replay:
+            from menu_replay import ReplayServer, load_corpus
+
+            server = stack.enter_context(ReplayServer(load_corpus(args.replay), latency=args.replay_latency))
+            url = server.url_for(url)
+        items = fetch_menu(url, use_playwright=use_playwright, intercept=not args.no_intercept)
+    if args.frontier:
+        with timed("frontier"):
+            frontier = budget_frontier(items, args.budget, limit_primary=args.limit_primary, solver=args.solver)
+        if args.json:
+            payload = {"frontier": frontier, "url": args.url, "use_playwright": use_playwright}
+            if timings is not None:
+                payload["timings"] = timings.to_dict()
+            print(json.dumps(payload, ensure_ascii=False, indent=2, cls=MenuJSONEncoder))
+        else:
+            print(format_frontier(frontier))
+            if timings is not None:
+                print()
+                print(timings.format())
+        return 0
+    with timed("solve"):
+        total, combo = best_combination(items, args.budget, limit_primary=args.limit_primary, solver=args.solver)
 
     if args.json:
         payload = {
             "total": total,
-            "items": [dataclasses.asdict(item) for item in combo],
-            "menu_items": [dataclasses.asdict(item) for item in items],
+            "items": combo,
+            "menu_items": items,
             "budget": args.budget,
             "url": args.url,
             "limit_primary": args.limit_primary,
             "use_playwright": use_playwright,
         }
-        print(json.dumps(payload, ensure_ascii=False, indent=2))
+        if timings is not None:
+            payload["timings"] = timings.to_dict()
+        print(json.dumps(payload, ensure_ascii=False, indent=2, cls=MenuJSONEncoder))
     else:
         print(format_menu_items(items))
         print()
         print(format_result(total, combo))
+        if timings is not None:
+            print()
+            print(timings.format())
     return 0
 
 
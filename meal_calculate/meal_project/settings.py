@@ -102,3 +102,60 @@ STATIC_ROOT = Path(static_root_env) if static_root_env else BASE_DIR / "staticfi
 
 # デフォルトの自動フィールド型
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+# メニュースナップショットキャッシュ (BACKEND: locmem / django / file / database / ドット区切りのクラスパス)
+MENU_SNAPSHOT_CACHE = {
+    "BACKEND": os.environ.get("MENU_CACHE_BACKEND", "locmem"),
+    "TTL": int(os.environ.get("MENU_CACHE_TTL", "900")),
+    # TTL切れからこの秒数までは古いメニューを返しつつ裏で取得し直す (0で無効)
+    "MAX_STALE": int(os.environ.get("MENU_CACHE_MAX_STALE", "3600")),
+    # 取得時にこの金額までの全予算の最適解を求めてスナップショットと共に保存する (0で無効)
+    "FRONTIER_MAX_BUDGET": int(os.environ.get("MENU_FRONTIER_MAX_BUDGET", "3000")),
+    # (メニューの内容, 予算, 制約) ごとの計算結果を保持する件数 (0で無効)
+    "RESULT_CACHE_SIZE": int(os.environ.get("MENU_RESULT_CACHE_SIZE", "1024")),
+    # ファイル保存のバックエンドの保存先 (他のバックエンドでは無視される)
+    "DIRECTORY": os.environ.get("MENU_CACHE_DIR"),
+    "OPTIONS": {},
+}
+
+# メニューの取得先のオリジン (例: menu_replay.py serve で起動した http://127.0.0.1:8765)。未指定なら west2-univ.jp
+MEAL_MENU_ORIGIN = os.environ.get("MEAL_MENU_ORIGIN") or None
+
+# トップページにasync版のビューを使う (uvicornなどASGIサーバーで動かす場合に有効化する)
+MEAL_ASYNC_VIEWS = os.environ.get("MEAL_ASYNC_VIEWS", "0") == "1"
+
+# フェーズごとの処理時間を Server-Timing ヘッダーで返す (取得先URLなどの詳細はスタッフのみ) /
+# JSONレスポンスの timings に含める
+MEAL_SERVER_TIMING = os.environ.get("MEAL_SERVER_TIMING", "0") == "1"
+MEAL_TIMINGS_IN_PAYLOAD = os.environ.get("MEAL_TIMINGS_IN_PAYLOAD", "0") == "1"
+
+# スタッフユーザーが X-Meal-Profile ヘッダー / ?profile= でトップページの1リクエストをプロファイルできるようにする
+MEAL_PROFILING_ENABLED = os.environ.get("MEAL_PROFILING_ENABLED", "0") == "1"
+# プロファイル結果をレスポンスとは別に保存するディレクトリ
+MEAL_PROFILE_DIR = os.environ.get("MEAL_PROFILE_DIR")
+
+# /metrics でPrometheus形式のメトリクスを公開する。トークンを指定すると
+# `Authorization: Bearer <トークン>` を付けたリクエストにだけ返す
+MEAL_METRICS_ENABLED = os.environ.get("MEAL_METRICS_ENABLED", "0") == "1"
+MEAL_METRICS_TOKEN = os.environ.get("MEAL_METRICS_TOKEN") or None
+
+# フェーズごとの処理時間をリクエストごとに1行のJSONでログ出力する (calculator.timings ロガー)
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {"message": {"format": "%(message)s"}},
+    "handlers": {"timings": {"class": "logging.StreamHandler", "formatter": "message"}},
+    "loggers": {
+        "calculator.timings": {
+            "handlers": ["timings"],
+            "level": os.environ.get("MEAL_TIMINGS_LOG_LEVEL", "INFO"),
+            "propagate": False,
+        },
+    },
+}
+
+# メニュー取得のワーカー間ロック (BACKEND: none / file / database)
+MENU_FETCH_LOCK = {
+    "BACKEND": os.environ.get("MENU_FETCH_LOCK", "none"),
+    "DIRECTORY": os.environ.get("MENU_FETCH_LOCK_DIR"),
+}
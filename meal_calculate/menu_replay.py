@@ -0,0 +1,307 @@
+"""メニューページとAJAX断片を記録し、west2-univ.jp の代わりにローカルで再生するユーティリティ。
+
+記録 (コーパス) は `<保存先>/<記録日時>/` に本文のファイルと `manifest.json` を置く形式で、
+記録するたびに新しい版のディレクトリが増える。再生サーバーは記録したURLのパスとクエリで応答を返し、
+応答ごとに遅延を加えられる。
+
+使い方:
+    python menu_replay.py record https://west2-univ.jp/sp/menu.php?t=650111 [--out DIR]
+    python menu_replay.py serve [DIR] --port 8765 --latency 0.05 --jitter 0.02
+"""
+from __future__ import annotations
+
+import argparse
+import dataclasses
+import hashlib
+import http.server
+import json
+import random
+import re
+import sys
+import threading
+import time
+import urllib.parse
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from meal_calculator import _download_with_urllib, _fetch_fragments, _fragment_urls
+
+
+CORPUS_FORMAT = 1
+MANIFEST_NAME = "manifest.json"
+DEFAULT_CORPUS_DIR = Path(__file__).resolve().parent / "benchmarks" / "corpus"
+
+
+def corpus_key(url: str) -> str:
+    """URLからホストを除き、クエリの順序を揃えた照合用のキーを返す。"""
+
+    parts = urllib.parse.urlsplit(url)
+    query = urllib.parse.urlencode(sorted(urllib.parse.parse_qsl(parts.query, keep_blank_values=True)))
+    path = parts.path or "/"
+    return f"{path}?{query}" if query else path
+
+
+def rebase_url(url: str, origin: str) -> str:
+    """URLのスキームとホストを `origin` (例: `http://127.0.0.1:8765`) に置き換える。"""
+
+    base = urllib.parse.urlsplit(origin)
+    return urllib.parse.urlunsplit(urllib.parse.urlsplit(url)._replace(scheme=base.scheme, netloc=base.netloc))
+
+
+def _file_name(key: str) -> str:
+    stem = re.sub(r"[^A-Za-z0-9._-]+", "_", key.lstrip("/"))[:80]
+    return f"{stem}-{hashlib.sha1(key.encode('utf-8')).hexdigest()[:8]}.html"
+
+
+@dataclasses.dataclass(frozen=True)
+class CorpusEntry:
+    """記録した応答1件。`kind` はメインページなら "page"、断片なら "fragment"。"""
+
+    key: str
+    url: str
+    kind: str
+    body: bytes
+    content_type: str = "text/html; charset=utf-8"
+
+    @property
+    def etag(self) -> str:
+        return '"' + hashlib.sha256(self.body).hexdigest()[:16] + '"'
+
+
+class MenuCorpus:
+    """記録済みの応答を照合用のキーで引けるようにまとめたもの。"""
+
+    def __init__(self, entries: Iterable[CorpusEntry], *, directory: Optional[Path] = None, recorded_at: str = "") -> None:
+        self.entries: Dict[str, CorpusEntry] = {entry.key: entry for entry in entries}
+        self.directory = directory
+        self.recorded_at = recorded_at
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, url: str) -> Optional[CorpusEntry]:
+        """URL (またはパスとクエリ) に対応する記録を返す。"""
+
+        return self.entries.get(corpus_key(url))
+
+    def page_urls(self) -> List[str]:
+        """記録したメインページの元のURL。"""
+
+        return sorted(entry.url for entry in self.entries.values() if entry.kind == "page")
+
+    def pages(self) -> List[tuple[str, str, List[tuple[str, str]]]]:
+        """(元のURL, メインページ本文, [(断片URL, 本文), ...]) の一覧を返す。解析の計測などに使う。"""
+
+        result = []
+        for url in self.page_urls():
+            page = self.entries[corpus_key(url)].body.decode("utf-8")
+            fragments = []
+            for fragment_url in _fragment_urls(page, url):
+                entry = self.get(fragment_url)
+                if entry is not None:
+                    fragments.append((fragment_url, entry.body.decode("utf-8")))
+            result.append((url, page, fragments))
+        return result
+
+
+def resolve_corpus(path: Path | str = DEFAULT_CORPUS_DIR) -> Path:
+    """コーパスの版ディレクトリを返す。保存先を指定した場合は最新の版を選ぶ。"""
+
+    path = Path(path)
+    if (path / MANIFEST_NAME).exists():
+        return path
+    versions = sorted(child for child in path.glob("*") if (child / MANIFEST_NAME).exists()) if path.is_dir() else []
+    if not versions:
+        raise SystemExit(f"記録済みのメニューが見つかりません: {path}")
+    return versions[-1]
+
+
+def load_corpus(path: Path | str = DEFAULT_CORPUS_DIR) -> MenuCorpus:
+    """`resolve_corpus` で選んだ版を読み込む。"""
+
+    directory = resolve_corpus(path)
+    manifest = json.loads((directory / MANIFEST_NAME).read_text(encoding="utf-8"))
+    if manifest.get("format") != CORPUS_FORMAT:
+        raise SystemExit(f"対応していない記録形式です (format={manifest.get('format')}): {directory}")
+    entries = [
+        CorpusEntry(
+            key=corpus_key(record["url"]),
+            url=record["url"],
+            kind=record["kind"],
+            body=(directory / record["file"]).read_bytes(),
+            content_type=record.get("content_type", "text/html; charset=utf-8"),
+        )
+        for record in manifest["entries"]
+    ]
+    return MenuCorpus(entries, directory=directory, recorded_at=manifest.get("recorded_at", ""))
+
+
+def record_corpus(urls: Sequence[str], root: Path | str = DEFAULT_CORPUS_DIR, *, version: Optional[str] = None) -> Path:
+    """各メインページと、そこから呼ばれる全 `menu_load.php` 断片を取得して新しい版として保存する。
+
+    断片は `fetch_menu` と同じく並行に取得し、再試行しても取得できなかったものは `manifest.json` の
+    `missing` に残す。メインページを取得できなければSystemExit。
+    """
+
+    directory = Path(root) / (version or time.strftime("%Y%m%d-%H%M%S"))
+    directory.mkdir(parents=True, exist_ok=False)
+    records: List[dict[str, Any]] = []
+    missing: List[str] = []
+
+    def store(url: str, kind: str, text: str) -> None:
+        name = _file_name(corpus_key(url))
+        (directory / name).write_bytes(text.encode("utf-8"))
+        records.append({"url": url, "kind": kind, "file": name, "content_type": "text/html; charset=utf-8"})
+
+    for url in urls:
+        page = _download_with_urllib(url)
+        store(url, "page", page.text)
+        fragment_urls = _fragment_urls(page.text, page.url)
+        for fragment_url, result in zip(fragment_urls, _fetch_fragments(fragment_urls)):
+            if result is None:
+                missing.append(fragment_url)
+            else:
+                store(fragment_url, "fragment", result.text)
+
+    manifest = {
+        "format": CORPUS_FORMAT,
+        "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "entries": records,
+        "missing": missing,
+    }
+    (directory / MANIFEST_NAME).write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8")
+    return directory
+
+
+class _ReplayHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "_ReplayHTTPServer"
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        replay = self.server.replay
+        replay.delay()
+        entry = replay.corpus.get(self.path)
+        if entry is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if self.headers.get("If-None-Match") == entry.etag:
+            self.send_response(304)
+            self.send_header("ETag", entry.etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", entry.content_type)
+        self.send_header("Content-Length", str(len(entry.body)))
+        self.send_header("ETag", entry.etag)
+        self.end_headers()
+        self.wfile.write(entry.body)
+
+
+class _ReplayHTTPServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    replay: "ReplayServer"
+
+
+class ReplayServer:
+    """コーパスをHTTPで返すローカルサーバー。
+
+    各応答の前に `latency` 秒と 0〜`jitter` 秒のランダムな遅延を加える。
+    ETagを返し、`If-None-Match` が一致すれば304を返す。
+    """
+
+    def __init__(
+        self,
+        corpus: MenuCorpus,
+        *,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+    ) -> None:
+        self.corpus = corpus
+        self.latency = latency
+        self.jitter = jitter
+        self._httpd = _ReplayHTTPServer((host, port), _ReplayHandler)
+        self._httpd.replay = self
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def origin(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def url_for(self, url: str) -> str:
+        """記録元のURLを、このサーバー上の同じパスのURLに置き換える。"""
+
+        return rebase_url(url, self.origin)
+
+    def delay(self) -> None:
+        seconds = self.latency + (random.uniform(0, self.jitter) if self.jitter > 0 else 0.0)
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def start(self) -> "ReplayServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="menu-replay", daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self) -> None:
+        self._httpd.serve_forever()
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self) -> "ReplayServer":
+        return self.start()
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.stop()
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="メニューページの記録と、記録したページを返すローカルサーバーの起動を行います。")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    record = commands.add_parser("record", help="メニューページと全AJAX断片を取得して新しい版として保存します。")
+    record.add_argument("urls", nargs="+", metavar="URL", help="記録するメニューページのURL")
+    record.add_argument("--out", default=str(DEFAULT_CORPUS_DIR), help="保存先 (デフォルト: benchmarks/corpus)")
+    record.add_argument("--label", help="版ディレクトリの名前 (デフォルト: 記録日時)")
+
+    serve = commands.add_parser("serve", help="記録したページをHTTPで返します。")
+    serve.add_argument("corpus", nargs="?", default=str(DEFAULT_CORPUS_DIR), help="保存先または版ディレクトリ")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8765)
+    serve.add_argument("--latency", type=float, default=0.0, help="各応答に加える遅延 (秒)")
+    serve.add_argument("--jitter", type=float, default=0.0, help="さらに 0〜指定秒のランダムな遅延を加えます")
+
+    args = parser.parse_args(argv)
+    if args.command == "record":
+        directory = record_corpus(args.urls, args.out, version=args.label)
+        manifest = json.loads((directory / MANIFEST_NAME).read_text(encoding="utf-8"))
+        print(f"{len(manifest['entries'])}件を記録しました: {directory}")
+        if manifest["missing"]:
+            print(f"取得できなかった断片: {len(manifest['missing'])}件", file=sys.stderr)
+        return 0
+
+    corpus = load_corpus(args.corpus)
+    server = ReplayServer(corpus, host=args.host, port=args.port, latency=args.latency, jitter=args.jitter)
+    print(f"{corpus.directory} ({len(corpus)}件) を {server.origin} で再生します", file=sys.stderr)
+    for url in corpus.page_urls():
+        print(f"  {server.url_for(url)}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())